@@ -0,0 +1,301 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Benchmark harness for the data product service.
+
+For each catalog size a synthetic data product directory is
+generated (see catalog.py), and the following are measured:
+- SimpleMetadata.load() time, peak and retained memory
+- endpoint throughput and latency percentiles, using an
+  in-process ASGI client (no network)
+
+Results are written as JSON and can be compared against a
+stored baseline to catch regressions.
+"""
+
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src"))
+
+import httpx
+
+import catalog
+import constants
+import state
+import server
+from simplemetadata import SimpleMetadata
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "10,100,1000,10000"
+DEFAULT_REQUESTS = 200
+DEFAULT_MAX_SECONDS = 10.0
+DEFAULT_LOAD_REPEATS = 3
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "osc-dm-bench")
+MIN_REQUESTS = 5
+BENCH_USERNAME = "osc-dm-bench"
+BENCH_CORRELATION_ID = "osc-dm-bench"
+WARMUP_REQUESTS = 3
+
+# Metrics compared against the baseline, and whether
+# a higher value is better (True) or worse (False)
+COMPARED_METRICS = {
+    "seconds": False,
+    "retained_bytes": False,
+    "throughput_rps": True,
+    "p99_ms": False,
+}
+
+
+#####
+# CATALOGS
+#####
+
+
+def catalog_directory(workdir: str, size: int) -> str:
+    """
+    Return a synthetic catalog of the given size, generating
+    it only if it does not already exist
+    """
+    directory = os.path.join(workdir, f"catalog-{size}")
+    artifacts_dir = os.path.join(directory, "artifacts")
+    if not os.path.isdir(artifacts_dir) or len(os.listdir(artifacts_dir)) != size:
+        catalog.generate(directory, size)
+    return directory
+
+
+#####
+# LOAD
+#####
+
+
+def bench_load(directory: str, repeats: int) -> Dict:
+    """
+    Measure SimpleMetadata.load() time (best of repeats)
+    and memory (peak and retained by the loaded metadata)
+    """
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        metadata = SimpleMetadata(directory=directory)
+        metadata.load()
+        timings.append(time.perf_counter() - start)
+        del metadata
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    metadata = SimpleMetadata(directory=directory)
+    metadata.load()
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    artifacts = len(list(metadata.artifacts()))
+    retained = after - before
+    return {
+        "artifacts": artifacts,
+        "seconds": round(min(timings), 6),
+        "peak_bytes": peak - before,
+        "retained_bytes": retained,
+        "bytes_per_artifact": round(retained / artifacts) if artifacts else 0,
+    }
+
+
+#####
+# ENDPOINTS
+#####
+
+
+def endpoints(metadata: SimpleMetadata) -> Dict[str, Callable[[], str]]:
+    """
+    Return endpoint name -> function returning the next path to request
+    """
+    prefix = f"{server.ENDPOINT_PREFIX}/uuid/{metadata.product().uuid}"
+    artifact_uuids = [artifact.uuid for artifact in metadata.artifacts()]
+    rnd = random.Random(0)
+    return {
+        "health": lambda: f"{prefix}/health",
+        "product": lambda: prefix,
+        "artifacts": lambda: f"{prefix}/artifacts",
+        "artifact": lambda: f"{prefix}/artifacts/{rnd.choice(artifact_uuids)}",
+    }
+
+
+async def bench_endpoint(client: httpx.AsyncClient, next_path: Callable[[], str],
+                         requests: int, max_seconds: float) -> Dict:
+    """
+    Issue sequential requests until the request count or time
+    budget is exhausted; return throughput and latency percentiles
+    """
+    for _ in range(WARMUP_REQUESTS):
+        response = await client.get(next_path())
+        response.raise_for_status()
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    while len(latencies) < requests:
+        path = next_path()
+        request_start = time.perf_counter()
+        response = await client.get(path)
+        latencies.append(time.perf_counter() - request_start)
+        response.raise_for_status()
+        if time.perf_counter() - start > max_seconds and len(latencies) >= MIN_REQUESTS:
+            break
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "response_bytes": len(response.content),
+    }
+
+
+async def bench_endpoints(directory: str, requests: int, max_seconds: float) -> Dict:
+    metadata = SimpleMetadata(directory=directory)
+    metadata.load()
+    state.gstate(server.STATE_METADATA, metadata)
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    headers = {
+        constants.HEADER_USERNAME: BENCH_USERNAME,
+        constants.HEADER_CORRELATION_ID: BENCH_CORRELATION_ID,
+    }
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+        for name, next_path in endpoints(metadata).items():
+            results[name] = await bench_endpoint(client, next_path, requests, max_seconds)
+            logger.info(f"Endpoint:{name} results:{results[name]}")
+    return results
+
+
+def _percentile(values: List[float], p: float) -> float:
+    index = min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+#####
+# BASELINE
+#####
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Return a description of each metric that regressed by more
+    than tolerance (a fraction) relative to the baseline
+    """
+    regressions = []
+    for size, current in results["results"].items():
+        previous = baseline["results"].get(size)
+        if previous is None:
+            continue
+        sections = [("load", current["load"], previous["load"])]
+        for name, endpoint in current["endpoints"].items():
+            if name in previous["endpoints"]:
+                sections.append((f"endpoints.{name}", endpoint, previous["endpoints"][name]))
+        for section, now, before in sections:
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                if metric not in now or not before.get(metric):
+                    continue
+                change = (now[metric] - before[metric]) / before[metric]
+                if higher_is_better:
+                    change = -change
+                if change > tolerance:
+                    regressions.append(
+                        f"size:{size} {section}.{metric} "
+                        f"baseline:{before[metric]} current:{now[metric]} "
+                        f"({change:+.0%} worse)")
+    return regressions
+
+
+#####
+# MAINLINE
+#####
+
+
+def run(sizes: List[int], workdir: str, requests: int, max_seconds: float,
+        load_repeats: int) -> Dict:
+    results = {}
+    for size in sizes:
+        directory = catalog_directory(workdir, size)
+        logger.info(f"Benchmarking size:{size} directory:{directory}")
+        load = bench_load(directory, load_repeats)
+        logger.info(f"Load results:{load}")
+        endpoint_results = asyncio.run(bench_endpoints(directory, requests, max_seconds))
+        results[str(size)] = {
+            "load": load,
+            "endpoints": endpoint_results,
+        }
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the data product service.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma separated artifact counts (default: {DEFAULT_SIZES})")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help=f"Directory for generated catalogs (default: {DEFAULT_WORKDIR})")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help=f"Requests per endpoint (default: {DEFAULT_REQUESTS})")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS, help=f"Time budget per endpoint (default: {DEFAULT_MAX_SECONDS})")
+    parser.add_argument("--load-repeats", type=int, default=DEFAULT_LOAD_REPEATS, help=f"Timed loads per size (default: {DEFAULT_LOAD_REPEATS})")
+    parser.add_argument("--output", default=None, help="File to write JSON results to (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Baseline results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help=f"Allowed regression as a fraction (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--verbose", action="store_true", help="Keep service INFO logging enabled")
+    args = parser.parse_args()
+
+    # Service logging (every request and response is logged at
+    # INFO) would dominate the measurements, so it is disabled
+    # unless explicitly requested
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.workdir, args.requests, args.max_seconds, args.load_repeats)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
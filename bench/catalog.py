@@ -0,0 +1,134 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Synthetic data product catalog generator.
+
+Creates a data product directory with the same layout as
+"dataproducts" (product.yaml, uuids.yaml, artifacts/*.yaml and
+the placeholder sample and metadata files), with any number of
+artifacts.
+"""
+
+import logging
+import os
+import random
+import shutil
+import uuid
+
+import yaml
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+TAGS = [
+    "utilities", "emissions", "finance", "operations", "assets",
+    "earnings", "investments", "customers", "sales", "targets",
+    "employees", "expenditure", "housing", "income", "plant",
+    "fuel", "technology", "revenue", "policy", "dispatch",
+]
+LICENSES = [
+    "CDLA 2.0, Permissive, Version 2.0",
+    "CC BY 4.0",
+    "Apache 2.0",
+]
+SECURITY_POLICIES = ["public", "restricted", "private"]
+WORDS = [
+    "detailed", "breakdown", "of", "utility", "assets", "in", "electric",
+    "rate", "base", "earnings", "on", "these", "and", "annual", "capital",
+    "additions", "by", "technology", "state", "year", "emissions", "sales",
+]
+
+PLACEHOLDER_SAMPLE = "placeholder-sample.csv"
+PLACEHOLDER_METADATA = "placeholder-metadata.json"
+
+
+def generate(directory: str, artifacts: int, seed: int = 0):
+    """
+    Generate a data product directory with the given number of artifacts
+    (any existing directory is replaced)
+    """
+    logger.info(f"Generating catalog directory:{directory} artifacts:{artifacts}")
+    rnd = random.Random(seed)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    artifacts_dir = os.path.join(directory, "artifacts")
+    os.makedirs(artifacts_dir)
+
+    product = {
+        "product": {
+            "namespace": "bench.brodagroupsoftware.com",
+            "name": f"bench.dataproduct.{artifacts}",
+            "description": f"Synthetic data product with {artifacts} artifacts",
+            "tags": ["bench", "synthetic"],
+            "publisher": "publisher.user@brodagroupsoftware.com",
+        }
+    }
+    _write_yaml(os.path.join(directory, "product.yaml"), product)
+
+    artifact_uuids = []
+    width = max(3, len(str(artifacts)))
+    for i in range(artifacts):
+        name = f"Artifact {i:0{width}d}"
+        artifact_uuids.append({name: str(uuid.UUID(int=rnd.getrandbits(128), version=4))})
+        artifact = {
+            "artifact": {
+                "name": name,
+                "description": " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(8, 30))),
+                "tags": rnd.sample(TAGS, rnd.randint(1, 4)),
+                "license": rnd.choice(LICENSES),
+                "securitypolicy": rnd.choice(SECURITY_POLICIES),
+                "links": [
+                    {
+                        "relationship": "artifact",
+                        "mimetype": "text/csv",
+                        "url": f"https://example.com/bench/artifact-{i}.csv",
+                    },
+                    {
+                        "relationship": "sample",
+                        "mimetype": "text/csv",
+                        "url": PLACEHOLDER_SAMPLE,
+                    },
+                    {
+                        "relationship": "metadata",
+                        "mimetype": "application/json",
+                        "url": PLACEHOLDER_METADATA,
+                    },
+                ],
+            }
+        }
+        _write_yaml(os.path.join(artifacts_dir, f"artifacts-{i:0{width}d}.yaml"), artifact)
+
+    uuids = {
+        "product_uuid": str(uuid.UUID(int=rnd.getrandbits(128), version=4)),
+        "artifact_uuids": artifact_uuids,
+    }
+    _write_yaml(os.path.join(directory, "uuids.yaml"), uuids)
+
+    with open(os.path.join(directory, PLACEHOLDER_SAMPLE), "w") as f:
+        f.write("name,year,value\n")
+        for i in range(100):
+            f.write(f"name-{i},{2000 + i % 25},{rnd.random() * 1000:.3f}\n")
+    with open(os.path.join(directory, PLACEHOLDER_METADATA), "w") as f:
+        f.write('{"columns": ["name", "year", "value"]}\n')
+
+
+def _write_yaml(path: str, data: dict):
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, sort_keys=False)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate a synthetic data product catalog.")
+    parser.add_argument("--directory", required=True, help="Directory to create")
+    parser.add_argument("--artifacts", type=int, default=100, help="Number of artifacts (default: 100)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args()
+    generate(args.directory, args.artifacts, args.seed)
@@ -0,0 +1,91 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Metadata memory benchmark.
+
+Reports, for catalogs of various sizes, the memory retained per
+artifact by a loaded SimpleMetadata (compact artifact store, JSON
+buffer, index and sort orders), the part of it taken by the JSON
+buffer, and, for comparison, the memory per artifact of the same
+artifacts as Pydantic models.
+"""
+
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src"))
+
+import bench
+from simplemetadata import SimpleMetadata
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "1000,10000,100000"
+
+
+def _retained(func):
+    """
+    Return func's result and the memory it retained (bytes)
+    """
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = func()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, after - before
+
+
+def run(sizes: List[int], workdir: str) -> Dict:
+    results = {}
+    for size in sizes:
+        directory = bench.catalog_directory(workdir, size)
+
+        def load():
+            metadata = SimpleMetadata(directory=directory)
+            metadata.load()
+            return metadata
+
+        start = time.perf_counter()
+        metadata, retained = _retained(load)
+        seconds = time.perf_counter() - start
+        artifacts = len(metadata.store)
+        fqproduct, models_retained = _retained(metadata.info)
+
+        results[str(size)] = {
+            "artifacts": artifacts,
+            "load_seconds_traced": round(seconds, 2),
+            "bytes_per_artifact": round(retained / artifacts),
+            "json_bytes_per_artifact": round(len(metadata.store.buffer) / artifacts),
+            "model_bytes_per_artifact": round(models_retained / artifacts),
+        }
+        logger.info(f"Size:{size} results:{results[str(size)]}")
+        del fqproduct, metadata
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark metadata memory per artifact.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma separated artifact counts (default: {DEFAULT_SIZES})")
+    parser.add_argument("--workdir", default=bench.DEFAULT_WORKDIR, help=f"Directory for generated catalogs (default: {bench.DEFAULT_WORKDIR})")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(json.dumps(run(sizes, args.workdir), indent=2))
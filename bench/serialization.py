@@ -0,0 +1,155 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+"""
+Response serialization benchmark.
+
+Measures the product, artifact list and single artifact endpoints
+through the in-process ASGI client (as bench.py does), before and
+after responses were pre-serialized:
+- before: an app with the same routes and middleware as the service
+  whose handlers return the models, so FastAPI validates the returned
+  object against the response model, serializes and JSON encodes it
+  on every request (as the endpoints used to)
+- after: the service's endpoints, which return the JSON produced by
+  SimpleMetadata at load time
+
+Both apps are served the same (already loaded) metadata, so the
+difference is the per-request response handling only.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src"))
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+import bench
+import constants
+import models
+import server
+import state
+from simplemetadata import SimpleMetadata
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = "10,100,1000,10000"
+DEFAULT_REQUESTS = 200
+DEFAULT_MAX_SECONDS = 5.0
+ENDPOINTS = ["product", "artifacts", "artifact"]
+
+
+def validating_app(metadata: SimpleMetadata) -> FastAPI:
+    """
+    Return an app serving the product and artifacts as models (validated
+    and serialized by FastAPI on each request), with the service's middleware
+    """
+    fqproduct: models.FQProduct = metadata.info()
+    artifacts = {artifact.uuid: artifact for artifact in fqproduct.artifacts}
+
+    app = FastAPI()
+    app.user_middleware = list(server.app.user_middleware)
+
+    def check(uuid: str):
+        if uuid != fqproduct.product.uuid:
+            raise HTTPException(status_code=404, detail=f"Invalid uuid:{uuid}")
+
+    @app.get(server.ENDPOINT_PREFIX + "/uuid/{uuid}")
+    async def product_get(uuid: str) -> models.FQProduct:
+        check(uuid)
+        return fqproduct
+
+    @app.get(server.ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts")
+    async def artifacts_get(uuid: str) -> List[models.Artifact]:
+        check(uuid)
+        return fqproduct.artifacts
+
+    @app.get(server.ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}")
+    async def artifact_get(uuid: str, artifact_uuid: str) -> models.Artifact:
+        check(uuid)
+        if artifact_uuid not in artifacts:
+            raise HTTPException(status_code=404, detail=f"Artifact not found artifact_uuid:{artifact_uuid}")
+        return artifacts[artifact_uuid]
+
+    return app
+
+
+def _client(app: FastAPI) -> httpx.AsyncClient:
+    headers = {
+        constants.HEADER_USERNAME: bench.BENCH_USERNAME,
+        constants.HEADER_CORRELATION_ID: bench.BENCH_CORRELATION_ID,
+    }
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", headers=headers)
+
+
+async def bench_app(app: FastAPI, metadata: SimpleMetadata, requests: int, max_seconds: float) -> Dict:
+    results = {}
+    paths = bench.endpoints(metadata)
+    async with _client(app) as client:
+        for name in ENDPOINTS:
+            results[name] = await bench.bench_endpoint(client, paths[name], requests, max_seconds)
+    return results
+
+
+async def check_responses(before: FastAPI, metadata: SimpleMetadata):
+    """
+    Check that both apps return the same responses
+    """
+    paths = bench.endpoints(metadata)
+    async with _client(before) as before_client, _client(server.app) as after_client:
+        for name in ENDPOINTS:
+            path = paths[name]()
+            before_response = await before_client.get(path)
+            after_response = await after_client.get(path)
+            if before_response.json() != after_response.json():
+                raise ValueError(f"Responses differ for endpoint:{name} path:{path}")
+
+
+async def run(sizes: List[int], workdir: str, requests: int, max_seconds: float) -> Dict:
+    results = {}
+    for size in sizes:
+        directory = bench.catalog_directory(workdir, size)
+        metadata = SimpleMetadata(directory=directory)
+        metadata.load()
+        state.gstate(server.STATE_METADATA, metadata)
+        before = validating_app(metadata)
+        await check_responses(before, metadata)
+
+        validated = await bench_app(before, metadata, requests, max_seconds)
+        preserialized = await bench_app(server.app, metadata, requests, max_seconds)
+        results[str(size)] = {}
+        for name in ENDPOINTS:
+            results[str(size)][name] = {
+                "validated": validated[name],
+                "preserialized": preserialized[name],
+                "speedup": round(preserialized[name]["throughput_rps"] / validated[name]["throughput_rps"], 1),
+            }
+            logger.info(f"Size:{size} endpoint:{name} results:{results[str(size)][name]}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark response serialization.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma separated artifact counts (default: {DEFAULT_SIZES})")
+    parser.add_argument("--workdir", default=bench.DEFAULT_WORKDIR, help=f"Directory for generated catalogs (default: {bench.DEFAULT_WORKDIR})")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help=f"Requests per endpoint (default: {DEFAULT_REQUESTS})")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS, help=f"Time budget per endpoint (default: {DEFAULT_MAX_SECONDS})")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(json.dumps(asyncio.run(run(sizes, args.workdir, args.requests, args.max_seconds)), indent=2))
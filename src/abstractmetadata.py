@@ -7,7 +7,7 @@
 # Created:  2024-04-15 by eric.broda@brodagroupsoftware.com
 
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, List
 
 
 class AbstractMetadata(ABC):
@@ -21,8 +21,25 @@ class AbstractMetadata(ABC):
 
     Methods to be implemented by subclasses:
         - __init__(**kwargs): Initialize the metadata object.
-        - load(): Load metadata from a source.
+        - load(previous): Load metadata from a source.
+        - apply(upserts, removals): Return the next version of the metadata
+          with artifacts added, replaced or removed.
+        - info(): Return the loaded metadata.
+        - product(), artifacts(): Return the product and its artifacts.
+        - uuids(): Return the product uuid and the artifact uuids by name.
+        - source(uuid): Return the file an artifact is persisted in.
+        - changes(): Return the version and the artifacts changed by the load.
         - query(text: str): Perform a query on the metadata.
+        - product_json(fields), artifacts_json(fields), artifact_json(uuid, fields):
+          Return the loaded metadata serialized as JSON, optionally
+          projected to a subset of fields.
+        - artifacts_page(limit, cursor, sort, fields): Return a page of
+          artifacts as JSON, and the cursor for the next page.
+        - artifacts_batch_json(uuids, fields): Return the given artifacts
+          (ArtifactBatch) as JSON.
+        - complete(prefix, kind, limit): Return completions of artifact
+          names and tags.
+        - facets(facets, filters): Return artifact counts per facet value.
     """
 
     @abstractmethod
@@ -39,9 +56,68 @@ class AbstractMetadata(ABC):
         pass
 
     @abstractmethod
-    def load(self):
+    def load(self, previous: "AbstractMetadata" = None):
         """
-        Load metadata
+        Load metadata; if previous (the metadata being replaced) is
+        given, the load is a reload and is compared against it
+        """
+        pass
+
+    @abstractmethod
+    def apply(self, upserts: List = None, removals: List[str] = None,
+              sources: Dict[str, str] = None) -> "AbstractMetadata":
+        """
+        Return new metadata (the next version, with its changes) with
+        the given artifacts (models.Artifact, with uuids) added or
+        replaced and the artifacts with the given uuids removed; added
+        artifacts are persisted in the files given in sources (by uuid,
+        see source()); this metadata is being replaced and must no
+        longer be used
+
+        Raises:
+            BgsNotFoundException: if an artifact to remove does not exist
+            BgsException: if an artifact's name is used by another artifact
+        """
+        pass
+
+    @abstractmethod
+    def product(self):
+        """
+        Return the product (models.Product)
+        """
+        pass
+
+    @abstractmethod
+    def artifacts(self):
+        """
+        Return the artifacts, as objects with (at least) the
+        uuid, name, description, tags, license, securitypolicy,
+        links and timestamp attributes of models.Artifact; use
+        query() to get an artifact as a models.Artifact
+        """
+        pass
+
+    @abstractmethod
+    def uuids(self):
+        """
+        Return the product uuid and the artifact uuids by
+        name (models.UUIDs), as persisted with the metadata
+        """
+        pass
+
+    @abstractmethod
+    def source(self, artifact_uuid: str):
+        """
+        Return the path (relative to the metadata directory) of the
+        file an artifact is persisted in, or None if it is unknown
+        """
+        pass
+
+    @abstractmethod
+    def changes(self):
+        """
+        Return the metadata version and the artifacts added,
+        modified and removed by the load (models.MetadataChange)
         """
         pass
 
@@ -67,4 +143,88 @@ class AbstractMetadata(ABC):
         Returns:
             The result of the query, the format of which depends on the subclass implementation.
         """
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def product_json(self, fields: List[str] = None) -> bytes:
+        """
+        Return the product and all of its artifacts (FQProduct) as JSON,
+        restricted to the given fields ("product", "artifacts",
+        "product.<field>" or "artifacts.<field>") if any
+
+        Raises:
+            ValueError: if a field is unknown
+        """
+        pass
+
+    @abstractmethod
+    def artifacts_json(self, fields: List[str] = None) -> bytes:
+        """
+        Return the list of all artifacts as JSON, restricted
+        to the given artifact fields if any
+
+        Raises:
+            ValueError: if a field is unknown
+        """
+        pass
+
+    @abstractmethod
+    def artifact_json(self, artifact_uuid: str, fields: List[str] = None) -> bytes:
+        """
+        Return an artifact as JSON, restricted to the given artifact
+        fields if any, or None if it does not exist
+
+        Raises:
+            ValueError: if a field is unknown
+        """
+        pass
+
+    @abstractmethod
+    def artifacts_page(self, limit: int = None, cursor: str = None,
+                       sort: str = None, fields: List[str] = None):
+        """
+        Return a page of up to limit artifacts (in "sort" order,
+        following the position given by cursor) as JSON, and an
+        opaque cursor for the next page (None if there are no more)
+
+        Raises:
+            ValueError: if a parameter or the cursor is invalid
+        """
+        pass
+
+    @abstractmethod
+    def artifacts_batch_json(self, artifact_uuids: List[str], fields: List[str] = None) -> bytes:
+        """
+        Return the artifacts with the given uuids, and the uuids
+        that were not found (ArtifactBatch), as JSON
+
+        Raises:
+            ValueError: if a field is unknown
+        """
+        pass
+
+    @abstractmethod
+    def complete(self, prefix: str, kind: str = None, limit: int = None):
+        """
+        Return up to limit completions (models.Completion) of prefix
+        among artifact names and tags (or only those of kind "name"
+        or "tag"), most frequent first
+
+        Raises:
+            ValueError: if kind or limit is invalid
+        """
+        pass
+
+    @abstractmethod
+    def facets(self, facets: List[str] = None, filters: List[str] = None):
+        """
+        Return the number of artifacts with each value of the given
+        facets ("tags", "license" and/or "securitypolicy"; all if none
+        are given) as models.FacetCounts. If filters ("facet:value") are
+        given, only artifacts having one of the filtered values of each
+        filtered facet are counted
+
+        Raises:
+            ValueError: if a facet or filter is invalid
+        """
+        pass
@@ -0,0 +1,70 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import hmac
+import logging
+import os
+
+from fastapi import HTTPException, Request
+
+import state
+import supervisor
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+HEADER_ADMIN_TOKEN = "OSC-DM-Admin-Token"
+ENV_ADMIN_TOKEN = "OSC_DM_ADMIN_TOKEN"
+STATE_CONFIGURATION = "configuration"
+
+
+def admin_token() -> str:
+    """
+    Return the administration token, from the OSC_DM_ADMIN_TOKEN
+    environment variable or else "admin.token" in the configuration
+    (None if neither is set, in which case admin endpoints are disabled)
+    """
+    token = os.environ.get(ENV_ADMIN_TOKEN)
+    if token:
+        return token
+    configuration = state.gstate(STATE_CONFIGURATION)
+    if configuration:
+        admin = configuration.get("admin") or {}
+        return admin.get("token")
+    return None
+
+
+def require_admin(request: Request):
+    """
+    FastAPI dependency that rejects requests without a valid
+    administration token (HEADER_ADMIN_TOKEN in header)
+    """
+    token = admin_token()
+    if not token:
+        msg = "Administration endpoints are disabled (no admin token configured)"
+        logger.error(msg)
+        raise HTTPException(status_code=403, detail=msg)
+
+    provided = request.headers.get(HEADER_ADMIN_TOKEN)
+    if not provided or not hmac.compare_digest(provided.encode("utf-8"), token.encode("utf-8")):
+        msg = f"Invalid or missing header:{HEADER_ADMIN_TOKEN}"
+        logger.error(msg)
+        raise HTTPException(status_code=401, detail=msg)
+
+
+def require_single_worker():
+    """
+    FastAPI dependency that rejects artifact writes when running with
+    multiple workers: each worker holds its own copy of the metadata,
+    so writes applied in one worker would conflict with (and could be
+    lost to) writes applied in another
+    """
+    if supervisor.worker():
+        msg = "Artifact writes are not available with multiple workers (product.workers > 1)"
+        logger.error(msg)
+        raise HTTPException(status_code=501, detail=msg)
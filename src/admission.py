@@ -0,0 +1,285 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+import math
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from middleware import HEADER_USERNAME, USERNAME_UNKNOWN, route_metrics
+import state
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_ADMISSION = "admission"
+STATE_CONFIGURATION = "configuration"
+HEADER_RETRY_AFTER = "Retry-After"
+
+DEFAULT_MAX_USERS = 1000
+# Long-lived or operational requests that are always admitted
+DEFAULT_EXEMPT = ["/health", "/metrics", "/changes/stream"]
+OVERFLOW_KEY = "__overflow__"
+
+METRIC_REJECTED_USER = "admission_rejected_user"
+METRIC_REJECTED_GLOBAL = "admission_rejected_global"
+
+
+class TokenBucket():
+    """
+    Allows "rate" requests per second on average, with bursts
+    of up to "burst" requests
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Take a token, returning 0 if one was available or else
+        the seconds until one will be (no token is taken)
+        """
+        # (now may precede the creation of the bucket)
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def give(self):
+        """
+        Return a token taken for a request that was not admitted
+        """
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def full(self, now: float) -> bool:
+        return self.tokens + max(now - self.updated, 0) * self.rate >= self.burst
+
+
+class Limits(NamedTuple):
+    max_concurrent: Optional[int]
+    rate: Optional[float]
+    burst: Optional[float]
+
+
+class Rejection(NamedTuple):
+    status_code: int
+    retry_after: int
+    reason: str
+
+
+class UserState():
+    """
+    A user's requests in progress and rate limit
+    """
+
+    def __init__(self, limits: Limits):
+        self.limits = limits
+        self.inflight = 0
+        self.bucket = _bucket(limits)
+
+
+class AdmissionController():
+    """
+    Admits or rejects requests before any handler work is done,
+    using concurrency limits (requests in progress) and token bucket
+    rate limits, both per user (HEADER_USERNAME in header) and for
+    the whole process.
+
+    A user over its own limits is rejected with 429 (so one caller
+    cannot take capacity from the others) and any request over the
+    process limits with 503; both say when to retry. Limits apply
+    per process (each worker has its own). The number of users
+    tracked is bounded: idle users are forgotten and, if all are
+    busy, new users share the limits of OVERFLOW_KEY.
+    """
+
+    def __init__(self, limits: Limits, user_limits: Limits,
+                 users: Dict[str, Limits] = None, exempt: List[str] = None,
+                 max_users: int = DEFAULT_MAX_USERS):
+        self.limits = limits
+        self.user_limits = user_limits
+        self.overrides = users or {}
+        self.exempt = tuple(DEFAULT_EXEMPT if exempt is None else exempt)
+        self.max_users = max_users
+        self.inflight = 0
+        self.bucket = _bucket(limits)
+        self.users: Dict[str, UserState] = {}
+        self.enabled = any(_limited(each) for each in [limits, user_limits, *self.overrides.values()])
+
+    def is_exempt(self, path: str) -> bool:
+        return path.endswith(self.exempt)
+
+    def admit(self, username: str) -> Tuple[UserState, Optional[Rejection]]:
+        """
+        Admit a request for username, returning the state of the user
+        (to release the request with once done) and None, or else why
+        the request was rejected
+        """
+        now = time.monotonic()
+        user = self._user(username, now)
+
+        if user.limits.max_concurrent is not None and user.inflight >= user.limits.max_concurrent:
+            return user, Rejection(429, 1, f"Too many concurrent requests for username:{username} (maximum:{user.limits.max_concurrent})")
+        if self.limits.max_concurrent is not None and self.inflight >= self.limits.max_concurrent:
+            return user, Rejection(503, 1, f"Too many concurrent requests (maximum:{self.limits.max_concurrent})")
+
+        if user.bucket:
+            wait = user.bucket.take(now)
+            if wait:
+                return user, Rejection(429, _seconds(wait), f"Rate limit exceeded for username:{username} (rate:{user.limits.rate}/s)")
+        if self.bucket:
+            wait = self.bucket.take(now)
+            if wait:
+                if user.bucket:
+                    user.bucket.give()
+                return user, Rejection(503, _seconds(wait), f"Rate limit exceeded (rate:{self.limits.rate}/s)")
+
+        user.inflight += 1
+        self.inflight += 1
+        return user, None
+
+    def release(self, user: UserState):
+        user.inflight -= 1
+        self.inflight -= 1
+
+    def _user(self, username: str, now: float) -> UserState:
+        user = self.users.get(username)
+        if user:
+            return user
+        if len(self.users) >= self.max_users:
+            self._forget_idle(now)
+        if len(self.users) >= self.max_users:
+            username = OVERFLOW_KEY
+            user = self.users.get(username)
+            if user:
+                return user
+        user = UserState(self.overrides.get(username, self.user_limits))
+        self.users[username] = user
+        return user
+
+    def _forget_idle(self, now: float):
+        """
+        Forget users with no requests in progress and a full
+        bucket (they are indistinguishable from new users)
+        """
+        for username in list(self.users):
+            user = self.users[username]
+            if user.inflight == 0 and (user.bucket is None or user.bucket.full(now)):
+                del self.users[username]
+
+
+class AdmissionMiddleware():
+    """
+    ASGI middleware applying the AdmissionController (added
+    outermost, so rejected requests are not read or logged)
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        controller = admission_controller()
+        if not controller.enabled or controller.is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        username = Headers(scope=scope).get(HEADER_USERNAME) or USERNAME_UNKNOWN
+        user, rejection = controller.admit(username)
+        if rejection:
+            metric = METRIC_REJECTED_USER if rejection.status_code == 429 else METRIC_REJECTED_GLOBAL
+            route_metrics().increment(metric)
+            logger.warning(f"Rejected username:{username} path:{scope['path']} status_code:{rejection.status_code} reason:{rejection.reason}")
+            response = JSONResponse(
+                {"detail": rejection.reason}, status_code=rejection.status_code,
+                headers={HEADER_RETRY_AFTER: str(rejection.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(user)
+
+
+def admission_controller() -> AdmissionController:
+    """
+    Return the admission controller for this process (created
+    from the configuration on first use)
+    """
+    controller = state.gstate(STATE_ADMISSION)
+    if not controller:
+        controller = from_configuration(state.gstate(STATE_CONFIGURATION))
+        state.gstate(STATE_ADMISSION, controller)
+    return controller
+
+
+def from_configuration(configuration: Optional[Dict]) -> AdmissionController:
+    """
+    Create an AdmissionController using the "admission" section of the configuration:
+    - max_concurrent, rate, burst: limits for the process
+    - user_max_concurrent, user_rate, user_burst: limits for each user
+    - users: limits (max_concurrent, rate, burst) for specific users,
+      replacing the user_* limits
+    - exempt: path suffixes that are always admitted
+      (default health, metrics and change streams)
+    - max_users: number of users tracked (default 1000)
+
+    Limits that are not set are unlimited; rate is in requests per
+    second and burst (default: rate, at least 1) in requests.
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("admission") or {}
+    limits = _limits(config)
+    user_limits = _limits(config, "user_")
+    users = {username: _limits(user or {}) for username, user in (config.get("users") or {}).items()}
+    exempt = config.get("exempt")
+    max_users = int(config.get("max_users", DEFAULT_MAX_USERS))
+    controller = AdmissionController(limits, user_limits, users, exempt, max_users)
+    if controller.enabled:
+        logger.info(f"Admission control limits:{limits} user_limits:{user_limits} users:{list(users)}")
+    return controller
+
+
+def _limits(config: Dict, prefix: str = "") -> Limits:
+    max_concurrent = config.get(prefix + "max_concurrent")
+    rate = config.get(prefix + "rate")
+    burst = config.get(prefix + "burst")
+    if max_concurrent is not None:
+        max_concurrent = int(max_concurrent)
+    if rate is not None:
+        rate = float(rate)
+        if rate <= 0:
+            raise ValueError(f"Invalid {prefix}rate:{rate} (must be positive)")
+        burst = max(float(burst if burst is not None else rate), 1.0)
+    return Limits(max_concurrent, rate, burst)
+
+
+def _limited(limits: Limits) -> bool:
+    return limits.max_concurrent is not None or limits.rate is not None
+
+
+def _bucket(limits: Limits) -> Optional[TokenBucket]:
+    return TokenBucket(limits.rate, limits.burst) if limits.rate is not None else None
+
+
+def _seconds(wait: float) -> int:
+    return max(1, math.ceil(wait))
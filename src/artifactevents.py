@@ -0,0 +1,211 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from abstractmetadata import AbstractMetadata
+import models
+import state
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_ARTIFACT_EVENTS = "artifact-events"
+STATE_CONFIGURATION = "configuration"
+STATE_REGISTRAR = "registrar"
+
+EVENT_ADDED = "artifact.added"
+EVENT_MODIFIED = "artifact.modified"
+EVENT_REMOVED = "artifact.removed"
+# Sent instead of artifact events that had to be dropped:
+# the product must be crawled again
+EVENT_RESYNC = "artifacts.resync"
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_DELAY = 2.0
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_RETRY_SECONDS = 15.0
+
+# Key of the (single) pending resync event
+_RESYNC_KEY = ""
+
+
+class ArtifactEventBatcher():
+    """
+    Sends artifact added, modified and removed events (models.Event,
+    with the artifact as data) to the registrar in batches.
+
+    A batch is sent once max_batch events are pending or max_delay
+    seconds after the first of them was queued, whichever is first.
+    Pending events for the same artifact are coalesced (for example,
+    added then modified is sent as one added event, and added then
+    removed is not sent at all). Batches that cannot be sent are
+    retried every retry_seconds; if more than max_pending events
+    build up meanwhile they are replaced by a single EVENT_RESYNC
+    event. Must be used from the event loop thread.
+    """
+
+    def __init__(self, send: Callable[[List[models.Event]], Awaitable],
+                 max_batch: int = DEFAULT_MAX_BATCH, max_delay: float = DEFAULT_MAX_DELAY,
+                 max_pending: int = DEFAULT_MAX_PENDING, retry_seconds: float = DEFAULT_RETRY_SECONDS):
+        self.send = send
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.retry_seconds = retry_seconds
+        self.pending: "OrderedDict[str, models.Event]" = OrderedDict()
+        self.available = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Artifact events started max_batch:{self.max_batch} max_delay:{self.max_delay}")
+
+    async def stop(self):
+        """
+        Stop, sending pending events (once, without retrying)
+        """
+        if self.task:
+            self.task.cancel()
+        if self.pending:
+            try:
+                await self._send(self._take(len(self.pending)))
+            except Exception as e:
+                logger.error(f"Could not send artifact events on stop, exception:{e}")
+
+    def publish(self, change: models.MetadataChange, metadata: AbstractMetadata):
+        """
+        Queue events for the artifacts added, modified and
+        removed by a metadata (re)load
+        """
+        product = metadata.product()
+        for name, artifact_uuids in [(EVENT_ADDED, change.added), (EVENT_MODIFIED, change.modified)]:
+            for artifact_uuid in artifact_uuids:
+                data = json.loads(metadata.artifact_json(artifact_uuid))
+                self._put(artifact_uuid, name, data)
+        for artifact_uuid in change.removed:
+            self._put(artifact_uuid, EVENT_REMOVED, {"uuid": artifact_uuid, "productuuid": product.uuid})
+
+        if len(self.pending) > self.max_pending:
+            logger.warning(f"Too many pending artifact events:{len(self.pending)} (maximum:{self.max_pending}), sending resync")
+            self.pending.clear()
+            self._put(_RESYNC_KEY, EVENT_RESYNC, {"productuuid": product.uuid})
+        self._wakeup()
+
+    def _put(self, key: str, name: str, data: Dict, event: models.Event = None):
+        prior = self.pending.pop(key, None)
+        if prior:
+            if prior.name == EVENT_ADDED and name == EVENT_REMOVED:
+                # Never seen downstream
+                return
+            if prior.name == EVENT_ADDED and name == EVENT_MODIFIED:
+                name = EVENT_ADDED
+            elif prior.name == EVENT_REMOVED and name == EVENT_ADDED:
+                name = EVENT_MODIFIED
+        if event is None or event.name != name:
+            event = models.Event(
+                uuid=str(uuid.uuid4()), name=name, data=data,
+                createtimestamp=datetime.now().isoformat(sep=' ', timespec='milliseconds'))
+        self.pending[key] = event
+
+    def _wakeup(self):
+        if self.pending:
+            self.available.set()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+
+    def _take(self, count: int) -> "OrderedDict[str, models.Event]":
+        batch = OrderedDict()
+        while self.pending and len(batch) < count:
+            key, event = self.pending.popitem(last=False)
+            batch[key] = event
+        return batch
+
+    async def _send(self, batch: "OrderedDict[str, models.Event]"):
+        await self.send(list(batch.values()))
+        logger.info(f"Sent artifact events:{len(batch)} pending:{len(self.pending)}")
+
+    async def _run(self):
+        while True:
+            await self.available.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.available.clear()
+            self.full.clear()
+
+            # Send full batches, and then whatever remains (the
+            # delay has passed for the oldest pending event)
+            while self.pending:
+                batch = self._take(self.max_batch)
+                try:
+                    await self._send(batch)
+                except Exception as e:
+                    logger.error(f"Could not send artifact events:{len(batch)}, retry in (seconds):{self.retry_seconds}, exception:{e}")
+                    self._requeue(batch)
+                    await asyncio.sleep(self.retry_seconds)
+
+    def _requeue(self, batch: "OrderedDict[str, models.Event]"):
+        """
+        Put back events that could not be sent, ahead of (and
+        coalesced with) events queued since
+        """
+        pending = self.pending
+        self.pending = OrderedDict()
+        for events in [batch, pending]:
+            for key, event in events.items():
+                self._put(key, event.name, event.data, event)
+
+
+def artifact_events() -> Optional[ArtifactEventBatcher]:
+    """
+    Return the artifact event batcher for this process (created and
+    started on first use, which must be in the event loop thread),
+    or None if there is no registrar or events are disabled
+    """
+    batcher = state.gstate(STATE_ARTIFACT_EVENTS)
+    if not batcher:
+        registrar = state.gstate(STATE_REGISTRAR)
+        if not registrar:
+            return None
+        batcher = from_configuration(state.gstate(STATE_CONFIGURATION), registrar.publish_events)
+        if not batcher:
+            return None
+        batcher.start()
+        state.gstate(STATE_ARTIFACT_EVENTS, batcher)
+    return batcher
+
+
+def from_configuration(configuration: Optional[Dict],
+                       send: Callable[[List[models.Event]], Awaitable]) -> Optional[ArtifactEventBatcher]:
+    """
+    Create an ArtifactEventBatcher using the "events" section of the configuration
+    (None unless "enabled" is true; the registrar must accept the events):
+    - max_batch: maximum events sent at once (default 100)
+    - max_delay: maximum seconds an event waits to be sent (default 2)
+    - max_pending: maximum events kept while the registrar is unavailable (default 10000)
+    - retry_seconds: seconds between attempts to send a batch (default 15)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("events") or {}
+    if not config.get("enabled", False):
+        return None
+    max_batch = int(config.get("max_batch", DEFAULT_MAX_BATCH))
+    max_delay = float(config.get("max_delay", DEFAULT_MAX_DELAY))
+    max_pending = int(config.get("max_pending", DEFAULT_MAX_PENDING))
+    retry_seconds = float(config.get("retry_seconds", DEFAULT_RETRY_SECONDS))
+    return ArtifactEventBatcher(send, max_batch, max_delay, max_pending, retry_seconds)
@@ -0,0 +1,242 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import stat
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+import yaml
+
+import models
+import state
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_SELF_WRITES = "self-writes"
+ARTIFACTS_DIR = "artifacts"
+UUIDS_FILENAME = "uuids.yaml"
+# Files being written (ignored by the loader and the watcher)
+TEMP_SUFFIX = ".tmp"
+DEFAULT_MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+
+# Artifact fields persisted in YAML (the others are derived on load)
+ARTIFACT_FIELDS = ["name", "description", "tags", "license", "securitypolicy", "links"]
+
+# Process umask (read once, since reading it means setting it), for
+# the mode of new files
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+_ARTIFACT_FILENAME = re.compile(r"^artifacts-(\d+)\.ya?ml$")
+_UPLOAD_EXTENSIONS_DENIED = [".yaml", ".yml", TEMP_SUFFIX]
+
+
+class SelfWrites():
+    """
+    Files written (or removed) by this process, with their state
+    (modification time and size, or None if removed) once written,
+    so the directory watcher can ignore its own changes; a file
+    whose state differs was changed by someone else since
+    """
+
+    def __init__(self):
+        self.files: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def record(self, fqpath: str):
+        self.files[os.path.realpath(fqpath)] = _stat_key(fqpath)
+
+    def is_self_write(self, fqpath: str) -> bool:
+        fqpath = os.path.realpath(fqpath)
+        if fqpath not in self.files:
+            return False
+        if self.files[fqpath] == _stat_key(fqpath):
+            return True
+        del self.files[fqpath]
+        return False
+
+
+def self_writes() -> SelfWrites:
+    """
+    Return the files written by this process (created on first use)
+    """
+    writes = state.gstate(STATE_SELF_WRITES)
+    if not writes:
+        writes = SelfWrites()
+        state.gstate(STATE_SELF_WRITES, writes)
+    return writes
+
+
+def is_temporary(path: str) -> bool:
+    return path.endswith(TEMP_SUFFIX)
+
+
+def write_atomic(fqpath: str, data: bytes):
+    """
+    Write a file so that readers (and the watcher) only ever see
+    its previous or its complete new contents
+    """
+    directory = os.path.dirname(fqpath) or "."
+    fd, temp = tempfile.mkstemp(dir=directory, prefix=".", suffix=TEMP_SUFFIX)
+    try:
+        os.fchmod(fd, _file_mode(fqpath))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, fqpath)
+    except BaseException:
+        _remove(temp)
+        raise
+    self_writes().record(fqpath)
+
+
+def remove(fqpath: str):
+    """
+    Remove a file (recorded as a self write)
+    """
+    _remove(fqpath)
+    self_writes().record(fqpath)
+
+
+async def write_stream(fqpath: str, chunks: AsyncIterator[bytes], max_bytes: int) -> Tuple[int, str]:
+    """
+    Write a stream of chunks to a file (atomically, holding one chunk
+    in memory at a time), returning its size and SHA-256 (hex)
+
+    Raises:
+        ValueError: if the stream is larger than max_bytes
+    """
+    directory = os.path.dirname(fqpath) or "."
+    fd, temp = tempfile.mkstemp(dir=directory, prefix=".", suffix=TEMP_SUFFIX)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        os.fchmod(fd, _file_mode(fqpath))
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Upload is larger than max_bytes:{max_bytes}")
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            # Large files can take a while to flush to disk
+            await asyncio.to_thread(os.fsync, f.fileno())
+        os.replace(temp, fqpath)
+    except BaseException:
+        _remove(temp)
+        raise
+    self_writes().record(fqpath)
+    return size, digest.hexdigest()
+
+
+def upload_path(directory: str, filename: str) -> str:
+    """
+    Return the path of an uploaded file (in the data product directory)
+
+    Raises:
+        ValueError: if the filename is not allowed (paths, hidden files
+        and metadata files can not be uploaded)
+    """
+    if (not filename or filename != os.path.basename(filename) or filename.startswith(".")
+            or os.path.splitext(filename)[1].lower() in _UPLOAD_EXTENSIONS_DENIED):
+        raise ValueError(f"Invalid filename:{filename} (must be a file name, not hidden, and not YAML)")
+    return os.path.join(directory, filename)
+
+
+def artifact_yaml(artifact: models.Artifact) -> bytes:
+    """
+    Return an artifact as the contents of its YAML file. The file is
+    generated from the artifact, so when it replaces a hand-written
+    file the formatting of that file is not kept: comments are
+    dropped, block scalars (such as multi-line descriptions) become
+    quoted strings and lists are written in block style
+    """
+    data = {"artifact": artifact.model_dump(include=set(ARTIFACT_FIELDS))}
+    return yaml.safe_dump(data, sort_keys=False, allow_unicode=True).encode("utf-8")
+
+
+def write_uuids(directory: str, uuids: models.UUIDs):
+    """
+    Write the UUIDs file (product uuid, and artifact uuids by name)
+    """
+    generated = datetime.now().strftime("%d-%b-%Y %H:%M:%S")
+    header = (
+        "#####\n"
+        "#\n"
+        "# UUIDs Definition\n"
+        "#\n"
+        "# This file contains the UUIDs for your product and artifacts (by name)\n"
+        "#\n"
+        "# -----\n"
+        "#\n"
+        f"# Generated on: {generated}\n"
+        "# Generated by: osc-dm-product-srv\n"
+        "#\n"
+        "#####\n"
+    )
+    text = header + yaml.safe_dump(uuids.model_dump(), sort_keys=False, allow_unicode=True)
+    write_atomic(os.path.join(directory, UUIDS_FILENAME), text.encode("utf-8"))
+
+
+def max_upload_bytes(configuration: Optional[Dict]) -> int:
+    """
+    Return "upload.max_bytes" from the configuration
+    (largest file that can be uploaded, default 100MB)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("upload") or {}
+    return int(config.get("max_bytes", DEFAULT_MAX_UPLOAD_BYTES))
+
+
+def next_artifact_filename(artifacts_dir: str, taken: Iterable[str] = ()) -> str:
+    """
+    Return the name of the next artifacts-NNN.yaml file, after
+    those in the directory and those taken (not yet written)
+    """
+    numbers = [0]
+    for file in list(os.listdir(artifacts_dir)) + list(taken):
+        match = _ARTIFACT_FILENAME.match(file)
+        if match:
+            numbers.append(int(match.group(1)))
+    return f"artifacts-{max(numbers) + 1:03d}.yaml"
+
+
+def _file_mode(fqpath: str) -> int:
+    """
+    Return the mode for a file replacing fqpath: that of the file
+    replaced, or the default for new files (temporary files are
+    created readable by their owner only)
+    """
+    try:
+        return stat.S_IMODE(os.stat(fqpath).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def _stat_key(fqpath: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(fqpath)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _remove(fqpath: str):
+    try:
+        os.remove(fqpath)
+    except FileNotFoundError:
+        pass
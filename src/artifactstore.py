@@ -0,0 +1,197 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+import logging
+import sys
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import models
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Artifact fields held by the product rather than by each record
+PRODUCT_FIELDS = ["productuuid", "productnamespace", "productname"]
+
+
+class Link(NamedTuple):
+    relationship: str
+    mimetype: str
+    url: str
+
+
+class ArtifactRecord():
+    """
+    Compact, read-only form of a models.Artifact. Fields that
+    belong to the product are not held (see PRODUCT_FIELDS),
+    tags and links are tuples, and repeated values (tags, licenses,
+    policies, links, timestamps) are shared between records.
+    """
+
+    __slots__ = ("uuid", "name", "description", "tags", "license",
+                 "securitypolicy", "links", "createtimestamp", "updatetimestamp")
+
+    def __init__(self, uuid: str, name: str, description: str, tags: Tuple[str, ...],
+                 license: str, securitypolicy: str, links: Tuple[Link, ...],
+                 createtimestamp: Optional[str], updatetimestamp: Optional[str]):
+        self.uuid = uuid
+        self.name = name
+        self.description = description
+        self.tags = tags
+        self.license = license
+        self.securitypolicy = securitypolicy
+        self.links = links
+        self.createtimestamp = createtimestamp
+        self.updatetimestamp = updatetimestamp
+
+
+class ArtifactStore():
+    """
+    The artifacts of a product, as ArtifactRecords, with the JSON
+    of every artifact held in one buffer (the JSON list of all
+    artifacts) so that an artifact's JSON is a slice of it.
+
+    Artifacts are added with add() and the store is usable once
+    finish() has been called. Pydantic models are only created
+    when asked for (model()).
+    """
+
+    def __init__(self, product: models.Product):
+        self.product = product
+        self.records: List[ArtifactRecord] = []
+        self.positions: Dict[str, int] = {}
+        self.buffer: bytes = b"[]"
+        self.offsets = array("Q", [1])
+        self._pending: List[bytes] = []
+        self._tags: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._links: Dict[Link, Link] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[ArtifactRecord]:
+        return iter(self.records)
+
+    def add(self, artifact: models.Artifact) -> ArtifactRecord:
+        """
+        Add an artifact (and its JSON, as returned by the API)
+        """
+        tags = tuple(sys.intern(tag) for tag in artifact.tags)
+        tags = self._tags.setdefault(tags, tags)
+        links = tuple(self._link(link) for link in artifact.links)
+        record = ArtifactRecord(
+            artifact.uuid, artifact.name, artifact.description, tags,
+            _intern(artifact.license), _intern(artifact.securitypolicy), links,
+            _intern(artifact.createtimestamp), _intern(artifact.updatetimestamp))
+        self.positions[record.uuid] = len(self.records)
+        self.records.append(record)
+        self._pending.append(artifact.model_dump_json().encode("utf-8"))
+        return record
+
+    def add_record(self, record: ArtifactRecord, data: bytes):
+        """
+        Add a record (and its JSON) taken from another store
+        of the same product
+        """
+        self.positions[record.uuid] = len(self.records)
+        self.records.append(record)
+        self._pending.append(data)
+
+    def finish(self):
+        """
+        Build the JSON buffer for the artifacts added
+        """
+        offsets = array("Q")
+        position = 1
+        for data in self._pending:
+            offsets.append(position)
+            position += len(data) + 1
+        offsets.append(position)
+        self.buffer = b"[" + b",".join(self._pending) + b"]"
+        self.offsets = offsets
+        self._pending = []
+
+    def get(self, uuid: str) -> Optional[ArtifactRecord]:
+        position = self.positions.get(uuid)
+        return None if position is None else self.records[position]
+
+    def json(self, uuid: str) -> Optional[bytes]:
+        """
+        Return an artifact's JSON, or None if there is no artifact with the uuid
+        """
+        position = self.positions.get(uuid)
+        if position is None:
+            return None
+        return self.buffer[self.offsets[position]:self.offsets[position + 1] - 1]
+
+    def model(self, record: ArtifactRecord) -> models.Artifact:
+        """
+        Return a record as a models.Artifact (not re-validated)
+        """
+        links = [models.Resource.model_construct(**link._asdict()) for link in record.links]
+        return models.Artifact.model_construct(
+            uuid=record.uuid,
+            productuuid=self.product.uuid,
+            productnamespace=self.product.namespace,
+            productname=self.product.name,
+            name=record.name,
+            description=record.description,
+            tags=list(record.tags),
+            license=record.license,
+            securitypolicy=record.securitypolicy,
+            links=links,
+            createtimestamp=record.createtimestamp,
+            updatetimestamp=record.updatetimestamp,
+        )
+
+    def project(self, record: ArtifactRecord, fields: Tuple[str, ...]) -> bytes:
+        """
+        Return the JSON of a record restricted to fields (which
+        must be in models.Artifact field order)
+        """
+        data = {}
+        for field in fields:
+            if field == "productuuid":
+                value = self.product.uuid
+            elif field == "productnamespace":
+                value = self.product.namespace
+            elif field == "productname":
+                value = self.product.name
+            elif field == "tags":
+                value = list(record.tags)
+            elif field == "links":
+                value = [link._asdict() for link in record.links]
+            else:
+                value = getattr(record, field)
+            data[field] = value
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def _link(self, resource: models.Resource) -> Link:
+        link = Link(_intern(resource.relationship), _intern(resource.mimetype), resource.url)
+        return self._links.setdefault(link, link)
+
+
+def content(artifact) -> Tuple:
+    """
+    Return the content of an artifact (a models.Artifact or an
+    ArtifactRecord), excluding timestamps, for comparison
+    """
+    return (
+        artifact.name,
+        artifact.description,
+        tuple(artifact.tags),
+        artifact.license,
+        artifact.securitypolicy,
+        tuple((link.relationship, link.mimetype, link.url) for link in artifact.links),
+    )
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return None if value is None else sys.intern(value)
@@ -0,0 +1,111 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import logging
+from typing import Optional, Set
+
+from bgsexception import BgsException
+import models
+import state
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_CHANGE_FEED = "change-feed"
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_MAX_SUBSCRIBERS = 1000
+
+# Queued in place of events when a subscriber falls behind
+_OVERFLOW = None
+
+
+class Subscription():
+    """
+    A subscriber's queue of pending change events (JSON)
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    async def next(self, timeout: float = None) -> Optional[str]:
+        """
+        Return the next change event, or None if the subscriber fell
+        behind (its queue filled up) and the subscription has ended
+
+        Raises:
+            asyncio.TimeoutError: if no event arrives within timeout seconds
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class ChangeFeed():
+    """
+    Fans out metadata change events to subscribers.
+
+    Each event is serialized once and queued for every subscriber.
+    Queues are bounded so that a slow subscriber cannot hold an
+    unbounded backlog: when a subscriber's queue is full its pending
+    events are dropped and its subscription ends (the subscriber can
+    reconnect and fetch the current state). Must be used from the
+    event loop thread.
+    """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_subscribers: int = DEFAULT_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscriptions: Set[Subscription] = set()
+
+    def subscribe(self) -> Subscription:
+        """
+        Raises:
+            BgsException: if there are already max_subscribers subscribers
+        """
+        if len(self.subscriptions) >= self.max_subscribers:
+            raise BgsException(f"Too many subscribers (maximum:{self.max_subscribers})")
+        subscription = Subscription(self.queue_size)
+        self.subscriptions.add(subscription)
+        logger.info(f"Subscribed subscribers:{len(self.subscriptions)}")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+        logger.info(f"Unsubscribed subscribers:{len(self.subscriptions)}")
+
+    def publish(self, change: models.MetadataChange):
+        data = change.model_dump_json()
+        overflowed = 0
+        for subscription in self.subscriptions:
+            if subscription.overflowed:
+                continue
+            try:
+                subscription.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                _overflow(subscription)
+                overflowed += 1
+        logger.info(f"Published version:{change.version} subscribers:{len(self.subscriptions)} overflowed:{overflowed}")
+
+
+def _overflow(subscription: Subscription):
+    subscription.overflowed = True
+    while not subscription.queue.empty():
+        subscription.queue.get_nowait()
+    subscription.queue.put_nowait(_OVERFLOW)
+
+
+def change_feed() -> ChangeFeed:
+    """
+    Return the change feed for this process (created on first use)
+    """
+    feed = state.gstate(STATE_CHANGE_FEED)
+    if not feed:
+        feed = ChangeFeed()
+        state.gstate(STATE_CHANGE_FEED, feed)
+    return feed
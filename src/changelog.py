@@ -0,0 +1,75 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+from collections import deque
+from typing import Deque, List, Optional
+
+import models
+import state
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_CHANGE_LOG = "change-log"
+DEFAULT_SIZE = 100
+
+
+class ChangeLog():
+    """
+    The most recent metadata changes (one per load), oldest first,
+    in a ring buffer holding up to "size" changes
+    """
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self.changes: Deque[models.MetadataChange] = deque(maxlen=size)
+
+    def append(self, change: models.MetadataChange):
+        self.changes.append(change)
+
+    def version(self) -> int:
+        return self.changes[-1].version if self.changes else 0
+
+    def since(self, version: int) -> Optional[List[models.MetadataChange]]:
+        """
+        Return the changes made after the given version, or None if
+        they are no longer all held in the log (or the version is
+        unknown, for example from before a restart)
+        """
+        current = self.version()
+        if version > current:
+            return None
+        if version == current:
+            return []
+        oldest = self.changes[0].version
+        if version < oldest - 1:
+            return None
+        return [change for change in self.changes if change.version > version]
+
+
+def delta(log: ChangeLog, version: int) -> models.MetadataDelta:
+    """
+    Return the changes since version; if the log does not reach back
+    that far, "resync" is set and the full state should be fetched
+    """
+    changes = log.since(version)
+    if changes is None:
+        logger.info(f"Changes since version:{version} not available, current version:{log.version()}")
+        return models.MetadataDelta(version=log.version(), resync=True, changes=[])
+    return models.MetadataDelta(version=log.version(), resync=False, changes=changes)
+
+
+def change_log() -> ChangeLog:
+    """
+    Return the change log for this process (created on first use)
+    """
+    log = state.gstate(STATE_CHANGE_LOG)
+    if not log:
+        log = ChangeLog()
+        state.gstate(STATE_CHANGE_LOG, log)
+    return log
@@ -0,0 +1,363 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import csv
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import models
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 1
+DEFAULT_CHUNK_ROWS = 65536
+DEFAULT_BINS = 10
+DEFAULT_SAMPLE_SIZE = 10000
+DEFAULT_DISTINCT_K = 1024
+PROFILE_EXTENSIONS = [".csv"]
+
+TYPE_EMPTY = "empty"
+TYPE_INTEGER = "integer"
+TYPE_FLOAT = "float"
+TYPE_STRING = "string"
+
+# Values (case-insensitive, after stripping whitespace) counted as nulls
+NULL_VALUES = ["", "na", "n/a", "nan", "null", "none"]
+_NULLS = frozenset(NULL_VALUES)
+# Values longer than this are not parsed as numbers (numpy string
+# arrays are as wide as their longest value, so a chunk's array of
+# values is at most this wide)
+MAX_NUMBER_LENGTH = 64
+
+_HASH_RANGE = 2.0 ** 64
+
+
+class ColumnStats():
+    """
+    Statistics of a column, updated a chunk of values at a time with
+    array operations (rather than value by value).
+
+    The type is the narrowest of integer, float and string that fits
+    every non-null value. Distinct values are counted exactly up to
+    distinct_k and estimated beyond that from the distinct_k smallest
+    value hashes (a KMV sketch). The histogram (of numeric columns) is
+    exact up to sample_size values and estimated beyond that from a
+    uniform sample of them.
+    """
+
+    def __init__(self, name: str, rng: np.random.Generator,
+                 sample_size: int = DEFAULT_SAMPLE_SIZE, distinct_k: int = DEFAULT_DISTINCT_K):
+        self.name = name
+        self.rng = rng
+        self.sample_size = sample_size
+        self.distinct_k = distinct_k
+        self.type = TYPE_EMPTY
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.text_min: Optional[str] = None
+        self.text_max: Optional[str] = None
+        self.sketch = np.empty(0, dtype=np.uint64)
+        self.sample = np.empty(0, dtype=np.float64)
+        self.sample_keys = np.empty(0, dtype=np.float64)
+
+    def update(self, values: Sequence[str]):
+        # Values are stripped and checked for nulls as Python strings,
+        # so one long value (free text, JSON) does not make every value
+        # of the chunk take its width in a numpy string array
+        texts = [value.strip() for value in values]
+        strings = [text for text in texts if text.lower() not in _NULLS]
+        self.count += len(texts)
+        self.nulls += len(texts) - len(strings)
+        if not strings:
+            return
+
+        self._update_text(strings)
+        self._update_distinct(strings)
+        if self.type != TYPE_STRING:
+            self._update_numeric(strings)
+
+    def profile(self, bins: int) -> models.ColumnProfile:
+        low, high = self.min, self.max
+        if self.type == TYPE_STRING:
+            low, high = self.text_min, self.text_max
+        elif self.type == TYPE_FLOAT:
+            # Integers seen before the first float
+            low, high = float(low), float(high)
+        distinct = len(self.sketch)
+        estimated = distinct >= self.distinct_k
+        if estimated:
+            # The k-th smallest of n uniform hashes is about k / (n + 1)
+            distinct = int(round((self.distinct_k - 1) * _HASH_RANGE / float(self.sketch[self.distinct_k - 1])))
+        return models.ColumnProfile(
+            name=self.name, type=self.type, count=self.count, nulls=self.nulls,
+            min=low, max=high, distinct=distinct, distinctestimated=estimated,
+            histogram=self._histogram(bins))
+
+    def _update_text(self, strings: List[str]):
+        low = min(strings)
+        high = max(strings)
+        if self.text_min is None or low < self.text_min:
+            self.text_min = low
+        if self.text_max is None or high > self.text_max:
+            self.text_max = high
+
+    def _update_distinct(self, strings: List[str]):
+        # String hashes are only comparable within a process, which
+        # is where the whole file is profiled
+        hashes = np.fromiter(map(hash, strings), dtype=np.int64, count=len(strings)).view(np.uint64)
+        if len(self.sketch) >= self.distinct_k:
+            hashes = hashes[hashes < self.sketch[-1]]
+        self.sketch = np.unique(np.concatenate([self.sketch, hashes]))[:self.distinct_k]
+
+    def _update_numeric(self, strings: List[str]):
+        numbers = None
+        present = None
+        if max(map(len, strings)) <= MAX_NUMBER_LENGTH:
+            present = np.array(strings)
+        if present is not None and self.type in [TYPE_EMPTY, TYPE_INTEGER]:
+            numbers = _parse(present, np.int64)
+            if numbers is not None:
+                self.type = TYPE_INTEGER
+        if numbers is None:
+            if present is not None:
+                numbers = _parse(present, np.float64)
+            if numbers is None:
+                # Stays a string column (numeric statistics are dropped)
+                self.type = TYPE_STRING
+                self.min = self.max = None
+                self.sample = self.sample_keys = np.empty(0, dtype=np.float64)
+                return
+            self.type = TYPE_FLOAT
+
+        low = numbers.min().item()
+        high = numbers.max().item()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+        # Keep the values with the smallest random keys: a uniform
+        # sample of all the values seen so far
+        finite = numbers[np.isfinite(numbers)].astype(np.float64)
+        sample = np.concatenate([self.sample, finite])
+        keys = np.concatenate([self.sample_keys, self.rng.random(len(finite))])
+        if len(sample) > self.sample_size:
+            kept = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            sample = sample[kept]
+            keys = keys[kept]
+        self.sample = sample
+        self.sample_keys = keys
+
+    def _histogram(self, bins: int) -> Optional[models.Histogram]:
+        if self.type not in [TYPE_INTEGER, TYPE_FLOAT] or not self.sample.size:
+            return None
+        low, high = float(self.min), float(self.max)
+        if not (np.isfinite(low) and np.isfinite(high)):
+            low, high = float(self.sample.min()), float(self.sample.max())
+        if low == high:
+            counts, edges = np.array([len(self.sample)]), np.array([low, high])
+        else:
+            counts, edges = np.histogram(self.sample, bins=bins, range=(low, high))
+
+        values = self.count - self.nulls
+        estimated = len(self.sample) < values
+        if estimated:
+            counts = np.rint(counts * (values / len(self.sample)))
+        return models.Histogram(edges=edges.tolist(), counts=counts.astype(np.int64).tolist(),
+                                estimated=estimated)
+
+
+def profile(fqpath: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, bins: int = DEFAULT_BINS,
+            sample_size: int = DEFAULT_SAMPLE_SIZE,
+            distinct_k: int = DEFAULT_DISTINCT_K) -> Tuple[int, List[models.ColumnProfile]]:
+    """
+    Return the number of rows (excluding the header) and the
+    column profiles of a CSV file, read once, chunk_rows at a time
+
+    Runs in a worker process, so it must only use its arguments.
+    """
+    # Seeded, so histograms of a file are sampled the same way each time
+    rng = np.random.default_rng(0)
+    rows = 0
+    with open(fqpath, "r", newline="", encoding="utf-8", errors="replace") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        width = len(header)
+        columns = [ColumnStats(name, rng, sample_size, distinct_k) for name in header]
+        while width:
+            chunk = list(islice(reader, chunk_rows))
+            if not chunk:
+                break
+            # Short rows are padded with nulls (and extra values are ignored)
+            chunk = [row if len(row) == width else (row + [""] * width)[:width] for row in chunk if row]
+            if not chunk:
+                continue
+            rows += len(chunk)
+            for stats, values in zip(columns, zip(*chunk)):
+                stats.update(values)
+    return rows, [stats.profile(bins) for stats in columns]
+
+
+def is_profiled(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in PROFILE_EXTENSIONS
+
+
+class CsvProfiler():
+    """
+    Profiles local CSV files linked by artifacts (per column: type,
+    null count, min and max, distinct count and histogram).
+
+    Files are profiled in a process pool (so large files neither block
+    the event loop nor contend for the GIL) and profiles are cached by
+    path, modification time and size. A file is profiled on first
+    request; afterwards, when the directory watcher reports that it
+    changed (changed()), it is profiled again in the background.
+    Concurrent requests for the same file share one profiling run.
+    """
+
+    def __init__(self, directory: str, workers: int = DEFAULT_WORKERS,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, bins: int = DEFAULT_BINS,
+                 sample_size: int = DEFAULT_SAMPLE_SIZE, distinct_k: int = DEFAULT_DISTINCT_K):
+        self.directory = directory
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.bins = bins
+        self.sample_size = sample_size
+        self.distinct_k = distinct_k
+        self.pool: ProcessPoolExecutor = None
+        self.cache: Dict[str, Tuple[Tuple[int, int], models.FileProfile]] = {}
+        self.running: Dict[str, asyncio.Task] = {}
+
+    def stop(self):
+        for task in self.running.values():
+            task.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def get(self, path: str) -> models.FileProfile:
+        """
+        Return the profile of a file (path relative to the directory),
+        profiling it unless it is cached and unchanged since
+
+        Raises:
+            OSError, ValueError, csv.Error: if the file can not be profiled
+        """
+        path = os.path.normpath(path)
+        entry = self.cache.get(path)
+        if entry and entry[0] == _stat_key(os.path.join(self.directory, path)):
+            return entry[1]
+        return await self._profile(path)
+
+    def changed(self, fqpath: str = None):
+        """
+        Profile a changed file (path as reported by the watcher) again
+        in the background if it was profiled before, or every profiled
+        file that changed if no path is given
+        """
+        if fqpath is None:
+            paths = list(self.cache)
+        else:
+            root = os.path.realpath(self.directory)
+            paths = [os.path.relpath(os.path.realpath(fqpath), root)]
+
+        for path in paths:
+            entry = self.cache.get(path)
+            if entry is None:
+                continue
+            try:
+                key = _stat_key(os.path.join(self.directory, path))
+            except OSError:
+                # Removed
+                del self.cache[path]
+                continue
+            if key != entry[0]:
+                logger.info(f"Refreshing profile path:{path}")
+                task = self._start(path)
+                task.add_done_callback(_log_failure)
+
+    def _profile(self, path: str) -> asyncio.Future:
+        task = self.running.get(path)
+        if task is None:
+            task = self._start(path)
+        # A request that is cancelled does not cancel the profiling
+        return asyncio.shield(task)
+
+    def _start(self, path: str) -> asyncio.Task:
+        task = self.running.get(path)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._compute(path))
+            self.running[path] = task
+            task.add_done_callback(lambda _: self.running.pop(path, None))
+        return task
+
+    async def _compute(self, path: str) -> models.FileProfile:
+        fqpath = os.path.join(self.directory, path)
+        key = _stat_key(fqpath)
+        if not self.pool:
+            # Spawn (rather than fork) since the server has threads running
+            context = multiprocessing.get_context("spawn")
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        loop = asyncio.get_running_loop()
+        rows, columns = await loop.run_in_executor(
+            self.pool, profile, fqpath, self.chunk_rows, self.bins, self.sample_size, self.distinct_k)
+
+        modified = datetime.fromtimestamp(key[0] / 1e9).isoformat(sep=' ', timespec='milliseconds')
+        fileprofile = models.FileProfile(
+            path=path, size=key[1], rows=rows, modifiedtimestamp=modified, columns=columns)
+        # The file may have changed while being read, in which case
+        # it will be profiled again when next requested
+        self.cache[path] = (key, fileprofile)
+        logger.info(f"Profiled path:{path} rows:{rows} columns:{len(columns)}")
+        return fileprofile
+
+
+def from_configuration(configuration: Optional[Dict], directory: str) -> CsvProfiler:
+    """
+    Create a CsvProfiler using the "profile" section of the configuration:
+    - workers: number of processes used to profile files (default 1)
+    - chunk_rows: rows processed at a time (default 65536)
+    - bins: number of histogram bins (default 10)
+    - sample_size: values sampled per column for histograms (default 10000)
+    - distinct_k: distinct values counted exactly, and then used to
+      estimate the distinct count (default 1024)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("profile") or {}
+    workers = int(config.get("workers", DEFAULT_WORKERS))
+    chunk_rows = int(config.get("chunk_rows", DEFAULT_CHUNK_ROWS))
+    bins = int(config.get("bins", DEFAULT_BINS))
+    sample_size = int(config.get("sample_size", DEFAULT_SAMPLE_SIZE))
+    distinct_k = int(config.get("distinct_k", DEFAULT_DISTINCT_K))
+    return CsvProfiler(directory, workers, chunk_rows, bins, sample_size, distinct_k)
+
+
+def _parse(texts: np.ndarray, dtype) -> Optional[np.ndarray]:
+    try:
+        return texts.astype(dtype)
+    except (ValueError, OverflowError):
+        return None
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Could not refresh profile, exception:{task.exception()}")
+
+
+def _stat_key(fqpath: str) -> Tuple[int, int]:
+    stat = os.stat(fqpath)
+    return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,373 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bgsexception import BgsException
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = "./tmp/downloads"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE = 300.0
+CHUNK_SIZE = 64 * 1024
+# Downloads are written in a worker thread, this many bytes at a time
+WRITE_BYTES = 1024 * 1024
+OPEN_ATTEMPTS = 3
+
+DATA_SUFFIX = ".data"
+INFO_SUFFIX = ".json"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class DownloadTooLarge(BgsException):
+    """
+    Raised if a download is larger than max_object_bytes (it is not
+    cached, so it is to be streamed from the origin instead)
+    """
+    pass
+
+
+class Entry():
+    """
+    A cached download: the response body is in "path" and
+    its validators and content type in the info file
+    """
+
+    def __init__(self, url: str, path: str, size: int = 0, etag: str = None,
+                 last_modified: str = None, content_type: str = None, validated: float = 0.0):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.validated = validated
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "size": self.size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_type": self.content_type,
+            "validated": self.validated,
+        }
+
+
+class DownloadCache():
+    """
+    Size-bounded on-disk cache of remote downloads.
+
+    A cached download is served as-is for max_age seconds after it
+    was last validated; after that it is revalidated with a
+    conditional request (If-None-Match/If-Modified-Since) and only
+    downloaded again if it changed. Concurrent requests for the same
+    URL share one upstream request. When the cache exceeds max_bytes
+    the least recently used downloads are removed. Downloads larger
+    than max_object_bytes (by default max_bytes) are not cached
+    (DownloadTooLarge). If the origin cannot be reached, a cached
+    (stale) copy is served. Files are written in a worker thread.
+    """
+
+    def __init__(self, client: Callable[[], httpx.AsyncClient], directory: str = DEFAULT_DIRECTORY,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_age: float = DEFAULT_MAX_AGE,
+                 max_object_bytes: int = None):
+        self.client = client
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_object_bytes = max_bytes if max_object_bytes is None else min(max_object_bytes, max_bytes)
+        self.entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self.size = 0
+        self.inflight: Dict[str, asyncio.Future] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    async def get(self, url: str) -> Entry:
+        """
+        Return the cache entry for url, downloading or
+        revalidating it as needed
+
+        Raises:
+            DownloadTooLarge: if the download is too large to cache
+            BgsException: if url could not be downloaded (and is not cached)
+        """
+        key = _key(url)
+        entry = self.entries.get(key)
+        if entry and time.time() - entry.validated < self.max_age:
+            self.entries.move_to_end(key)
+            return entry
+
+        # Single flight: requests arriving during a download wait for it
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(key, url, entry))
+            self.inflight[key] = future
+            future.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def get_file(self, url: str) -> Tuple[Entry, BinaryIO]:
+        """
+        Return the cache entry for url and its file opened for reading
+        (the open file stays readable if the download is then evicted
+        or replaced)
+
+        Raises:
+            DownloadTooLarge: if the download is too large to cache
+            BgsException: if url could not be downloaded (and is not cached)
+        """
+        key = _key(url)
+        for _ in range(OPEN_ATTEMPTS):
+            entry = await self.get(url)
+            # Other requests may evict or replace the download
+            # before this one resumes: if so, get it again
+            try:
+                f = open(entry.path, "rb")
+            except FileNotFoundError:
+                continue
+            if self.entries.get(key) is entry:
+                return entry, f
+            f.close()
+        msg = f"Could not open download url:{url} (attempts:{OPEN_ATTEMPTS})"
+        logger.error(msg)
+        raise BgsException(msg)
+
+    async def _fetch(self, key: str, url: str, entry: Optional[Entry]) -> Entry:
+        headers = {}
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        path = os.path.join(self.directory, key + DATA_SUFFIX)
+        try:
+            async with self.client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 304 and entry:
+                    logger.info(f"Download not modified url:{url}")
+                    entry.validated = time.time()
+                    await asyncio.to_thread(self._save_info, key, entry)
+                    self.entries.move_to_end(key)
+                    return entry
+                response.raise_for_status()
+                length = response.headers.get("Content-Length", "")
+                if length.isdigit() and int(length) > self.max_object_bytes:
+                    self._too_large(key, url)
+                size = await self._download(key, url, response, path)
+        except (httpx.HTTPError, OSError) as e:
+            if entry:
+                logger.warning(f"Could not revalidate url:{url}, serving cached copy, exception:{e}")
+                return entry
+            msg = f"Could not download url:{url} exception:{e}"
+            logger.error(msg)
+            raise BgsException(msg)
+
+        if entry:
+            self.size -= entry.size
+        entry = Entry(
+            url, path, size,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            content_type=response.headers.get("Content-Type"),
+            validated=time.time())
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.size += size
+        await asyncio.to_thread(self._save_info, key, entry)
+        logger.info(f"Downloaded url:{url} size:{size}")
+        await self._evict(keep=key)
+        return entry
+
+    async def _download(self, key: str, url: str, response: httpx.Response, path: str) -> int:
+        """
+        Write a response body to path (replacing it once complete),
+        returning its size
+        """
+        fd, temp = await asyncio.to_thread(tempfile.mkstemp, dir=self.directory, suffix=".tmp")
+        f = os.fdopen(fd, "wb")
+        size = 0
+        try:
+            chunks = []
+            buffered = 0
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_object_bytes:
+                    self._too_large(key, url)
+                chunks.append(chunk)
+                buffered += len(chunk)
+                if buffered >= WRITE_BYTES:
+                    await asyncio.to_thread(f.write, b"".join(chunks))
+                    chunks, buffered = [], 0
+            await asyncio.to_thread(_complete, f, b"".join(chunks), temp, path)
+        except BaseException:
+            f.close()
+            os.remove(temp)
+            raise
+        return size
+
+    def _too_large(self, key: str, url: str):
+        """
+        Raise DownloadTooLarge, removing any cached (older) copy
+        """
+        self._remove(key)
+        msg = f"Download too large to cache url:{url} (maximum:{self.max_object_bytes})"
+        logger.warning(msg)
+        raise DownloadTooLarge(msg)
+
+    async def _evict(self, keep: str):
+        """
+        Remove the least recently used downloads (other than keep)
+        until the cache fits within max_bytes
+        """
+        evicted = []
+        for key in list(self.entries):
+            if self.size <= self.max_bytes:
+                break
+            if key == keep or key in self.inflight:
+                continue
+            entry = self.entries.pop(key)
+            self.size -= entry.size
+            evicted.append(key)
+            logger.info(f"Evicted url:{entry.url} size:{entry.size}")
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def _remove(self, key: str):
+        """
+        Remove a download (if cached)
+        """
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.size -= entry.size
+            self._remove_files([key])
+
+    def _remove_files(self, keys: List[str]):
+        for key in keys:
+            for suffix in [DATA_SUFFIX, INFO_SUFFIX]:
+                try:
+                    os.remove(os.path.join(self.directory, key + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def _save_info(self, key: str, entry: Entry):
+        fqpath = os.path.join(self.directory, key + INFO_SUFFIX)
+        with open(fqpath + ".tmp", "w") as f:
+            json.dump(entry.to_dict(), f)
+        os.replace(fqpath + ".tmp", fqpath)
+
+    def _load(self):
+        """
+        Load the downloads cached by a previous run (least
+        recently validated first)
+        """
+        entries = []
+        for file in os.listdir(self.directory):
+            fqpath = os.path.join(self.directory, file)
+            if file.endswith(".tmp"):
+                os.remove(fqpath)
+                continue
+            if not file.endswith(INFO_SUFFIX):
+                continue
+            key = file[:-len(INFO_SUFFIX)]
+            path = os.path.join(self.directory, key + DATA_SUFFIX)
+            try:
+                with open(fqpath, "r") as f:
+                    info = json.load(f)
+                entry = Entry(path=path, **info)
+                if os.path.getsize(path) != entry.size:
+                    raise ValueError(f"Size mismatch for path:{path}")
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Discarding cached download fqpath:{fqpath} exception:{e}")
+                os.remove(fqpath)
+                continue
+            entries.append((key, entry))
+
+        for key, entry in sorted(entries, key=lambda item: item[1].validated):
+            self.entries[key] = entry
+            self.size += entry.size
+        logger.info(f"Loaded cached downloads:{len(self.entries)} size:{self.size}")
+
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Return the (start, end inclusive) of a single "bytes=" range, or
+    None if there is no range header or it is not a single byte range
+    (in which case the whole content is returned)
+
+    Raises:
+        ValueError: if the range cannot be satisfied
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(f"Unsatisfiable range:{header}")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Unsatisfiable range:{header}")
+    return start, end
+
+
+def from_configuration(configuration: Optional[Dict], client: Callable[[], httpx.AsyncClient],
+                       slot: Optional[int] = None) -> DownloadCache:
+    """
+    Create a DownloadCache using the "download" section of the configuration:
+    - directory: directory holding cached downloads (default ./tmp/downloads)
+    - max_bytes: maximum size of cached downloads (default 1GB)
+    - max_age: seconds a download is used before it is revalidated (default 300)
+    - max_object_bytes: largest download cached (default max_bytes);
+      larger downloads are streamed from the origin
+
+    Worker processes (slot given) each use their own subdirectory
+    since a cache is managed by a single process.
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("download") or {}
+    directory = config.get("directory", DEFAULT_DIRECTORY)
+    if slot is not None:
+        directory = os.path.join(directory, f"worker-{slot}")
+    max_bytes = int(config.get("max_bytes", DEFAULT_MAX_BYTES))
+    max_age = float(config.get("max_age", DEFAULT_MAX_AGE))
+    max_object_bytes = config.get("max_object_bytes")
+    if max_object_bytes is not None:
+        max_object_bytes = int(max_object_bytes)
+    return DownloadCache(client, directory, max_bytes, max_age, max_object_bytes)
+
+
+def _complete(f: BinaryIO, data: bytes, temp: str, path: str):
+    with f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
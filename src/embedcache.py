@@ -0,0 +1,158 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fingerprint import local_path
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+JSON_EXTENSIONS = [".json"]
+
+
+class EmbedCache():
+    """
+    Contents of small local files linked by artifacts (for example,
+    samples and metadata), as JSON values ready to be inlined in
+    artifact responses: JSON files are inlined as JSON and other
+    files as text.
+
+    Files larger than max_size (or that are not UTF-8 text) are not
+    inlined. Contents are kept until the directory watcher reports
+    that the file changed (invalidate()) or, when the cache holds
+    more than max_bytes, until they are the least recently used, so
+    serving an inlined file does not touch the file system.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        # Path to (size, content JSON or None if not inlined)
+        self.entries: "OrderedDict[str, Tuple[int, Optional[bytes]]]" = OrderedDict()
+        self.size = 0
+        # Link URL to path (None if not a local file)
+        self.paths: Dict[str, Optional[str]] = {}
+
+    def embedded(self, links: Iterable, relationships: List[str]) -> bytes:
+        """
+        Return the JSON object of the inlined files linked with the
+        given relationships (the first link of each), keyed by
+        relationship, each with its url, mimetype, size and content
+        """
+        wanted = set(relationships)
+        items = []
+        for link in links:
+            if link.relationship not in wanted:
+                continue
+            path = self._path(link.url)
+            if not path:
+                continue
+            size, content = self._get(path)
+            if content is None:
+                continue
+            wanted.discard(link.relationship)
+            head = json.dumps({"url": link.url, "mimetype": link.mimetype, "size": size},
+                              separators=(",", ":"), ensure_ascii=False)
+            item = f'{json.dumps(link.relationship, ensure_ascii=False)}:{head[:-1]},"content":'
+            items.append(item.encode("utf-8") + content + b"}")
+        return b"{" + b",".join(items) + b"}"
+
+    def invalidate(self, fqpath: str = None):
+        """
+        Forget a file (path as reported by the watcher), or
+        every file if no path is given
+        """
+        # A link may now resolve differently (for example, to a file just added)
+        self.paths.clear()
+        if fqpath is None:
+            self.entries.clear()
+            self.size = 0
+            return
+        path = os.path.relpath(os.path.realpath(fqpath), os.path.realpath(self.directory))
+        entry = self.entries.pop(path, None)
+        if entry:
+            self.size -= _cost(entry)
+            logger.info(f"Invalidated path:{path}")
+
+    def _path(self, url: str) -> Optional[str]:
+        if url not in self.paths:
+            self.paths[url] = local_path(self.directory, url)
+        return self.paths[url]
+
+    def _get(self, path: str) -> Tuple[int, Optional[bytes]]:
+        entry = self.entries.get(path)
+        if entry:
+            self.entries.move_to_end(path)
+            return entry
+
+        entry = self._read(path)
+        self.entries[path] = entry
+        self.size += _cost(entry)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= _cost(evicted)
+        return entry
+
+    def _read(self, path: str) -> Tuple[int, Optional[bytes]]:
+        fqpath = os.path.join(self.directory, path)
+        try:
+            size = os.path.getsize(fqpath)
+            if size > self.max_size:
+                return size, None
+            with open(fqpath, "rb") as f:
+                data = f.read(self.max_size + 1)
+            size = len(data)
+            if size > self.max_size:
+                return size, None
+            if os.path.splitext(path)[1].lower() in JSON_EXTENSIONS:
+                value = json.loads(data)
+            else:
+                value = data.decode("utf-8")
+        except (OSError, ValueError) as e:
+            # Not inlined (the link can still be followed)
+            logger.warning(f"Could not inline fqpath:{fqpath} exception:{e}")
+            return 0, None
+        content = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return size, content
+
+
+def embed_artifact(data: bytes, embedded: bytes) -> bytes:
+    """
+    Return an artifact's JSON with the "embedded" object added
+    """
+    if data == b"{}":
+        return b'{"embedded":' + embedded + b"}"
+    return data[:-1] + b',"embedded":' + embedded + b"}"
+
+
+def from_configuration(configuration: Optional[Dict], directory: str) -> EmbedCache:
+    """
+    Create an EmbedCache using the "embed" section of the configuration:
+    - max_size: largest file (bytes) inlined in responses (default 64KB)
+    - max_bytes: maximum size of the inlined files kept (default 16MB)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("embed") or {}
+    max_size = int(config.get("max_size", DEFAULT_MAX_SIZE))
+    max_bytes = int(config.get("max_bytes", DEFAULT_MAX_BYTES))
+    return EmbedCache(directory, max_size, max_bytes)
+
+
+def _cost(entry: Tuple[int, Optional[bytes]]) -> int:
+    content = entry[1]
+    return len(content) if content else 0
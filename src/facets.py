@@ -0,0 +1,170 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+FACET_TAGS = "tags"
+FACET_LICENSE = "license"
+FACET_SECURITYPOLICY = "securitypolicy"
+FACET_FIELDS = [FACET_TAGS, FACET_LICENSE, FACET_SECURITYPOLICY]
+
+
+def facet_values(artifact) -> Iterable[Tuple[str, str]]:
+    """
+    Return the (facet, value) pairs of an artifact (a
+    models.Artifact or an ArtifactRecord)
+    """
+    for tag in dict.fromkeys(artifact.tags):
+        yield FACET_TAGS, tag
+    if artifact.license is not None:
+        yield FACET_LICENSE, artifact.license
+    if artifact.securitypolicy is not None:
+        yield FACET_SECURITYPOLICY, artifact.securitypolicy
+
+
+class FacetIndex():
+    """
+    For each facet (FACET_FIELDS) value, the set of artifacts
+    (uuids) having it.
+
+    Unfiltered counts are the sizes of the sets. Counts under a
+    filter (artifacts having any of the selected values of each
+    filtered facet) intersect each value's set with the set of
+    artifacts matching the filter, so no request scans the artifacts.
+    Artifacts can be added and removed individually, so the index
+    can be updated for a few changed artifacts rather than rebuilt
+    (see copy()).
+    """
+
+    def __init__(self, artifacts: Iterable = ()):
+        self.postings: Dict[str, Dict[str, Set[str]]] = {facet: {} for facet in FACET_FIELDS}
+        self.uuids: Set[str] = set()
+        # Values whose set was created by this index (the others are
+        # shared with a copy and are copied before being changed)
+        self.owned: Set[Tuple[str, str]] = set()
+        for artifact in artifacts:
+            self.add(artifact)
+
+    def copy(self) -> "FacetIndex":
+        """
+        Return a copy to update, leaving this index (which may
+        still be serving requests, possibly from another thread)
+        unchanged. The sets of values are shared until a change to
+        the copy copies them, so this index must not be changed
+        once copied.
+        """
+        index = FacetIndex()
+        index.postings = {facet: dict(values) for facet, values in self.postings.items()}
+        index.uuids = set(self.uuids)
+        return index
+
+    def add(self, artifact):
+        self.uuids.add(artifact.uuid)
+        for facet, value in facet_values(artifact):
+            self._owned(facet, value).add(artifact.uuid)
+
+    def remove(self, artifact):
+        self.uuids.discard(artifact.uuid)
+        for facet, value in facet_values(artifact):
+            if value not in self.postings[facet]:
+                continue
+            uuids = self._owned(facet, value)
+            uuids.discard(artifact.uuid)
+            if not uuids:
+                del self.postings[facet][value]
+                self.owned.discard((facet, value))
+
+    def matching(self, filters: Dict[str, List[str]]) -> Set[str]:
+        """
+        Return the artifacts having, for every facet in filters,
+        any of its values
+        """
+        selected = None
+        # Intersect the smallest sets first
+        unions = sorted((self._union(facet, values) for facet, values in filters.items()), key=len)
+        for uuids in unions:
+            selected = uuids if selected is None else selected & uuids
+            if not selected:
+                break
+        return self.uuids if selected is None else selected
+
+    def counts(self, facets: List[str], filters: Dict[str, List[str]] = None) -> Tuple[int, Dict[str, Dict[str, int]]]:
+        """
+        Return the number of artifacts matching filters and, for each
+        facet, the number of them having each value (most frequent first)
+        """
+        selected = self.matching(filters) if filters else None
+        result = {}
+        for facet in facets:
+            if selected is None:
+                counts = [(value, len(uuids)) for value, uuids in self.postings[facet].items()]
+            else:
+                counts = [(value, len(uuids & selected)) for value, uuids in self.postings[facet].items()]
+            counts.sort(key=lambda count: (-count[1], count[0]))
+            result[facet] = {value: count for value, count in counts if count}
+        total = len(self.uuids if selected is None else selected)
+        return total, result
+
+    def _owned(self, facet: str, value: str) -> Set[str]:
+        """
+        Return the set of a value to change (created, or
+        copied if shared with another index)
+        """
+        if (facet, value) not in self.owned:
+            uuids = self.postings[facet].get(value)
+            self.postings[facet][value] = set() if uuids is None else set(uuids)
+            self.owned.add((facet, value))
+        return self.postings[facet][value]
+
+    def _union(self, facet: str, values: List[str]) -> Set[str]:
+        postings = self.postings[facet]
+        sets = [postings[value] for value in values if value in postings]
+        if len(sets) == 1:
+            return sets[0]
+        return set().union(*sets)
+
+
+def parse_facets(facets: Optional[List[str]]) -> List[str]:
+    """
+    Return the facets to count (all if none are given)
+
+    Raises:
+        ValueError: if a facet is unknown
+    """
+    if not facets:
+        return list(FACET_FIELDS)
+    _check_facets(facets)
+    return facets
+
+
+def parse_filters(filters: Optional[List[str]]) -> Dict[str, List[str]]:
+    """
+    Return the "facet:value" filters grouped by facet
+
+    Raises:
+        ValueError: if a filter is malformed or its facet is unknown
+    """
+    grouped: Dict[str, List[str]] = {}
+    for item in filters or []:
+        facet, separator, value = item.partition(":")
+        if not separator or not value:
+            raise ValueError(f"Invalid filter:{item} (must be facet:value)")
+        grouped.setdefault(facet.strip(), []).append(value.strip())
+    _check_facets(grouped)
+    return grouped
+
+
+def _check_facets(facets: Iterable[str]):
+    unknown = [facet for facet in facets if facet not in FACET_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown facets:{unknown} (valid facets:{FACET_FIELDS})")
+
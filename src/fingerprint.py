@@ -0,0 +1,222 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from abstractmetadata import AbstractMetadata
+import models
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+CHUNK_SIZE = 1024 * 1024
+ROW_COUNT_EXTENSIONS = [".csv"]
+
+
+def fingerprint(fqpath: str) -> Tuple[int, str, Optional[int]]:
+    """
+    Return the size, SHA-256 (hex) and, for CSV files, number
+    of rows (lines, excluding the header) of a file
+
+    Runs in a worker process, so it must only use its arguments.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    lines = 0
+    last = b"\n"
+    with open(fqpath, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        # Last line has no line ending
+        lines += 1
+
+    rows = None
+    if os.path.splitext(fqpath)[1].lower() in ROW_COUNT_EXTENSIONS:
+        rows = max(lines - 1, 0)
+    return size, digest.hexdigest(), rows
+
+
+def local_path(directory: str, url: str) -> Optional[str]:
+    """
+    Return the path (relative to directory) of a link to a local
+    file, or None if the link is not to a file within directory
+    """
+    parsed = urlparse(url)
+    if parsed.scheme or parsed.netloc or not parsed.path:
+        return None
+    root = os.path.realpath(directory)
+    fqpath = os.path.realpath(os.path.join(root, parsed.path))
+    if os.path.commonpath([root, fqpath]) != root or not os.path.isfile(fqpath):
+        return None
+    return os.path.relpath(fqpath, root)
+
+
+class FingerprintIndexer():
+    """
+    Computes the size, SHA-256 and row count of the local files
+    linked by artifacts, in the background.
+
+    Files are fingerprinted in a process pool (so hashing large files
+    neither blocks the event loop nor contends for the GIL) and
+    results are cached by path, modification time and size, so a
+    refresh only reads files that changed. Refreshes requested while
+    one is running are coalesced into a single refresh.
+    """
+
+    def __init__(self, directory: str, workers: int = DEFAULT_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self.pool: ProcessPoolExecutor = None
+        self.cache: Dict[str, Tuple[Tuple[int, int], models.FileFingerprint]] = {}
+        self.manifest = models.Manifest(version=0, files=[])
+        self.metadata: AbstractMetadata = None
+        self.requested = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Fingerprint indexer started directory:{self.directory} workers:{self.workers}")
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def request_refresh(self, metadata: AbstractMetadata):
+        """
+        Request that the files linked by metadata be (re)indexed
+        """
+        self.metadata = metadata
+        self.requested.set()
+
+    def get(self, path: str) -> Optional[models.FileFingerprint]:
+        """
+        Return the fingerprint of a file (path relative to the
+        directory) if it is indexed and unchanged since, else None
+        """
+        entry = self.cache.get(os.path.normpath(path))
+        if entry is None:
+            return None
+        key, fileprint = entry
+        try:
+            if _stat_key(os.path.join(self.directory, fileprint.path)) != key:
+                return None
+        except OSError:
+            return None
+        return fileprint
+
+    async def refresh(self, metadata: AbstractMetadata) -> models.Manifest:
+        """
+        Index the local files linked by the artifacts in metadata
+        and publish the resulting manifest
+        """
+        urls: Dict[str, List[str]] = {}
+        for artifact in metadata.artifacts():
+            for link in artifact.links:
+                urls.setdefault(link.url, []).append(artifact.uuid)
+
+        # Resolve each distinct link once (many artifacts may share one)
+        paths: Dict[str, List[str]] = {}
+        for url, artifact_uuids in urls.items():
+            path = local_path(self.directory, url)
+            if path:
+                paths.setdefault(path, []).extend(artifact_uuids)
+
+        fileprints = await asyncio.gather(*[self._fingerprint(path) for path in paths])
+        files = []
+        for path, fileprint in zip(paths, fileprints):
+            if fileprint:
+                files.append(fileprint.model_copy(update={"artifacts": paths[path]}))
+
+        # Drop files no longer linked
+        for path in list(self.cache):
+            if path not in paths:
+                del self.cache[path]
+
+        self.manifest = models.Manifest(version=metadata.changes().version, files=files)
+        logger.info(f"Indexed files:{len(files)} version:{self.manifest.version}")
+        return self.manifest
+
+    async def _run(self):
+        while True:
+            await self.requested.wait()
+            self.requested.clear()
+            try:
+                await self.refresh(self.metadata)
+            except Exception as e:
+                logger.error(f"Could not index files, exception:{e}", exc_info=True)
+
+    async def _fingerprint(self, path: str) -> Optional[models.FileFingerprint]:
+        fqpath = os.path.join(self.directory, path)
+        try:
+            key = _stat_key(fqpath)
+        except OSError as e:
+            logger.warning(f"Could not stat fqpath:{fqpath} exception:{e}")
+            return None
+
+        entry = self.cache.get(path)
+        if entry and entry[0] == key:
+            return entry[1]
+
+        if not self.pool:
+            # Spawn (rather than fork) since the server has threads running
+            context = multiprocessing.get_context("spawn")
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        try:
+            loop = asyncio.get_running_loop()
+            size, sha256, rows = await loop.run_in_executor(self.pool, fingerprint, fqpath)
+        except OSError as e:
+            logger.warning(f"Could not fingerprint fqpath:{fqpath} exception:{e}")
+            return None
+
+        modified = datetime.fromtimestamp(key[0] / 1e9).isoformat(sep=' ', timespec='milliseconds')
+        fileprint = models.FileFingerprint(
+            path=path, size=size, sha256=sha256, rows=rows,
+            modifiedtimestamp=modified, artifacts=[])
+        # The file may have changed while being read, in which case
+        # it will be indexed again on the next refresh
+        self.cache[path] = (key, fileprint)
+        return fileprint
+
+
+def etag(fileprint: models.FileFingerprint) -> str:
+    return f'"{fileprint.sha256}"'
+
+
+def from_configuration(configuration: Optional[Dict], directory: str) -> FingerprintIndexer:
+    """
+    Create a FingerprintIndexer using the "fingerprint" section of the configuration:
+    - workers: number of processes used to fingerprint files (default 2)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("fingerprint") or {}
+    workers = int(config.get("workers", DEFAULT_WORKERS))
+    return FingerprintIndexer(directory, workers)
+
+
+def _stat_key(fqpath: str) -> Tuple[int, int]:
+    stat = os.stat(fqpath)
+    return stat.st_mtime_ns, stat.st_size
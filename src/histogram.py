@@ -0,0 +1,120 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import math
+from typing import Dict, List
+
+# Buckets are logarithmic: each bucket upper bound is
+# 2^(1/BUCKETS_PER_OCTAVE) times the previous one, which
+# keeps percentile error under ~9% for any value in range
+BUCKETS_PER_OCTAVE = 8
+MIN_VALUE = 0.000001    # 1 microsecond
+OCTAVES = 27            # 1 microsecond .. ~134 seconds
+NUM_BUCKETS = OCTAVES * BUCKETS_PER_OCTAVE + 1
+
+PERCENTILES = [50, 90, 99]
+
+
+class LatencyHistogram():
+    """
+    Fixed-memory, log-bucketed histogram of durations (in seconds).
+
+    Every histogram has the same bucket layout, so histograms
+    can be merged by adding bucket counts (for example, to
+    aggregate across workers).
+    """
+
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * NUM_BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """
+        Record one duration (in seconds)
+        """
+        self.buckets[bucket_index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram"):
+        """
+        Add the observations of another histogram to this one
+        """
+        for i, n in enumerate(other.buckets):
+            if n:
+                self.buckets[i] += n
+        self.count += other.count
+        self.sum += other.sum
+        if other.max > self.max:
+            self.max = other.max
+
+    def percentile(self, p: float) -> float:
+        """
+        Return the upper bound of the bucket holding the p-th
+        percentile (capped at the largest observed value)
+        """
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                if i == NUM_BUCKETS - 1:
+                    return self.max
+                return min(bucket_upper_bound(i), self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        """
+        Return count, mean, percentiles and max (in milliseconds)
+        """
+        summary = {"count": self.count}
+        if self.count:
+            summary["mean_ms"] = round(self.sum / self.count * 1000, 3)
+        for p in PERCENTILES:
+            summary[f"p{p}_ms"] = round(self.percentile(p) * 1000, 3)
+        summary["max_ms"] = round(self.max * 1000, 3)
+        return summary
+
+    def to_dict(self) -> Dict:
+        """
+        Return a compact, mergeable representation
+        (only non-empty buckets are included)
+        """
+        return {
+            "buckets": {i: n for i, n in enumerate(self.buckets) if n},
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> "LatencyHistogram":
+        histogram = LatencyHistogram()
+        for i, n in data["buckets"].items():
+            histogram.buckets[int(i)] = n
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def bucket_index(value: float) -> int:
+    if value <= MIN_VALUE:
+        return 0
+    index = math.ceil(math.log2(value / MIN_VALUE) * BUCKETS_PER_OCTAVE)
+    return min(index, NUM_BUCKETS - 1)
+
+
+def bucket_upper_bound(index: int) -> float:
+    return MIN_VALUE * 2 ** (index / BUCKETS_PER_OCTAVE)
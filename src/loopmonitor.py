@@ -0,0 +1,108 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+from routemetrics import RouteMetrics
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_THRESHOLD = 0.5
+
+METRIC_LAG = "event_loop_lag"
+METRIC_STALLS = "event_loop_stalls"
+
+
+class LoopMonitor():
+    """
+    Measures event loop scheduling lag and reports stalls.
+
+    A task on the event loop sleeps for "interval" seconds at a
+    time; the extra time it takes to be woken up is the loop lag,
+    recorded in the METRIC_LAG histogram. A watchdog thread checks
+    that the task keeps running: when the loop has not run it for
+    longer than "threshold" seconds, the stack of the event loop
+    thread (the blocking callback) is logged once per stall and
+    METRIC_STALLS is incremented.
+    """
+
+    def __init__(self, metrics: RouteMetrics, interval: float = DEFAULT_INTERVAL,
+                 threshold: float = DEFAULT_THRESHOLD):
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.task: asyncio.Task = None
+        self.stop_event = threading.Event()
+        self.watchdog: threading.Thread = None
+
+    def start(self):
+        """
+        Start monitoring the running event loop
+        """
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.metrics.increment(METRIC_STALLS, 0)
+        self.task = asyncio.get_running_loop().create_task(self._measure())
+        self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+        logger.info(f"Event loop monitor started interval:{self.interval} threshold:{self.threshold}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.task:
+            self.task.cancel()
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            self.heartbeat = time.monotonic()
+            self.metrics.observe(METRIC_LAG, max(lag, 0.0))
+
+    def _watch(self):
+        reported = None
+        while not self.stop_event.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled <= self.threshold or reported == heartbeat:
+                continue
+
+            # Report each stall once (until the loop runs again)
+            reported = heartbeat
+            self.metrics.increment(METRIC_STALLS)
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(unavailable)"
+            logger.warning(
+                f"Event loop blocked for more than {stalled:.3f} seconds "
+                f"(threshold:{self.threshold}), blocking stack:\n{stack}")
+
+
+def from_configuration(configuration: Optional[Dict], metrics: RouteMetrics) -> LoopMonitor:
+    """
+    Create a LoopMonitor using the "monitor" section of the configuration:
+    - loop_interval: seconds between lag measurements (default 0.1)
+    - loop_threshold: seconds after which a stall is reported (default 0.5)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("monitor") or {}
+    interval = float(config.get("loop_interval", DEFAULT_INTERVAL))
+    threshold = float(config.get("loop_threshold", DEFAULT_THRESHOLD))
+    return LoopMonitor(metrics, interval, threshold)
@@ -0,0 +1,199 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import gc
+import logging
+import sys
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from types import FunctionType, ModuleType
+from typing import Dict, List
+
+from bgsexception import BgsException, BgsNotFoundException
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRAMES = 1
+MAX_FRAMES = 50
+MAX_SNAPSHOTS = 5
+DEFAULT_LIMIT = 20
+GROUP_BY = ["lineno", "filename", "traceback"]
+
+# Objects that are shared (not owned) and are not counted in sizes
+_SKIP_TYPES = (type, ModuleType, FunctionType)
+
+# Snapshot id -> (timestamp, snapshot), oldest first
+_snapshots: "OrderedDict[int, tuple]" = OrderedDict()
+_next_snapshot_id = 1
+
+
+def start(frames: int = DEFAULT_FRAMES) -> Dict:
+    """
+    Start tracing allocations (recording up to frames stack frames each)
+    """
+    if frames < 1 or frames > MAX_FRAMES:
+        raise ValueError(f"Invalid frames:{frames} (must be >= 1 and <= {MAX_FRAMES})")
+    if tracemalloc.is_tracing():
+        raise BgsException("Allocation tracing is already running")
+    tracemalloc.start(frames)
+    logger.info(f"Allocation tracing started frames:{frames}")
+    return status()
+
+
+def stop() -> Dict:
+    """
+    Stop tracing allocations (snapshots are discarded)
+    """
+    if not tracemalloc.is_tracing():
+        raise BgsException("Allocation tracing is not running")
+    tracemalloc.stop()
+    _snapshots.clear()
+    logger.info("Allocation tracing stopped")
+    return status()
+
+
+def status() -> Dict:
+    tracing = tracemalloc.is_tracing()
+    response = {
+        "tracing": tracing,
+        "snapshots": [
+            {"id": id, "timestamp": timestamp}
+            for id, (timestamp, _) in _snapshots.items()
+        ],
+    }
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        response["frames"] = tracemalloc.get_traceback_limit()
+        response["traced_bytes"] = current
+        response["peak_traced_bytes"] = peak
+    return response
+
+
+def take_snapshot(group_by: str = "lineno", limit: int = DEFAULT_LIMIT) -> Dict:
+    """
+    Take and keep a snapshot (the oldest is discarded once MAX_SNAPSHOTS
+    are kept); returns its id and its top allocation sites
+    """
+    global _next_snapshot_id
+    _check(group_by)
+    snapshot = _filtered(tracemalloc.take_snapshot())
+    id = _next_snapshot_id
+    _next_snapshot_id += 1
+    timestamp = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+    _snapshots[id] = (timestamp, snapshot)
+    while len(_snapshots) > MAX_SNAPSHOTS:
+        _snapshots.popitem(last=False)
+
+    stats = snapshot.statistics(group_by)
+    return {
+        "id": id,
+        "timestamp": timestamp,
+        "total_bytes": sum(stat.size for stat in stats),
+        "top": [_statistic(stat) for stat in stats[:limit]],
+    }
+
+
+def diff(base_id: int, id: int, group_by: str = "lineno", limit: int = DEFAULT_LIMIT) -> Dict:
+    """
+    Return the allocation sites that changed most between two snapshots
+    """
+    _check(group_by)
+    base = _snapshot(base_id)
+    snapshot = _snapshot(id)
+    stats = snapshot.compare_to(base, group_by)
+    return {
+        "base": base_id,
+        "id": id,
+        "size_diff_bytes": sum(stat.size_diff for stat in stats),
+        "top": [_statistic_diff(stat) for stat in stats[:limit]],
+    }
+
+
+def sizes(objects: Dict[str, object]) -> Dict[str, Dict]:
+    """
+    Return the approximate (deep) size of each named object
+    """
+    response = {}
+    for name, obj in objects.items():
+        count, size = deep_sizeof(obj)
+        response[name] = {
+            "type": type(obj).__name__,
+            "objects": count,
+            "bytes": size,
+        }
+    return response
+
+
+def deep_sizeof(obj) -> tuple:
+    """
+    Return (number of objects, total bytes) reachable from obj,
+    counting each object once and ignoring classes, modules
+    and functions (which are shared)
+    """
+    seen = set()
+    pending = [obj]
+    count = 0
+    size = 0
+    while pending:
+        batch = []
+        for item in pending:
+            if isinstance(item, _SKIP_TYPES) or id(item) in seen:
+                continue
+            seen.add(id(item))
+            count += 1
+            size += sys.getsizeof(item)
+            batch.append(item)
+        pending = gc.get_referents(*batch) if batch else []
+    return count, size
+
+
+def _check(group_by: str):
+    if not tracemalloc.is_tracing():
+        raise BgsException("Allocation tracing is not running")
+    if group_by not in GROUP_BY:
+        raise ValueError(f"Invalid group_by:{group_by} (must be one of {GROUP_BY})")
+
+
+def _snapshot(id: int) -> tracemalloc.Snapshot:
+    if id not in _snapshots:
+        raise BgsNotFoundException(f"Snapshot not found id:{id}")
+    _, snapshot = _snapshots[id]
+    return snapshot
+
+
+def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def _traceback(traceback: tracemalloc.Traceback) -> List[str]:
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+
+
+def _statistic(stat: tracemalloc.Statistic) -> Dict:
+    return {
+        "site": _traceback(stat.traceback),
+        "bytes": stat.size,
+        "count": stat.count,
+    }
+
+
+def _statistic_diff(stat: tracemalloc.StatisticDiff) -> Dict:
+    return {
+        "site": _traceback(stat.traceback),
+        "bytes": stat.size,
+        "bytes_diff": stat.size_diff,
+        "count": stat.count,
+        "count_diff": stat.count_diff,
+    }
@@ -6,15 +6,29 @@ from starlette.responses import StreamingResponse
 from starlette.types import Send
 from starlette.datastructures import MutableHeaders
 import uuid
+import time
 
 import state
+import tracing
+from admin import HEADER_ADMIN_TOKEN
+from routemetrics import RouteMetrics, route_template
 
 STATE_TRACEID = "state-traceid"
 STATE_METRICS = "state-metrics"
 
 HEADER_USERNAME = "OSC-DM-Username"
 HEADER_CORRELATION_ID = "OSC-DM-Correlation-ID"
+HEADER_SERVER_TIMING = "Server-Timing"
 USERNAME_UNKNOWN = "unknown"
+MEDIA_TYPE_JSON = "application/json"
+# Request bodies are logged only if JSON and at most this size (as
+# given by Content-Length), and never for uploads (which are streamed
+# to the handler); they are logged as text, not parsed
+MAX_LOGGED_BODY_BYTES = 16 * 1024
+UPLOAD_PATH_SEGMENT = "/files/"
+# Credentials are never logged (header names are case-insensitive)
+REDACTED_HEADERS = {name.lower() for name in [HEADER_ADMIN_TOKEN, "Authorization", "Proxy-Authorization", "Cookie", "Set-Cookie"]}
+REDACTED = "(redacted)"
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     """
@@ -23,44 +37,52 @@ class LoggingMiddleware(BaseHTTPMiddleware):
     - add "TRACE" identifiers to request and responses that
     link requests to their responses
     - track basic statistics about service usage for
-    URLs and username (HEADER_USERNAME in header)
+    route templates and username (HEADER_USERNAME in header),
+    including latency histograms (also returned to the caller
+    in the HEADER_SERVER_TIMING header)
     - create correlation id that can allow messages
     to be tracked end-to-end (assuming each communication
     participate propagates key headers)
     """
     async def dispatch(self, request: Request, call_next):
         logger = logging.getLogger(__name__)
+        start_time = time.perf_counter()
 
         body = {}
         if request.method not in ["GET", "HEAD", "OPTIONS"]:
-            try:
-                body = await request.json()
-            except Exception:
+            if _is_logged_body(request):
                 try:
-                    body = await request.body()
-                    body = _safe_decode(body)
+                    body = _safe_decode(await request.body())
                 except Exception as e:
                     body = f"Failed to read body: {str(e)}"
+            else:
+                # Not read (and held in memory) here, before the
+                # handler has authorized the request
+                content_type = request.headers.get("content-type", "")
+                body = f"(not logged, content-type:{content_type} content-length:{request.headers.get('content-length')})"
 
         # Get the correlation id, and add it if it does not exist
         correlation_id = request.headers.get(HEADER_CORRELATION_ID)
         if correlation_id is None:
-            logger.warning(f"Missing header:{HEADER_CORRELATION_ID} url:{str(request.url)} headers:{request.headers} ")
+            logger.warning(f"Missing header:{HEADER_CORRELATION_ID} url:{str(request.url)} headers:{_logged_headers(request.headers)} ")
             correlation_id = str(uuid.uuid4())
             headers = MutableHeaders(request._headers)
             headers[HEADER_CORRELATION_ID] = correlation_id
             request._headers = headers
-            logger.warning(f"Added header:{HEADER_CORRELATION_ID}:{correlation_id} url:{str(request.url)} headers:{request.headers} ")
+            logger.warning(f"Added header:{HEADER_CORRELATION_ID}:{correlation_id} url:{str(request.url)} headers:{_logged_headers(request.headers)} ")
 
         # Get the username, and add it if it does not exist
         username = request.headers.get(HEADER_USERNAME)
         if username is None:
-            logger.warning(f"Missing header:{HEADER_USERNAME} url:{str(request.url)} headers:{request.headers} ")
+            logger.warning(f"Missing header:{HEADER_USERNAME} url:{str(request.url)} headers:{_logged_headers(request.headers)} ")
             username = USERNAME_UNKNOWN
             headers = MutableHeaders(request._headers)
             headers[HEADER_USERNAME] = username
             request._headers = headers
-            logger.warning(f"Added header:{HEADER_USERNAME}:{username} url:{str(request.url)} headers:{request.headers} ")
+            logger.warning(f"Added header:{HEADER_USERNAME}:{username} url:{str(request.url)} headers:{_logged_headers(request.headers)} ")
+
+        # Record the correlation id and username on the request span
+        tracing.annotate_request(correlation_id, username)
 
         # Get a trace identifier to track requests and responses logs
         trace_id = state.gstate(STATE_TRACEID)
@@ -73,7 +95,7 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         request_info = {
             "url": url,
             "method": request.method,
-            "headers": dict(request.headers),
+            "headers": _logged_headers(request.headers),
             "parameters": dict(request.query_params),
             "body": body
         }
@@ -81,30 +103,23 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
         response = await call_next(request)
         status_code = response.status_code
+        elapsed = time.perf_counter() - start_time
 
         # Add the correlation id and username to the response
         response.headers[HEADER_CORRELATION_ID] = correlation_id
         response.headers[HEADER_USERNAME] = username
+        response.headers[HEADER_SERVER_TIMING] = f"app;dur={elapsed * 1000:.3f}"
 
-        # Handle username counts
-        metrics = state.gstate(STATE_METRICS)
-        if not metrics:
-            metrics = {}
-            state.gstate(STATE_METRICS, metrics)
-        metrics = state.gstate(STATE_METRICS)
+        # Update counts for username and route template (not the
+        # full URL, which would grow without bound)
+        metrics = route_metrics()
 
-        # Update counts for username
         username = request.headers.get(HEADER_USERNAME)
         if not username:
             username = USERNAME_UNKNOWN
-        if username not in metrics:
-            metrics[username] = {}
-        if url not in metrics[username]:
-            metrics[username][url] = {}
-        if status_code not in metrics[username][url]:
-            metrics[username][url][status_code] = 0
-        metrics[username][url][status_code] += 1
-        logger.info(f"Using metrics:{metrics}")
+        route = route_template(request)
+        metrics.record(username, route, status_code, elapsed)
+        logger.info(f"Using metrics username:{username} route:{route} status_code:{status_code} elapsed:{elapsed:.6f}")
 
         # Log response
         response_body = ""
@@ -117,7 +132,7 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
         response_info = {
             "status_code": response.status_code,
-            "headers": response.headers,
+            "headers": _logged_headers(response.headers),
             "body": response_body
         }
         logger.info(f"TRACE-{trace_id}:{correlation_id}-RSP:{response_info}")
@@ -128,8 +143,21 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
     @staticmethod
     def get_metrics():
-        usernames = state.gstate(STATE_METRICS)
-        return usernames
+        metrics = state.gstate(STATE_METRICS)
+        if not metrics:
+            return {}
+        return metrics.snapshot()
+
+
+def route_metrics() -> RouteMetrics:
+    """
+    Return the metrics for this process (created on first use)
+    """
+    metrics = state.gstate(STATE_METRICS)
+    if not metrics:
+        metrics = RouteMetrics()
+        state.gstate(STATE_METRICS, metrics)
+    return metrics
 
 
 class _LoggingStreamingResponse(StreamingResponse):
@@ -156,6 +184,25 @@ class _LoggingStreamingResponse(StreamingResponse):
     def body(self):
         return b"".join(self.body_chunks).decode("utf-8")
 
+def _is_logged_body(request: Request) -> bool:
+    if UPLOAD_PATH_SEGMENT in request.url.path:
+        return False
+    if not request.headers.get("content-type", "").startswith(MEDIA_TYPE_JSON):
+        return False
+    length = request.headers.get("content-length", "")
+    return length.isdigit() and int(length) <= MAX_LOGGED_BODY_BYTES
+
+
+def _logged_headers(headers) -> dict:
+    """
+    Return headers to log, with credentials redacted
+    """
+    return {
+        name: REDACTED if name.lower() in REDACTED_HEADERS else value
+        for name, value in headers.items()
+    }
+
+
 def _safe_decode(data):
     try:
         return data.decode('utf-8')
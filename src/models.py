@@ -145,3 +145,83 @@ class Event(BaseModel):
 class UUIDs(BaseModel):
     product_uuid: str
     artifact_uuids: List[Dict[str, str]]
+
+# Batch retrieval of artifacts by uuid
+class ArtifactBatchRequest(BaseModel):
+    uuids: List[str]
+
+class ArtifactBatch(BaseModel):
+    artifacts: List[Artifact]
+    missing: List[str]
+
+# Completion of a prefix (autocomplete): an artifact name or tag
+# ("kind") and the number of artifacts having it
+class Completion(BaseModel):
+    text: str
+    kind: str
+    count: int
+
+# Number of artifacts (matching a filter, if any) in total and
+# with each value of each facet (tags, license, securitypolicy)
+class FacetCounts(BaseModel):
+    total: int
+    facets: Dict[str, Dict[str, int]]
+
+# Artifacts (uuids) changed by a metadata (re)load, which
+# produces a new metadata version
+class MetadataChange(BaseModel):
+    version: int
+    added: List[str]
+    modified: List[str]
+    removed: List[str]
+    createtimestamp: Optional[str] = None
+
+# Changes since a version; if "resync" is set the changes are
+# no longer available and the full metadata must be fetched
+class MetadataDelta(BaseModel):
+    version: int
+    resync: bool
+    changes: List[MetadataChange]
+
+# Fingerprint of a local file linked by artifacts (path is
+# relative to the data product directory)
+class FileFingerprint(BaseModel):
+    path: str
+    size: int
+    sha256: str
+    rows: Optional[int] = None
+    modifiedtimestamp: Optional[str] = None
+    artifacts: List[str]
+
+class Manifest(BaseModel):
+    version: int
+    files: List[FileFingerprint]
+
+# Histogram of the values of a numeric column (counts are estimated
+# from a sample of the values for large files)
+class Histogram(BaseModel):
+    edges: List[float]
+    counts: List[int]
+    estimated: bool
+
+# Profile of a column of a CSV file (min and max are numbers for
+# integer and float columns, and strings for string columns)
+class ColumnProfile(BaseModel):
+    name: str
+    type: str
+    count: int
+    nulls: int
+    min: Optional[Union[int, float, str]] = None
+    max: Optional[Union[int, float, str]] = None
+    distinct: int
+    distinctestimated: bool
+    histogram: Optional[Histogram] = None
+
+# Profile of a local CSV file linked by artifacts (path is
+# relative to the data product directory)
+class FileProfile(BaseModel):
+    path: str
+    size: int
+    rows: int
+    modifiedtimestamp: Optional[str] = None
+    columns: List[ColumnProfile]
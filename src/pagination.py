@@ -0,0 +1,117 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import base64
+import binascii
+import bisect
+import json
+import logging
+from typing import List, Optional, Tuple
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ["name", "createtimestamp", "updatetimestamp"]
+DEFAULT_SORT = "name"
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+DESCENDING = "-"
+
+
+class SortOrder():
+    """
+    Items sorted (ascending) by one field, with the item uuid as a
+    tie-breaker so that every position has a unique key.
+
+    Pages are located by key (keyset pagination) rather than by
+    offset, so a cursor remains valid when items are added or
+    removed between requests (for example across a reload), and a
+    page costs O(log n + limit) whatever the number of items.
+    """
+
+    def __init__(self, field: str, items: List):
+        self.field = field
+        self.items: List = sorted(items, key=self._key)
+
+    def _key(self, item) -> Tuple[str, str]:
+        return _key(item, self.field)
+
+    def page(self, limit: int, after: Optional[Tuple[str, str]] = None,
+             descending: bool = False) -> Tuple[List, Optional[Tuple[str, str]]]:
+        """
+        Return up to limit items following the "after" key (from
+        the start if None) and the key to continue from (None if
+        there are no more items)
+        """
+        # Keys are computed while bisecting (O(log n) of them)
+        # rather than held for every item
+        if descending:
+            end = len(self.items) if after is None else bisect.bisect_left(self.items, after, key=self._key)
+            start = max(end - limit, 0)
+            items = self.items[start:end][::-1]
+            more = start > 0
+        else:
+            start = 0 if after is None else bisect.bisect_right(self.items, after, key=self._key)
+            end = min(start + limit, len(self.items))
+            items = self.items[start:end]
+            more = end < len(self.items)
+        last = _key(items[-1], self.field) if items and more else None
+        return items, last
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[str, bool]:
+    """
+    Return the field and direction of a sort parameter
+    ("name", or "-name" for descending order)
+    """
+    sort = sort or DEFAULT_SORT
+    descending = sort.startswith(DESCENDING)
+    field = sort[len(DESCENDING):] if descending else sort
+    if field not in SORT_FIELDS:
+        raise ValueError(f"Invalid sort:{sort} (must be one of {SORT_FIELDS}, optionally prefixed by '{DESCENDING}')")
+    return field, descending
+
+
+def check_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_LIMIT
+    if limit < 1 or limit > MAX_LIMIT:
+        raise ValueError(f"Invalid limit:{limit} (must be >= 1 and <= {MAX_LIMIT})")
+    return limit
+
+
+def encode_cursor(sort: str, key: Tuple[str, str]) -> str:
+    """
+    Return an opaque cursor for the position after key
+    """
+    data = json.dumps([sort, key[0], key[1]], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[str, str]:
+    """
+    Return the key in a cursor, checking that it was
+    created for the same sort order
+
+    Raises:
+        ValueError: if the cursor is invalid
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, uuid = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor:{cursor}") from e
+    if cursor_sort != sort:
+        raise ValueError(f"Invalid cursor:{cursor} (created for sort:{cursor_sort}, not sort:{sort})")
+    if not isinstance(value, str) or not isinstance(uuid, str):
+        raise ValueError(f"Invalid cursor:{cursor}")
+    return value, uuid
+
+
+def _key(item, field: str) -> Tuple[str, str]:
+    return getattr(item, field) or "", item.uuid or ""
@@ -0,0 +1,110 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import heapq
+import logging
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Tuple
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Ranges of more keys than this are ranked once and the result kept
+# (short prefixes match many keys and are the most frequent queries)
+CACHE_THRESHOLD = 256
+MAX_CACHED = 1024
+
+_HIGHEST = "\U0010ffff"
+
+
+class PrefixIndex():
+    """
+    Case-insensitive prefix index over terms (for example,
+    artifact names or tags) counting how many times each occurs.
+
+    Keys (case-folded terms) are held in a sorted list, so the keys
+    with a prefix are a contiguous range found by binary search.
+    Completions are ranked by count (most frequent first) and then
+    alphabetically. Terms can be added and removed individually, so
+    the index can be updated for a few changed artifacts rather than
+    rebuilt (see copy()).
+    """
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self.counts: Dict[str, int] = {}
+        self.terms: Dict[str, str] = {}
+        for term in terms:
+            self._count(term, 1)
+        self.keys: List[str] = sorted(self.counts)
+        self._cache: Dict[Tuple[str, int], List[Tuple[str, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def copy(self) -> "PrefixIndex":
+        """
+        Return a copy to update, leaving this index (which may
+        still be serving requests) unchanged
+        """
+        index = PrefixIndex()
+        index.counts = dict(self.counts)
+        index.terms = dict(self.terms)
+        index.keys = list(self.keys)
+        return index
+
+    def add(self, term: str):
+        key = self._count(term, 1)
+        if self.counts[key] == 1:
+            insort(self.keys, key)
+        self._cache.clear()
+
+    def remove(self, term: str):
+        key = term.casefold()
+        if key not in self.counts:
+            return
+        if self._count(term, -1) not in self.counts:
+            del self.keys[bisect_left(self.keys, key)]
+        self._cache.clear()
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """
+        Return up to limit (term, count) completions of prefix
+        """
+        prefix = prefix.casefold()
+        cached = self._cache.get((prefix, limit))
+        if cached is not None:
+            return cached
+
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + _HIGHEST, start)
+        keys = self.keys
+        counts = self.counts
+        # Keys are sorted, so ties on count are in alphabetical order
+        ranked = heapq.nsmallest(limit, range(start, end), key=lambda i: (-counts[keys[i]], i))
+        completions = [(self.terms[keys[i]], counts[keys[i]]) for i in ranked]
+
+        if end - start > CACHE_THRESHOLD:
+            if len(self._cache) >= MAX_CACHED:
+                self._cache.clear()
+            self._cache[(prefix, limit)] = completions
+        return completions
+
+    def _count(self, term: str, delta: int) -> str:
+        """
+        Update the count of a term, returning its key
+        """
+        key = term.casefold()
+        count = self.counts.get(key, 0) + delta
+        if count > 0:
+            self.counts[key] = count
+            # The first spelling seen is the one completed
+            self.terms.setdefault(key, term)
+        else:
+            self.counts.pop(key, None)
+            self.terms.pop(key, None)
+        return key
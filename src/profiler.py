@@ -0,0 +1,130 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict
+
+from bgsexception import BgsException
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+MODE_SAMPLE = "sample"
+MODE_CPROFILE = "cprofile"
+FORMAT_PSTATS = "pstats"
+FORMAT_TEXT = "text"
+
+MAX_SECONDS = 300.0
+DEFAULT_INTERVAL = 0.005
+TEXT_REPORT_LINES = 50
+
+# Only one capture may run at a time
+_lock = asyncio.Lock()
+
+
+async def profile(seconds: float, mode: str = MODE_SAMPLE,
+                  format: str = FORMAT_TEXT, interval: float = DEFAULT_INTERVAL) -> bytes:
+    """
+    Profile the event loop thread for the given number of seconds.
+
+    Modes:
+    - "sample": a background thread samples the event loop thread's
+      stack every interval seconds; returns collapsed stacks
+      ("frame;frame;frame count" per line, as used by flame graph tools)
+    - "cprofile": deterministic profile using cProfile; returns
+      a pstats file ("pstats" format) or a text report ("text" format)
+
+    Nothing is installed while no capture is running.
+
+    Raises:
+        ValueError: if parameters are invalid
+        BgsException: if a capture is already running
+    """
+    if seconds <= 0 or seconds > MAX_SECONDS:
+        raise ValueError(f"Invalid seconds:{seconds} (must be > 0 and <= {MAX_SECONDS})")
+    if mode not in [MODE_SAMPLE, MODE_CPROFILE]:
+        raise ValueError(f"Invalid mode:{mode}")
+    if format not in [FORMAT_PSTATS, FORMAT_TEXT]:
+        raise ValueError(f"Invalid format:{format}")
+    if _lock.locked():
+        raise BgsException("A profile capture is already running")
+
+    async with _lock:
+        logger.info(f"Profiling seconds:{seconds} mode:{mode} format:{format}")
+        if mode == MODE_SAMPLE:
+            return await _sample(seconds, interval)
+        return await _cprofile(seconds, format)
+
+
+async def _cprofile(seconds: float, format: str) -> bytes:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+
+    if format == FORMAT_TEXT:
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TEXT_REPORT_LINES)
+        return output.getvalue().encode("utf-8")
+
+    fd, path = tempfile.mkstemp(suffix=".pstats")
+    os.close(fd)
+    try:
+        profiler.dump_stats(path)
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+async def _sample(seconds: float, interval: float) -> bytes:
+    target = threading.get_ident()
+    stop = threading.Event()
+    stacks: Dict[str, int] = {}
+
+    def sampler():
+        while not stop.is_set():
+            frame = sys._current_frames().get(target)
+            if frame is not None:
+                key = _collapse(frame)
+                stacks[key] = stacks.get(key, 0) + 1
+            time.sleep(interval)
+
+    thread = threading.Thread(target=sampler, name="profiler-sampler", daemon=True)
+    thread.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        thread.join()
+
+    lines = [f"{stack} {count}" for stack, count in sorted(stacks.items())]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
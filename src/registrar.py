@@ -8,6 +8,7 @@
 
 import logging
 import uuid
+from typing import List
 
 # Set up logging
 LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
@@ -19,6 +20,8 @@ import utilities
 import models
 import constants
 
+SERVICE_EVENTS = "/api/registrar/events"
+
 class Registrar():
 
     def __init__(self, config: dict):
@@ -45,3 +48,23 @@ class Registrar():
         logger.info(f"Registering product:{product}, response:{response}")
 
         return response
+
+    async def publish_events(self, events: List[models.Event]):
+        """
+        Send a batch of events (for example, artifact changes)
+        """
+        logger.info(f"Publishing events:{len(events)}")
+
+        events_list = [event.model_dump() for event in events]
+        service = SERVICE_EVENTS
+        method = "POST"
+        headers = {
+            constants.HEADER_USERNAME: constants.USERNAME,
+            constants.HEADER_CORRELATION_ID: str(uuid.uuid4())
+        }
+        response = await utilities.httprequest(
+            self.registrar_host, self.registrar_port, service, method,
+            headers=headers, obj=events_list)
+        logger.info(f"Publishing events:{len(events)}, response:{response}")
+
+        return response
@@ -0,0 +1,230 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+from typing import Dict, List, Tuple
+
+from histogram import LatencyHistogram, bucket_upper_bound, BUCKETS_PER_OCTAVE, NUM_BUCKETS
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_USERNAMES = 100
+DEFAULT_MAX_ROUTES = 64
+OVERFLOW_KEY = "__overflow__"
+UNMATCHED_ROUTE = "__unmatched__"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROMETHEUS_PREFIX = "osc_dm_product"
+
+
+class RouteMetrics():
+    """
+    Request counts keyed by (username, route template, status code),
+    and latency histograms keyed by (route template, status class).
+    Process-level histograms and counters (for example, event loop
+    lag) are also kept, keyed by a fixed name.
+
+    Keys are bounded: once the number of distinct usernames or
+    routes reaches its limit, further new values are counted
+    under OVERFLOW_KEY, so memory stays flat regardless of
+    how many distinct URLs, path parameters or callers are seen.
+    """
+
+    def __init__(self, max_usernames: int = DEFAULT_MAX_USERNAMES,
+                 max_routes: int = DEFAULT_MAX_ROUTES):
+        self.max_usernames = max_usernames
+        self.max_routes = max_routes
+        self.usernames = set()
+        self.routes = set()
+        self.counts: Dict[Tuple[str, str, int], int] = {}
+        self.latencies: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {}
+
+    def observe(self, name: str, seconds: float):
+        """
+        Record a duration (in seconds) in the named histogram
+        """
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[name] = histogram
+        histogram.observe(seconds)
+
+    def increment(self, name: str, count: int = 1):
+        """
+        Increment the named counter
+        """
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def record(self, username: str, route: str, status_code: int, seconds: float):
+        """
+        Count one request for username and route template,
+        and record its latency (in seconds)
+        """
+        username = self._bound(username, self.usernames, self.max_usernames)
+        route = self._bound(route, self.routes, self.max_routes)
+        key = (username, route, status_code)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        key = (route, status_class(status_code))
+        histogram = self.latencies.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.latencies[key] = histogram
+        histogram.observe(seconds)
+
+    def snapshot(self) -> Dict:
+        """
+        Return request counts (username -> route -> status code -> count),
+        latency summaries (route -> status class -> percentiles), and
+        process-level histogram summaries and counters
+        """
+        requests = {}
+        for (username, route, status_code), count in self.counts.items():
+            routes = requests.setdefault(username, {})
+            statuses = routes.setdefault(route, {})
+            statuses[status_code] = count
+
+        latencies = {}
+        for (route, status), histogram in self.latencies.items():
+            statuses = latencies.setdefault(route, {})
+            statuses[status] = histogram.summary()
+
+        return {
+            "requests": requests,
+            "latency": latencies,
+            "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
+
+    def to_dict(self) -> Dict:
+        """
+        Return a compact, mergeable representation of all metrics
+        """
+        return {
+            "counts": [
+                [username, route, status_code, count]
+                for (username, route, status_code), count in self.counts.items()
+            ],
+            "latencies": [
+                [route, status, histogram.to_dict()]
+                for (route, status), histogram in self.latencies.items()
+            ],
+            "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+            "counters": dict(self.counters),
+        }
+
+    def merge(self, data: Dict):
+        """
+        Add metrics produced by to_dict() (for example, from
+        another worker) to this instance
+        """
+        for username, route, status_code, count in data["counts"]:
+            username = self._bound(username, self.usernames, self.max_usernames)
+            route = self._bound(route, self.routes, self.max_routes)
+            key = (username, route, status_code)
+            self.counts[key] = self.counts.get(key, 0) + count
+
+        for route, status, histogram_dict in data["latencies"]:
+            route = self._bound(route, self.routes, self.max_routes)
+            key = (route, status)
+            histogram = self.latencies.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.latencies[key] = histogram
+            histogram.merge(LatencyHistogram.from_dict(histogram_dict))
+
+        for name, histogram_dict in data.get("histograms", {}).items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histograms[name] = histogram
+            histogram.merge(LatencyHistogram.from_dict(histogram_dict))
+
+        for name, count in data.get("counters", {}).items():
+            self.increment(name, count)
+
+    def prometheus(self) -> str:
+        """
+        Return metrics in Prometheus text exposition format
+        """
+        lines: List[str] = []
+
+        name = f"{PROMETHEUS_PREFIX}_requests_total"
+        lines.append(f"# HELP {name} Requests by username, route and status code")
+        lines.append(f"# TYPE {name} counter")
+        for (username, route, status_code), count in sorted(self.counts.items()):
+            labels = _labels(username=username, route=route, status_code=status_code)
+            lines.append(f"{name}{{{labels}}} {count}")
+
+        name = f"{PROMETHEUS_PREFIX}_request_duration_seconds"
+        lines.append(f"# HELP {name} Request latency by route and status class")
+        lines.append(f"# TYPE {name} histogram")
+        for (route, status), histogram in sorted(self.latencies.items()):
+            _prometheus_histogram(lines, name, histogram, route=route, status_class=status)
+
+        for counter, count in sorted(self.counters.items()):
+            name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {count}")
+
+        for histogram_name, histogram in sorted(self.histograms.items()):
+            name = f"{PROMETHEUS_PREFIX}_{histogram_name}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            _prometheus_histogram(lines, name, histogram)
+
+        return "\n".join(lines) + "\n"
+
+    def _bound(self, value: str, seen: set, limit: int) -> str:
+        if value in seen:
+            return value
+        if len(seen) >= limit:
+            return OVERFLOW_KEY
+        seen.add(value)
+        return value
+
+
+def _prometheus_histogram(lines: List[str], name: str, histogram: LatencyHistogram, **labels):
+    # Exported buckets are the power-of-two bounds of the
+    # internal buckets (a fixed set, as Prometheus expects)
+    cumulative = 0
+    for i, n in enumerate(histogram.buckets[:NUM_BUCKETS - 1]):
+        cumulative += n
+        if i % BUCKETS_PER_OCTAVE == 0:
+            le = f"{bucket_upper_bound(i):.6g}"
+            lines.append(f"{name}_bucket{{{_labels(**labels, le=le)}}} {cumulative}")
+    lines.append(f"{name}_bucket{{{_labels(**labels, le='+Inf')}}} {histogram.count}")
+    suffix = f"{{{_labels(**labels)}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def status_class(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+def _labels(**labels) -> str:
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        items.append(f'{key}="{value}"')
+    return ",".join(items)
+
+
+def route_template(request) -> str:
+    """
+    Return "METHOD /path/{param}" for the route that served
+    the request, or UNMATCHED_ROUTE if no route matched
+    """
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return UNMATCHED_ROUTE
+    return f"{request.method} {path}"
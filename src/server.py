@@ -6,17 +6,23 @@
 #
 # Created:  2024-04-15 by eric.broda@brodagroupsoftware.com
 
+import asyncio
 import logging
 from datetime import datetime
-from typing import List
+from typing import Any, Callable, Dict, List
 import os
+import signal
 import json
 # import csv
 import yaml
 import time
+from uuid import uuid4
 
-from fastapi import FastAPI, Request, WebSocket, HTTPException
+from fastapi import FastAPI, Request, WebSocket, HTTPException, Depends, Response, Query, Body
 from fastapi.websockets import WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+import httpx
 import uvicorn
 
 # Make accessible other source directories (as needed)
@@ -30,7 +36,24 @@ import state
 from registrar import Registrar
 from bgsexception import BgsException, BgsNotFoundException
 from abstractmetadata import AbstractMetadata
-from middleware import LoggingMiddleware
+from middleware import LoggingMiddleware, route_metrics
+from admission import AdmissionMiddleware
+from routemetrics import RouteMetrics, PROMETHEUS_CONTENT_TYPE
+import supervisor
+import tracing
+import admin
+import profiler
+import memoryprofiler
+import loopmonitor
+import changefeed
+import changelog
+import fingerprint
+import downloadcache
+import embedcache
+import csvprofile
+import artifactfiles
+import artifactevents
+import writebehind
 import constants
 
 # Set up logging
@@ -43,23 +66,47 @@ ENDPOINT_PREFIX = "/api" + ENDPOINT_DATAPRODUCTS
 DEFAULT_HOST="0.0.0.0"
 DEFAULT_PORT=8000
 DEFAULT_CONFIG="./config/config.yaml"
+DEFAULT_WORKERS=1
 STATE_CONFIGURATION = "configuration"
 STATE_REGISTRAR="registrar"
 STATE_METADATA="metadata"
+STATE_LOOP_MONITOR="loop-monitor"
+STATE_FINGERPRINTS="fingerprints"
+STATE_DOWNLOADS="downloads"
+STATE_EMBEDS="embeds"
+STATE_WRITE_BEHIND="write-behind"
+STATE_PROFILES="profiles"
 
 DATAPRODUCT_DIR = "dataproducts"
 METADATA_RETRY_SECONDS = 15
 REGISTRATION_RETRY_SECONDS = 15
 REGISTRATION_FILENAME = "registration.yaml"
+MEDIA_TYPE_JSON = "application/json"
+HEADER_NEXT_CURSOR = "OSC-DM-Next-Cursor"
+HEADER_ETAG = "ETag"
+HEADER_IF_NONE_MATCH = "If-None-Match"
+HEADER_RANGE = "Range"
+HEADER_CONTENT_LENGTH = "Content-Length"
+RELATIONSHIP_ARTIFACT = "artifact"
+MEDIA_TYPE_OCTET_STREAM = "application/octet-stream"
+MAX_BATCH_ARTIFACTS = 1000
+MEDIA_TYPE_EVENT_STREAM = "text/event-stream"
+SSE_KEEPALIVE_SECONDS = 15.0
+WS_CLOSE_POLICY_VIOLATION = 1008
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+METRICS_FORMAT_JSON = "json"
+METRICS_FORMAT_PROMETHEUS = "prometheus"
 
 
 # Set up server
 app = FastAPI()
 app.add_middleware(LoggingMiddleware)
+# Added last so that it runs first (rejects before any other work)
+app.add_middleware(AdmissionMiddleware)
 
 
 @app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/tmp/{path}")
-async def dataproducts_tmp_file_get(uuid: str, path: str):
+async def dataproducts_tmp_file_get(uuid: str, path: str, request: Request, response: Response):
     """
     This is a TEMPORARY endpoint used by the Marketplace UX
     to get samples and metadata where it does not exist yet
@@ -67,8 +114,17 @@ async def dataproducts_tmp_file_get(uuid: str, path: str):
     relative to the configuration directory (usually pointing
     to samples). THIS SHOULD BE REPLACED ONCE SAMPLES AND
     METADATA ARE SUPPORTED!
+
+    Files that have been fingerprinted (see the manifest) are
+    returned with an ETag, and If-None-Match is honoured.
     """
-    response = None
+    indexer: fingerprint.FingerprintIndexer = state.gstate(STATE_FINGERPRINTS)
+    fileprint = indexer.get(path) if indexer else None
+    if fileprint:
+        etag = fingerprint.etag(fileprint)
+        if etag in _etags(request.headers.get(HEADER_IF_NONE_MATCH)):
+            return Response(status_code=304, headers={HEADER_ETAG: etag})
+        response.headers[HEADER_ETAG] = etag
 
     fqpath = None
     try:
@@ -127,80 +183,414 @@ async def dataproducts_tmp_file_get(uuid: str, path: str):
         logger.error(msg)
         raise HTTPException(status_code=500, detail=msg)
 
-    response = data
+    return data
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/manifest", response_model=models.Manifest)
+async def dataproducts_uuid_manifest_get(uuid: str):
+    """
+    Get the size, SHA-256 and (for CSV files) row count of each local
+    file linked by artifacts, as of the given metadata version (files
+    are fingerprinted in the background after each load)
+    """
+    _product_metadata(uuid)
+
+    indexer: fingerprint.FingerprintIndexer = state.gstate(STATE_FINGERPRINTS)
+    if not indexer:
+        msg = "File fingerprinting is not running"
+        logger.error(msg)
+        raise HTTPException(status_code=503, detail=msg)
+
+    response = indexer.manifest
     return response
 
 
-@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}")
-async def dataproducts_uuid_get(uuid: str) -> models.FQProduct:
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}", response_model=models.FQProduct)
+async def dataproducts_uuid_get(uuid: str, fields: str = None):
     """
     Discover product by uuid
+
+    Optionally, "fields" (comma separated) restricts the response to
+    "product" and/or "artifacts", or to some of their fields
+    (for example "product.name,artifacts.uuid,artifacts.name")
     """
-    response = None
+    metadata = _product_metadata(uuid)
 
-    metadata = state.gstate(STATE_METADATA)
-    fqproduct: models.FQProduct = metadata.info()
-    logger.info(f"fqproduct:{fqproduct}")
+    # Metadata is validated and serialized at load time,
+    # so the response is returned as-is (no re-validation)
+    try:
+        data = metadata.product_json(_fields(fields))
+    except ValueError as e:
+        _raise_request_error(e)
+
+    response = Response(content=data, media_type=MEDIA_TYPE_JSON)
+    return response
 
-    # Check to ensure the UUID matches
-    if uuid != fqproduct.product.uuid:
-        msg = f"Invalid uuid:{uuid} (does not match uuid for product)"
-        logger.error(msg)
-        raise HTTPException(status_code=404, detail=msg)
 
-    response = fqproduct
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts", response_model=List[models.Artifact])
+async def dataproducts_uuid_artifacts_get(uuid: str, fields: str = None, limit: int = None,
+                                          cursor: str = None, sort: str = None):
+    """
+    Discover all artifacts for a product
 
+    Optionally, "fields" (comma separated) restricts each
+    artifact to the given fields (for example "uuid,name")
+
+    If any of "limit", "cursor" or "sort" is given, a page of
+    artifacts is returned, sorted by "sort" ("name" by default,
+    "createtimestamp" or "updatetimestamp", prefixed by "-" for
+    descending order). If there are more artifacts, the
+    HEADER_NEXT_CURSOR header contains the cursor for the next page.
+    """
+    metadata = _product_metadata(uuid)
+
+    headers = {}
+    try:
+        if limit is None and cursor is None and sort is None:
+            data = metadata.artifacts_json(_fields(fields))
+        else:
+            data, next_cursor = metadata.artifacts_page(limit, cursor, sort, _fields(fields))
+            if next_cursor:
+                headers[HEADER_NEXT_CURSOR] = next_cursor
+    except ValueError as e:
+        _raise_request_error(e)
+
+    response = Response(content=data, media_type=MEDIA_TYPE_JSON, headers=headers)
     return response
 
 
-@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts")
-async def dataproducts_uuid_artifacts_get(uuid: str) -> List[models.Artifact]:
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/autocomplete", response_model=List[models.Completion])
+async def dataproducts_uuid_autocomplete_get(uuid: str, prefix: str = "", kind: str = None, limit: int = None):
     """
-    Discover all artifacts for a product
+    Complete a prefix (case insensitive) of artifact names and tags,
+    for type-ahead search. Returns up to "limit" completions (10 by
+    default), most frequent first; "kind" ("name" or "tag")
+    restricts completions to names or to tags
+    """
+    metadata = _product_metadata(uuid)
+
+    try:
+        response = metadata.complete(prefix, kind, limit)
+    except ValueError as e:
+        _raise_request_error(e)
+    return response
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/facets", response_model=models.FacetCounts)
+async def dataproducts_uuid_facets_get(uuid: str, facets: str = None, filter: List[str] = Query(None)):
     """
-    response = None
+    Count artifacts per tag, license and security policy value
 
-    # Should check to ensure the UUID matches?
+    Optionally, "facets" (comma separated) restricts the counts to
+    some of "tags", "license" and "securitypolicy", and "filter"
+    ("facet:value", repeated since values may contain commas) counts
+    only artifacts having, for each filtered facet, one of its values
+    (for example "filter=tags:emissions&filter=license:MIT")
+    """
+    metadata = _product_metadata(uuid)
 
-    metadata = state.gstate(STATE_METADATA)
-    fqproduct: models.FQProduct = metadata.info()
+    try:
+        response = metadata.facets(_fields(facets), filter)
+    except ValueError as e:
+        _raise_request_error(e)
+    return response
 
-    # Check to ensure the UUID matches
-    if uuid != fqproduct.product.uuid:
-        msg = f"Invalid uuid:{uuid} (does not match uuid for product)"
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}", response_model=models.Artifact)
+async def dataproducts_uuid_artifacts_get(uuid: str, artifact_uuid: str, fields: str = None,
+                                          embed: str = None):
+    """
+    Discover product artifact by uuid
+
+    Optionally, "fields" (comma separated) restricts the
+    artifact to the given fields (for example "uuid,name")
+
+    Optionally, "embed" (comma separated link relationships, for
+    example "sample,metadata") inlines the small local files linked
+    with those relationships in an "embedded" object, keyed by
+    relationship, so they need not be fetched separately
+    """
+    metadata = _product_metadata(uuid)
+
+    try:
+        data = metadata.artifact_json(artifact_uuid, _fields(fields))
+    except ValueError as e:
+        _raise_request_error(e)
+    if data is None:
+        msg = f"Artifact not found artifact_uuid:{artifact_uuid}"
         logger.error(msg)
         raise HTTPException(status_code=404, detail=msg)
 
-    artifacts: List[models.Artifact] = fqproduct.artifacts
-    response = artifacts
+    relationships = _fields(embed)
+    if relationships:
+        cache: embedcache.EmbedCache = state.gstate(STATE_EMBEDS)
+        if not cache:
+            msg = "Embedding is not available"
+            logger.error(msg)
+            raise HTTPException(status_code=503, detail=msg)
+        artifact = metadata.query(artifact=artifact_uuid)
+        data = embedcache.embed_artifact(data, cache.embedded(artifact.links, relationships))
 
+    response = Response(content=data, media_type=MEDIA_TYPE_JSON)
     return response
 
 
-@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}")
-async def dataproducts_uuid_artifacts_get(uuid: str, artifact_uuid: str) -> models.Artifact:
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}/profile", response_model=models.FileProfile)
+async def dataproducts_uuid_artifacts_profile_get(uuid: str, artifact_uuid: str, relationship: str = "sample"):
     """
-    Discover product artifact by uuid
+    Profile the local CSV file an artifact links with the given
+    relationship (default "sample"): for each column, its type,
+    null count, min and max, distinct count and histogram. Profiles
+    are cached until the file changes, and are then refreshed in
+    the background
     """
-    response = None
+    metadata = _product_metadata(uuid)
+    artifact = _artifact(metadata, artifact_uuid)
 
-    metadata = state.gstate(STATE_METADATA)
-    fqproduct: models.FQProduct = metadata.info()
+    profiler: csvprofile.CsvProfiler = state.gstate(STATE_PROFILES)
+    if not profiler:
+        msg = "Profiling is not available"
+        logger.error(msg)
+        raise HTTPException(status_code=503, detail=msg)
+
+    path = None
+    for link in artifact.links:
+        if link.relationship == relationship:
+            path = fingerprint.local_path(DATAPRODUCT_DIR, link.url)
+            if path and csvprofile.is_profiled(path):
+                break
+            path = None
+    if not path:
+        msg = f"No local CSV file linked artifact_uuid:{artifact_uuid} relationship:{relationship}"
+        logger.error(msg)
+        raise HTTPException(status_code=404, detail=msg)
 
-    # Check to ensure the UUID matches
-    if uuid != fqproduct.product.uuid:
-        msg = f"Invalid uuid:{uuid} (does not match uuid for product)"
+    try:
+        fileprofile = await profiler.get(path)
+    except Exception as e:
+        msg = f"Could not profile path:{path}, exception:{e}"
+        logger.error(msg)
+        raise HTTPException(status_code=500, detail=msg)
+    return fileprofile
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}/download")
+async def dataproducts_uuid_artifacts_download_get(uuid: str, artifact_uuid: str, request: Request):
+    """
+    Download an artifact (its remote "artifact" link) through the
+    download cache; a single byte range may be requested (Range header)
+    """
+    metadata = _product_metadata(uuid)
+
+    artifact: models.Artifact = metadata.query(artifact=artifact_uuid)
+    if artifact is None:
+        msg = f"Artifact not found artifact_uuid:{artifact_uuid}"
         logger.error(msg)
         raise HTTPException(status_code=404, detail=msg)
 
-    artifacts: List[models.Artifact] = fqproduct.artifacts
-    found_artifact: models.Artifact = None
-    for artifact in artifacts:
-        if artifact.uuid == artifact_uuid:
-            found_artifact = artifact
-            break
+    link = _download_link(artifact)
+    if link is None:
+        msg = f"Artifact has no remote link to download artifact_uuid:{artifact_uuid}"
+        logger.error(msg)
+        raise HTTPException(status_code=404, detail=msg)
+
+    cache: downloadcache.DownloadCache = state.gstate(STATE_DOWNLOADS)
+    try:
+        entry, f = await cache.get_file(link.url)
+    except downloadcache.DownloadTooLarge:
+        return await _proxy_download(cache.client(), link, request)
+    except BgsException as e:
+        msg = f"Could not download artifact_uuid:{artifact_uuid} exception:{e}"
+        logger.error(msg)
+        raise HTTPException(status_code=502, detail=msg)
+
+    try:
+        byte_range = downloadcache.byte_range(request.headers.get(HEADER_RANGE), entry.size)
+    except ValueError as e:
+        f.close()
+        logger.error(f"Invalid range, exception:{e}")
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{entry.size}"})
+
+    headers = {"Accept-Ranges": "bytes"}
+    if entry.etag:
+        headers[HEADER_ETAG] = entry.etag
+    if entry.last_modified:
+        headers["Last-Modified"] = entry.last_modified
+    status_code = 200
+    start, end = 0, entry.size - 1
+    if byte_range:
+        status_code = 206
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    # The file was opened by the cache, so the download is served
+    # even if it is evicted (or replaced) while being sent
+    media_type = entry.content_type or link.mimetype or MEDIA_TYPE_OCTET_STREAM
+    return StreamingResponse(_read_range(f, start, end), status_code=status_code,
+                             media_type=media_type, headers=headers)
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/batch", response_model=models.ArtifactBatch)
+async def dataproducts_uuid_artifacts_batch_post(uuid: str, request: models.ArtifactBatchRequest, fields: str = None):
+    """
+    Discover several product artifacts by uuid: returns the artifacts
+    found (in the order requested) and the uuids that were not found
+
+    Optionally, "fields" (comma separated) restricts each
+    artifact to the given fields (for example "uuid,name")
+    """
+    metadata = _product_metadata(uuid)
+
+    if len(request.uuids) > MAX_BATCH_ARTIFACTS:
+        msg = f"Too many artifacts requested:{len(request.uuids)} (maximum:{MAX_BATCH_ARTIFACTS})"
+        logger.error(msg)
+        raise HTTPException(status_code=400, detail=msg)
 
-    response = found_artifact
+    try:
+        data = metadata.artifacts_batch_json(request.uuids, _fields(fields))
+    except ValueError as e:
+        _raise_request_error(e)
+
+    response = Response(content=data, media_type=MEDIA_TYPE_JSON)
+    return response
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts", response_model=models.Artifact, status_code=201,
+          dependencies=[Depends(admin.require_admin), Depends(admin.require_single_worker)])
+async def dataproducts_uuid_artifacts_post(uuid: str, artifact: models.Artifact):
+    """
+    Add an artifact (a new uuid is assigned; link its sample and
+    metadata files, uploaded beforehand, by file name). The artifact
+    is available as soon as the request completes (without a reload)
+    and is written to a new artifact YAML file shortly after
+    """
+    metadata = _product_metadata(uuid)
+    writer: writebehind.WriteBehind = state.gstate(STATE_WRITE_BEHIND)
+
+    artifact = artifact.model_copy(update={"uuid": str(uuid4())})
+    try:
+        source = writer.new_path()
+        updated = metadata.apply(upserts=[artifact], sources={artifact.uuid: source})
+    except Exception as e:
+        _raise_admin_error("add artifact", e)
+    _publish_write(updated, metadata)
+
+    data = updated.artifact_json(artifact.uuid)
+    response = Response(content=data, status_code=201, media_type=MEDIA_TYPE_JSON)
+    return response
+
+
+@app.put(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}", response_model=models.Artifact,
+         dependencies=[Depends(admin.require_admin), Depends(admin.require_single_worker)])
+async def dataproducts_uuid_artifacts_put(uuid: str, artifact_uuid: str, artifact: models.Artifact):
+    """
+    Replace an artifact (its uuid is kept). The change is available
+    as soon as the request completes (without a reload) and is
+    written to the artifact's YAML file shortly after (rewriting the
+    whole file, see artifactfiles.artifact_yaml())
+    """
+    metadata = _product_metadata(uuid)
+    _artifact(metadata, artifact_uuid)
+
+    artifact = artifact.model_copy(update={"uuid": artifact_uuid})
+    return _replace_artifact(metadata, artifact, "replace artifact")
+
+
+@app.patch(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}", response_model=models.Artifact,
+           dependencies=[Depends(admin.require_admin), Depends(admin.require_single_worker)])
+async def dataproducts_uuid_artifacts_patch(uuid: str, artifact_uuid: str,
+                                            changes: Dict[str, Any] = Body(...)):
+    """
+    Update some fields of an artifact (name, description, tags,
+    license, securitypolicy or links; each given field is replaced
+    whole). The change is available as soon as the request completes
+    (without a reload) and is written to the artifact's YAML file
+    shortly after (rewriting the whole file, see
+    artifactfiles.artifact_yaml())
+    """
+    metadata = _product_metadata(uuid)
+    current = _artifact(metadata, artifact_uuid)
+
+    unknown = [field for field in changes if field not in artifactfiles.ARTIFACT_FIELDS]
+    if unknown:
+        _raise_request_error(ValueError(
+            f"Fields can not be updated:{unknown} (valid fields:{artifactfiles.ARTIFACT_FIELDS})"))
+    data = current.model_dump()
+    data.update(changes)
+    try:
+        artifact = models.Artifact(**data)
+    except ValueError as e:
+        _raise_request_error(e)
+    return _replace_artifact(metadata, artifact, "update artifact")
+
+
+@app.delete(ENDPOINT_PREFIX + "/uuid/{uuid}/artifacts/{artifact_uuid}", status_code=204,
+            dependencies=[Depends(admin.require_admin), Depends(admin.require_single_worker)])
+async def dataproducts_uuid_artifacts_delete(uuid: str, artifact_uuid: str):
+    """
+    Remove an artifact. It is gone as soon as the request completes
+    (without a reload) and its YAML file is removed shortly after
+    """
+    metadata = _product_metadata(uuid)
+
+    try:
+        updated = metadata.apply(removals=[artifact_uuid])
+    except Exception as e:
+        _raise_admin_error("remove artifact", e)
+    _publish_write(updated, metadata)
+
+    response = Response(status_code=204)
+    return response
+
+
+@app.put(ENDPOINT_PREFIX + "/uuid/{uuid}/files/{filename}", response_model=models.FileFingerprint,
+         dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_files_put(uuid: str, filename: str, request: Request):
+    """
+    Upload a file (for example, an artifact sample) to the data
+    product directory, from the raw request body. The body is
+    streamed to disk (it is never held in memory) and the file is
+    replaced atomically once complete
+    """
+    metadata = _product_metadata(uuid)
+
+    max_bytes = artifactfiles.max_upload_bytes(state.gstate(STATE_CONFIGURATION))
+    length = request.headers.get(HEADER_CONTENT_LENGTH)
+    if length and length.isdigit() and int(length) > max_bytes:
+        msg = f"Upload is larger than max_bytes:{max_bytes}"
+        logger.error(msg)
+        raise HTTPException(status_code=413, detail=msg)
+
+    try:
+        fqpath = artifactfiles.upload_path(DATAPRODUCT_DIR, filename)
+    except ValueError as e:
+        _raise_request_error(e)
+    try:
+        size, sha256 = await artifactfiles.write_stream(fqpath, request.stream(), max_bytes)
+    except ValueError as e:
+        msg = f"Could not upload filename:{filename}, exception:{e}"
+        logger.error(msg)
+        raise HTTPException(status_code=413, detail=msg)
+    except Exception as e:
+        _raise_admin_error("upload file", e)
+    logger.info(f"Uploaded filename:{filename} size:{size}")
+
+    # Inlined, profiled and fingerprinted copies of a replaced file are stale
+    embeds: embedcache.EmbedCache = state.gstate(STATE_EMBEDS)
+    if embeds:
+        embeds.invalidate(fqpath)
+    profiler: csvprofile.CsvProfiler = state.gstate(STATE_PROFILES)
+    if profiler:
+        profiler.changed(fqpath)
+    indexer: fingerprint.FingerprintIndexer = state.gstate(STATE_FINGERPRINTS)
+    if indexer:
+        indexer.request_refresh(metadata)
+
+    modified = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+    response = models.FileFingerprint(
+        path=filename, size=size, sha256=sha256, rows=None,
+        modifiedtimestamp=modified, artifacts=[])
     return response
 
 
@@ -216,15 +606,112 @@ async def dataproducts_uuid_health_get(uuid: str):
 
 
 @app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/metrics")
-async def dataproducts_uuid_metrics_get(uuid: str):
+async def dataproducts_uuid_metrics_get(uuid: str, format: str = METRICS_FORMAT_JSON):
     """
-    Get metrics information
+    Get metrics information (format is "json" or "prometheus")
     """
-    metrics = LoggingMiddleware.get_metrics()
+    if format == METRICS_FORMAT_PROMETHEUS:
+        metrics = _route_metrics().prometheus()
+        return PlainTextResponse(metrics, media_type=PROMETHEUS_CONTENT_TYPE)
+
+    metrics = _route_metrics().snapshot()
     response = metrics
     return response
 
 
+#####
+# CHANGES
+#####
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/changes", response_model=models.MetadataDelta)
+async def dataproducts_uuid_changes_get(uuid: str, since: int):
+    """
+    Get the changes (artifact uuids added, modified and removed by
+    each reload) since the given version, and the current version.
+    Changed artifacts can be fetched with the batch endpoint. If the
+    changes are no longer held (only the most recent are kept)
+    "resync" is set and the full product should be fetched instead.
+    """
+    _product_metadata(uuid)
+
+    response = changelog.delta(changelog.change_log(), since)
+    return response
+
+
+@app.websocket(ENDPOINT_PREFIX + "/uuid/{uuid}/changes/ws")
+async def dataproducts_uuid_changes_ws(websocket: WebSocket, uuid: str):
+    """
+    Subscribe to metadata changes: upon connection the latest change
+    event (models.MetadataChange, giving the current version) is sent,
+    followed by a change event after each reload. If the subscriber
+    falls behind the connection is closed (code 1013) and the
+    subscriber should reconnect and fetch the current state.
+    """
+    metadata: AbstractMetadata = state.gstate(STATE_METADATA)
+    if uuid != metadata.product().uuid:
+        logger.error(f"Invalid uuid:{uuid} (does not match uuid for product)")
+        await websocket.close(code=WS_CLOSE_POLICY_VIOLATION)
+        return
+
+    feed = changefeed.change_feed()
+    try:
+        subscription = feed.subscribe()
+    except BgsException as e:
+        logger.error(f"Could not subscribe to changes, exception:{e}")
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+        return
+
+    await websocket.accept()
+    sender = asyncio.create_task(_send_changes(websocket, subscription, metadata.changes()))
+    try:
+        # Wait for the client to disconnect (messages from the client are ignored)
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        feed.unsubscribe(subscription)
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/changes/stream")
+async def dataproducts_uuid_changes_stream_get(uuid: str):
+    """
+    Subscribe to metadata changes using server-sent events (same
+    events as the websocket endpoint, as "data" lines); the stream
+    ends if the subscriber falls behind
+    """
+    metadata = _product_metadata(uuid)
+
+    feed = changefeed.change_feed()
+    try:
+        subscription = feed.subscribe()
+    except BgsException as e:
+        msg = f"Could not subscribe to changes, exception:{e}"
+        logger.error(msg)
+        raise HTTPException(status_code=503, detail=msg)
+
+    async def events():
+        try:
+            yield _sse(metadata.changes().model_dump_json())
+            while True:
+                try:
+                    data = await subscription.next(SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if data is None:
+                    logger.warning("Change subscriber fell behind, ending stream")
+                    break
+                yield _sse(data)
+        finally:
+            feed.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache"}
+    return StreamingResponse(events(), media_type=MEDIA_TYPE_EVENT_STREAM, headers=headers)
+
+
 #####
 # MONITOR
 #####
@@ -242,21 +729,304 @@ async def dataproducts_health_get():
 
 
 @app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/metrics")
-async def dataproducts_metrics_get():
+async def dataproducts_metrics_get(format: str = METRICS_FORMAT_JSON):
     """
     Get metrics information
     """
-    metrics = LoggingMiddleware.get_metrics()
+    if format == METRICS_FORMAT_PROMETHEUS:
+        metrics = _route_metrics().prometheus()
+        return PlainTextResponse(metrics, media_type=PROMETHEUS_CONTENT_TYPE)
+
+    metrics = _route_metrics().snapshot()
     response = metrics
     return response
 
 
+#####
+# ADMIN
+#####
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/profile", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_profile_post(uuid: str, seconds: float = 10.0,
+        mode: str = profiler.MODE_SAMPLE, format: str = profiler.FORMAT_TEXT):
+    """
+    Profile the running process for a number of seconds and return
+    collapsed stacks (mode "sample"), or a pstats file or text
+    report (mode "cprofile", format "pstats" or "text")
+    """
+    _product_metadata(uuid)
+
+    try:
+        data = await profiler.profile(seconds, mode=mode, format=format)
+    except Exception as e:
+        _raise_admin_error("profile", e)
+
+    if mode == profiler.MODE_CPROFILE and format == profiler.FORMAT_PSTATS:
+        headers = {"Content-Disposition": 'attachment; filename="profile.pstats"'}
+        return Response(content=data, media_type="application/octet-stream", headers=headers)
+    return PlainTextResponse(data)
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/memory", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_memory_get(uuid: str):
+    """
+    Get allocation tracing status and the approximate size
+    of each object held in global state
+    """
+    _product_metadata(uuid)
+
+    response = memoryprofiler.status()
+    response["state"] = memoryprofiler.sizes(dict(state.global_state))
+    return response
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/memory/start", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_memory_start_post(uuid: str, frames: int = memoryprofiler.DEFAULT_FRAMES):
+    """
+    Start allocation tracing (tracemalloc)
+    """
+    _product_metadata(uuid)
+
+    try:
+        return memoryprofiler.start(frames)
+    except Exception as e:
+        _raise_admin_error("start allocation tracing", e)
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/memory/stop", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_memory_stop_post(uuid: str):
+    """
+    Stop allocation tracing (tracemalloc)
+    """
+    _product_metadata(uuid)
+
+    try:
+        return memoryprofiler.stop()
+    except Exception as e:
+        _raise_admin_error("stop allocation tracing", e)
+
+
+@app.post(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/memory/snapshots", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_memory_snapshots_post(uuid: str, group_by: str = "lineno",
+        limit: int = memoryprofiler.DEFAULT_LIMIT):
+    """
+    Take an allocation snapshot and return its top allocation sites
+    """
+    _product_metadata(uuid)
+
+    try:
+        return memoryprofiler.take_snapshot(group_by, limit)
+    except Exception as e:
+        _raise_admin_error("take snapshot", e)
+
+
+@app.get(ENDPOINT_PREFIX + "/uuid/{uuid}/admin/memory/snapshots/{id}/diff", dependencies=[Depends(admin.require_admin)])
+async def dataproducts_uuid_admin_memory_snapshots_diff_get(uuid: str, id: int, base: int,
+        group_by: str = "lineno", limit: int = memoryprofiler.DEFAULT_LIMIT):
+    """
+    Return the allocation sites that changed most between
+    snapshot "base" and snapshot "id"
+    """
+    _product_metadata(uuid)
+
+    try:
+        return memoryprofiler.diff(base, id, group_by, limit)
+    except Exception as e:
+        _raise_admin_error("compare snapshots", e)
+
+
 #####
 # INTERNAL
 #####
 
 
+def _artifact(metadata: AbstractMetadata, artifact_uuid: str) -> models.Artifact:
+    """
+    Return an artifact, raising 404 if it does not exist
+    """
+    artifact: models.Artifact = metadata.query(artifact=artifact_uuid)
+    if artifact is None:
+        msg = f"Artifact not found artifact_uuid:{artifact_uuid}"
+        logger.error(msg)
+        raise HTTPException(status_code=404, detail=msg)
+    return artifact
+
+
+def _replace_artifact(metadata: AbstractMetadata, artifact: models.Artifact, action: str) -> Response:
+    """
+    Apply a replaced artifact, returning it
+    """
+    try:
+        updated = metadata.apply(upserts=[artifact])
+    except Exception as e:
+        _raise_admin_error(action, e)
+    _publish_write(updated, metadata)
+
+    data = updated.artifact_json(artifact.uuid)
+    response = Response(content=data, media_type=MEDIA_TYPE_JSON)
+    return response
+
+
+def _product_metadata(uuid: str) -> AbstractMetadata:
+    """
+    Return the metadata, checking that uuid is the product uuid
+    """
+    metadata: AbstractMetadata = state.gstate(STATE_METADATA)
+
+    # Check to ensure the UUID matches
+    if uuid != metadata.product().uuid:
+        msg = f"Invalid uuid:{uuid} (does not match uuid for product)"
+        logger.error(msg)
+        raise HTTPException(status_code=404, detail=msg)
+
+    return metadata
+
+
+def _fields(fields: str) -> List[str]:
+    """
+    Return the field names in a comma separated "fields"
+    query parameter (None if no fields are given)
+    """
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    return names or None
+
+
+def _raise_request_error(e: ValueError):
+    msg = f"Invalid request, exception:{e}"
+    logger.error(msg)
+    raise HTTPException(status_code=400, detail=msg)
+
+
+async def _send_changes(websocket: WebSocket, subscription: changefeed.Subscription,
+                        latest: models.MetadataChange):
+    try:
+        await websocket.send_text(latest.model_dump_json())
+        while True:
+            data = await subscription.next()
+            if data is None:
+                logger.warning("Change subscriber fell behind, closing websocket")
+                await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason="Subscriber fell behind")
+                return
+            await websocket.send_text(data)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not send changes, exception:{e}")
+
+
+def _download_link(artifact: models.Artifact) -> models.Resource:
+    """
+    Return the artifact's first remote (http/https) "artifact" link
+    """
+    for link in artifact.links:
+        if link.relationship == RELATIONSHIP_ARTIFACT and link.url.startswith(("http://", "https://")):
+            return link
+    return None
+
+
+# Origin response headers passed on when a download is streamed
+# (the body is passed on as received, so its encoding is too)
+PROXIED_HEADERS = ["Accept-Ranges", "Content-Encoding", "Content-Length", "Content-Range", HEADER_ETAG, "Last-Modified"]
+
+
+async def _proxy_download(client: httpx.AsyncClient, link: models.Resource, request: Request) -> Response:
+    """
+    Stream a download (too large to cache) from the origin,
+    passing on the requested byte range (if any)
+    """
+    headers = {}
+    if request.headers.get(HEADER_RANGE):
+        headers[HEADER_RANGE] = request.headers.get(HEADER_RANGE)
+    try:
+        response = await client.send(client.build_request("GET", link.url, headers=headers), stream=True)
+    except httpx.HTTPError as e:
+        msg = f"Could not download url:{link.url} exception:{e}"
+        logger.error(msg)
+        raise HTTPException(status_code=502, detail=msg)
+    if response.status_code not in [200, 206, 416]:
+        await response.aclose()
+        msg = f"Could not download url:{link.url} status_code:{response.status_code}"
+        logger.error(msg)
+        raise HTTPException(status_code=502, detail=msg)
+
+    logger.info(f"Streaming download (not cached) url:{link.url}")
+    headers = {name: response.headers[name] for name in PROXIED_HEADERS if name in response.headers}
+    media_type = response.headers.get("Content-Type") or link.mimetype or MEDIA_TYPE_OCTET_STREAM
+    return StreamingResponse(response.aiter_raw(downloadcache.CHUNK_SIZE), status_code=response.status_code,
+                             media_type=media_type, headers=headers, background=BackgroundTask(response.aclose))
+
+
+async def _read_range(f, start: int, end: int):
+    try:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(downloadcache.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _sse(data: str) -> str:
+    return f"data: {data}\n\n"
+
+
+def _etags(header: str) -> List[str]:
+    """
+    Return the entity tags in an If-None-Match header
+    """
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+
+def _raise_admin_error(action: str, e: Exception):
+    """
+    Raise the HTTPException matching an administration failure
+    """
+    msg = f"Could not {action}, exception:{e}"
+    logger.error(msg)
+    if isinstance(e, ValueError):
+        raise HTTPException(status_code=400, detail=msg)
+    if isinstance(e, BgsNotFoundException):
+        raise HTTPException(status_code=404, detail=msg)
+    if isinstance(e, BgsException):
+        raise HTTPException(status_code=409, detail=msg)
+    raise HTTPException(status_code=500, detail=msg)
+
+
+def _route_metrics() -> RouteMetrics:
+    """
+    Return metrics for this process or, when running under
+    a supervisor, aggregated across all worker processes
+    """
+    metrics = route_metrics()
+    current = supervisor.worker()
+    if current:
+        metrics = current.slots.aggregate(current.slot, metrics)
+    return metrics
+
+
+@tracing.traced("load_metadata")
 def _load_metadata():
+    previous: AbstractMetadata = state.gstate(STATE_METADATA)
+    metadata = _read_metadata(previous)
+    _publish_metadata(metadata, previous)
+
+
+def _read_metadata(previous: AbstractMetadata) -> AbstractMetadata:
+    """
+    Load the metadata (compared against previous), retrying until it
+    loads. Previous is only read (its search indexes are copied before
+    being updated), so this can run in a thread other than the event
+    loop's while previous serves requests
+    """
     from metadatafactory import MetadataFactory
     factory = MetadataFactory()
     metadata_dir = "dataproducts"
@@ -265,10 +1035,9 @@ def _load_metadata():
     while True:
         try:
             metadata = factory.new_instance("simple", directory=metadata_dir)
-            metadata.load()
-            state.gstate(STATE_METADATA, metadata)
-            logger.info("Metadata load SUCCESS")
-            break
+            metadata.load(previous)
+            logger.info(f"Metadata load SUCCESS version:{metadata.changes().version}")
+            return metadata
         except Exception as e:
             msg = (
                 f"Metadata load FAILED, "
@@ -279,6 +1048,57 @@ def _load_metadata():
             time.sleep(METADATA_RETRY_SECONDS)
 
 
+def _publish_metadata(metadata: AbstractMetadata, previous: AbstractMetadata):
+    """
+    Make metadata the current metadata, and record and publish its changes
+    """
+    # The address is set upon registration (by the supervisor, before
+    # workers are started), not read from the files, so it is kept
+    if previous and metadata.product().address is None:
+        metadata.product().address = previous.product().address
+    state.gstate(STATE_METADATA, metadata)
+    changelog.change_log().append(metadata.changes())
+    indexer: fingerprint.FingerprintIndexer = state.gstate(STATE_FINGERPRINTS)
+    if indexer:
+        indexer.request_refresh(metadata)
+    if previous:
+        changefeed.change_feed().publish(metadata.changes())
+
+
+def _publish_write(metadata: AbstractMetadata, previous: AbstractMetadata):
+    """
+    Make metadata changed through the API the current metadata,
+    and schedule writing the changed files
+    """
+    changes: models.MetadataChange = metadata.changes()
+    if not (changes.added or changes.modified or changes.removed):
+        return
+    writer: writebehind.WriteBehind = state.gstate(STATE_WRITE_BEHIND)
+    for artifact_uuid in changes.added + changes.modified:
+        writer.schedule(metadata.source(artifact_uuid), metadata.query(artifact=artifact_uuid))
+    for artifact_uuid in changes.removed:
+        writer.schedule(previous.source(artifact_uuid), None)
+    # The UUIDs file only changes if artifacts are added, removed or renamed
+    if _artifact_uuids(metadata) != _artifact_uuids(previous):
+        writer.schedule_uuids(metadata.uuids())
+
+    # Only available without a supervisor (admin.require_single_worker),
+    # so this process also sends the artifact events
+    _publish_metadata(metadata, previous)
+    _publish_artifact_events()
+
+
+def _artifact_uuids(metadata: AbstractMetadata) -> Dict[str, str]:
+    """
+    Return the artifact uuids by name
+    """
+    artifact_uuids = {}
+    for item in metadata.uuids().artifact_uuids:
+        artifact_uuids.update(item)
+    return artifact_uuids
+
+
+@tracing.traced("register")
 def _register():
 
     registrar: Registrar = state.gstate(STATE_REGISTRAR)
@@ -293,8 +1113,7 @@ def _register():
     # product.uuid = uuids_dict["product_uuid"]
     # product.address = address
 
-    fqproduct: models.FQProduct = metadata.info()
-    product = fqproduct.product
+    product: models.Product = metadata.product()
     product.address = product_address
     product_dict = dict(product)
 
@@ -365,6 +1184,48 @@ def _register():
 @app.on_event("startup")
 async def startup_event():
     path = DATAPRODUCT_DIR
+
+    # Measure event loop lag and report blocking calls
+    configuration = state.gstate(STATE_CONFIGURATION)
+    monitor = loopmonitor.from_configuration(configuration, route_metrics())
+    monitor.start()
+    state.gstate(STATE_LOOP_MONITOR, monitor)
+
+    # Fingerprint local files linked by artifacts in the background
+    indexer = fingerprint.from_configuration(configuration, path)
+    indexer.start()
+    indexer.request_refresh(state.gstate(STATE_METADATA))
+    state.gstate(STATE_FINGERPRINTS, indexer)
+
+    # Cache remote artifact downloads (per worker, if any)
+    current = supervisor.worker()
+    slot = current.slot if current else None
+    cache = downloadcache.from_configuration(configuration, utilities.http_client, slot)
+    state.gstate(STATE_DOWNLOADS, cache)
+
+    # Inline small linked files (embed) from a cache invalidated on changes
+    state.gstate(STATE_EMBEDS, embedcache.from_configuration(configuration, path))
+
+    # Profile linked CSV files on request (refreshed when they change)
+    state.gstate(STATE_PROFILES, csvprofile.from_configuration(configuration, path))
+
+    # Write artifacts changed through the API in the background
+    writer = writebehind.from_configuration(configuration, path)
+    writer.start()
+    state.gstate(STATE_WRITE_BEHIND, writer)
+
+    if current:
+        # Under a supervisor the directory watcher runs once (in the
+        # supervisor), which signals each worker when to reload
+        logger.info(f"Worker slot:{current.slot} waiting for reload signals")
+        requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, requested.set)
+        supervisor.unblock_reloads()
+        asyncio.create_task(_reload_metadata_worker(requested))
+        asyncio.create_task(supervisor.publish_metrics(route_metrics))
+        return
+
     logger.info(f"Initializing file monitor path:{path}")
     logger.info(f"Contents of Dataproduct directory:{os.listdir(path)}")
     logger.info(f"Startup path:{path}")
@@ -372,11 +1233,62 @@ async def startup_event():
     asyncio.create_task(watch_directory(path))
 
 
-import asyncio
+@app.on_event("shutdown")
+async def shutdown_event():
+    indexer: fingerprint.FingerprintIndexer = state.gstate(STATE_FINGERPRINTS)
+    if indexer:
+        indexer.stop()
+    profiler: csvprofile.CsvProfiler = state.gstate(STATE_PROFILES)
+    if profiler:
+        profiler.stop()
+    writer: writebehind.WriteBehind = state.gstate(STATE_WRITE_BEHIND)
+    if writer:
+        writer.stop()
+    batcher: artifactevents.ArtifactEventBatcher = state.gstate(artifactevents.STATE_ARTIFACT_EVENTS)
+    if batcher:
+        await batcher.stop()
+    await utilities.close_http_client()
+
+
+async def _reload_metadata_worker(requested: asyncio.Event):
+    """
+    Reload the metadata each time the supervisor requests it (requests
+    made during a reload are coalesced into one more reload). Files are
+    read in a thread, so a slow or failing load does not stall requests
+    """
+    while True:
+        await requested.wait()
+        requested.clear()
+        logger.info("Metadata (reload) initiated by supervisor")
+        # The supervisor does not say which files changed
+        embeds: embedcache.EmbedCache = state.gstate(STATE_EMBEDS)
+        if embeds:
+            embeds.invalidate()
+        profiler: csvprofile.CsvProfiler = state.gstate(STATE_PROFILES)
+        if profiler:
+            profiler.changed()
+        _flush_writes()
+        previous: AbstractMetadata = state.gstate(STATE_METADATA)
+        metadata = await asyncio.to_thread(_read_metadata, previous)
+        _publish_metadata(metadata, previous)
+        logger.info("Metadata (reload) complete")
+
+
+def _flush_writes():
+    """
+    Write pending changes made through the API, so a reload
+    (which reads the files) does not lose them
+    """
+    writer: writebehind.WriteBehind = state.gstate(STATE_WRITE_BEHIND)
+    if writer:
+        writer.flush()
+
+
 from watchgod import awatch, Change
-async def watch_directory(path: str):
+async def watch_directory(path: str, on_reload: Callable[[], None] = None):
     async for changes in awatch(path):
         logger.info(f"Changes detected: {changes}")
+        reload = False
         for change in changes:
             event, path = change
 
@@ -390,6 +1302,18 @@ async def watch_directory(path: str):
                 if event != Change.deleted:
                     continue
 
+            embeds: embedcache.EmbedCache = state.gstate(STATE_EMBEDS)
+            if embeds:
+                embeds.invalidate(path)
+            profiler: csvprofile.CsvProfiler = state.gstate(STATE_PROFILES)
+            if profiler:
+                profiler.changed(path)
+
+            # Ignore files being written, and files written by this
+            # process (already applied)
+            if artifactfiles.is_temporary(path) or artifactfiles.self_writes().is_self_write(path):
+                continue
+
             if event == Change.added:
                 logger.info(f"ADD:{path}")
             elif event == Change.modified:
@@ -398,11 +1322,35 @@ async def watch_directory(path: str):
                 logger.info(f"DELETE:{path}")
             else:
                 continue
+            reload = True
+
+        # Reload once for all of the changes detected together
+        # (each reload produces a new version and change event)
+        if not reload:
+            continue
+        logger.info("Registration/metadata (reload) initiated")
+        _flush_writes()
+        _load_metadata()
+        _register()
+        _publish_artifact_events()
+        if on_reload:
+            on_reload()
+        logger.info("Registration/metadata (reload) complete")
+
+
+def _publish_artifact_events():
+    """
+    Send the artifacts changed by the last reload to the registrar
+    (batched; only the process that registers the product sends them)
+    """
+    batcher = artifactevents.artifact_events()
+    if batcher:
+        metadata: AbstractMetadata = state.gstate(STATE_METADATA)
+        batcher.publish(metadata.changes(), metadata)
+
 
-            logger.info("Registration/metadata (reload) initiated")
-            _load_metadata()
-            _register()
-            logger.info("Registration/metadata (reload) complete")
+def _watch_directory_supervisor(on_reload: Callable[[], None]):
+    asyncio.run(watch_directory(DATAPRODUCT_DIR, on_reload))
 
 
 if __name__ == "__main__":
@@ -413,6 +1361,7 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default=DEFAULT_HOST, help=f"Host for the server (default: {DEFAULT_HOST})")
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port for the server (default: {DEFAULT_PORT})")
     parser.add_argument("--configuration", default=DEFAULT_CONFIG, help=f"Configuration file (default: {DEFAULT_CONFIG})")
+    parser.add_argument("--workers", type=int, default=None, help=f"Number of worker processes (default: {DEFAULT_WORKERS}, or product.workers in configuration)")
     args = parser.parse_args()
 
     # Show directory file contents (for debugging)
@@ -431,9 +1380,15 @@ if __name__ == "__main__":
     state.gstate(STATE_CONFIGURATION, configuration)
     logger.info(f"Using configuration:{configuration}")
 
+    # Set up tracing (spans for load, register and each request)
+    tracing.setup(configuration, app)
+
     # Get host and port from configuration
     host = configuration["product"]["host"]
     port = configuration["product"]["port"]
+    workers = args.workers
+    if workers is None:
+        workers = configuration["product"].get("workers", DEFAULT_WORKERS)
 
     # Get host and port for registrar (via proxy)
     registrar_host = configuration["proxy"]["host"]
@@ -453,8 +1408,11 @@ if __name__ == "__main__":
 
     # Start the service
     try:
-        logger.info(f"Starting service on host:{host} port:{port}")
-        uvicorn.run(app, host=host, port=port)
+        logger.info(f"Starting service on host:{host} port:{port} workers:{workers}")
+        if workers > 1:
+            supervisor.Supervisor(app, host, port, workers, _watch_directory_supervisor).run()
+        else:
+            uvicorn.run(app, host=host, port=port)
     except Exception as e:
         logger.info(f"Stopping server, exception:{e}")
     finally:
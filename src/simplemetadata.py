@@ -6,24 +6,81 @@
 #
 # Created:  2024-04-15 by eric.broda@brodagroupsoftware.com
 
+import copy
 import logging
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Optional, Tuple
 from typing import List
+from collections import OrderedDict
 import yaml
 import json
 import os
 from datetime import datetime
 
 from abstractmetadata import AbstractMetadata
+from artifactstore import ArtifactRecord, ArtifactStore
+from facets import FacetIndex, parse_facets, parse_filters
+from prefixindex import PrefixIndex
 from bgsexception import BgsException, BgsNotFoundException
+import artifactstore
 import models
+import pagination
+import tracing
 
 # Set up logging
 LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 logger = logging.getLogger(__name__)
 
+# Use the (much faster) LibYAML based loader when available
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Number of artifact projections ("fields" selections) whose
+# serialized JSON is kept, least recently used are discarded
+MAX_PROJECTIONS = 32
+# Total size of the lists of all artifacts kept for projections (each
+# can be as large as the catalog), least recently used are discarded
+MAX_PROJECTION_BYTES = 64 * 1024 * 1024
+
+FIELD_PRODUCT = "product"
+FIELD_ARTIFACTS = "artifacts"
+
+# Completions (autocomplete) of artifact names and tags
+KIND_NAME = "name"
+KIND_TAG = "tag"
+DEFAULT_COMPLETIONS = 10
+MAX_COMPLETIONS = 100
+# On reload, the completion and facet indexes are updated for the changed
+# artifacts unless more than this fraction of them changed
+MAX_INCREMENTAL_FRACTION = 0.1
+
+
+class _Projection():
+    """
+    Artifacts serialized with only the included fields; the
+    list of all artifacts is serialized on first use and then
+    kept while the projection is cached
+    """
+
+    def __init__(self, store: ArtifactStore, include: frozenset):
+        self.store = store
+        # Fields in model order, so output matches the full artifact's
+        self.fields = tuple(field for field in models.Artifact.model_fields if field in include)
+        self._artifacts_json: bytes = None
+
+    def artifact_json(self, record: ArtifactRecord) -> bytes:
+        return self.store.project(record, self.fields)
+
+    def size(self) -> int:
+        return 0 if self._artifacts_json is None else len(self._artifacts_json)
+
+    def artifacts_json(self) -> bytes:
+        if self._artifacts_json is None:
+            self._artifacts_json = b"[" + b",".join(
+                self.artifact_json(record) for record in self.store) + b"]"
+        return self._artifacts_json
+
+
 class SimpleMetadata(AbstractMetadata):
     """
     SimpleMetadata is a concrete implementation of the AbstractMetadata class.
@@ -55,19 +112,427 @@ class SimpleMetadata(AbstractMetadata):
         logger.info(f"Using artifact UUIDs:{self.artifact_uuids}")
 
 
-    def load(self):
-        self.metadata: models.FQProduct = self._load_metadata()
-        logger.info(f"Loaded metadata:{self.metadata}")
+    @tracing.traced("SimpleMetadata.load")
+    def load(self, previous: AbstractMetadata = None):
+        product, artifacts = self._load_metadata()
+        logger.info(f"Loaded product:{product} artifacts:{len(artifacts)}")
+        self._compare(artifacts, previous)
+        self._index(product, artifacts)
+        self._index_search(previous)
+
+
+    def apply(self, upserts: List[models.Artifact] = None, removals: List[str] = None,
+              sources: Dict[str, str] = None) -> "SimpleMetadata":
+        """
+        Return new metadata (the next version) with artifacts added
+        or replaced (by uuid) and removed, without reading any files.
+        Upserts that do not change an artifact are ignored. Added
+        artifacts are persisted to the files given in sources (by
+        uuid). This metadata is being replaced (its search indexes
+        are reused).
+
+        Raises:
+            BgsNotFoundException: if an artifact to remove does not exist
+            BgsException: if an artifact's name is used by another artifact
+        """
+        now = datetime.now().isoformat(sep=' ', timespec='milliseconds')
+        product = self.store.product
+        names = dict(self.artifact_uuids)
+
+        removed = []
+        for artifact_uuid in dict.fromkeys(removals or []):
+            record = self.store.get(artifact_uuid)
+            if record is None:
+                raise BgsNotFoundException(f"Artifact not found artifact_uuid:{artifact_uuid}")
+            names.pop(record.name, None)
+            removed.append(artifact_uuid)
+
+        added = []
+        modified = []
+        replaced: Dict[str, models.Artifact] = {}
+        for artifact in upserts or []:
+            old = self.store.get(artifact.uuid)
+            if artifact.uuid in removed or (old is not None and artifactstore.content(artifact) == artifactstore.content(old)):
+                continue
+            owner = names.get(artifact.name)
+            if owner is not None and owner != artifact.uuid:
+                raise BgsException(f"Artifact name:{artifact.name} is already used by artifact_uuid:{owner}")
+            artifact = artifact.model_copy(update={
+                "productuuid": product.uuid,
+                "productnamespace": product.namespace,
+                "productname": product.name,
+                "createtimestamp": old.createtimestamp if old else now,
+                "updatetimestamp": now,
+            })
+            if old is None:
+                added.append(artifact.uuid)
+            else:
+                modified.append(artifact.uuid)
+                if old.name != artifact.name:
+                    names.pop(old.name, None)
+            # (an unchanged name keeps its position in the UUIDs file)
+            names[artifact.name] = artifact.uuid
+            replaced[artifact.uuid] = artifact
+
+        metadata = copy.copy(self)
+        metadata.artifact_uuids = names
+        metadata.sources = dict(self.sources)
+        for artifact_uuid in removed:
+            metadata.sources.pop(artifact_uuid, None)
+        for artifact_uuid in added:
+            if sources and artifact_uuid in sources:
+                metadata.sources[artifact_uuid] = sources[artifact_uuid]
+        metadata._changes = models.MetadataChange(
+            version=self._changes.version + 1,
+            added=added,
+            modified=modified,
+            removed=removed,
+            createtimestamp=now,
+        )
+
+        # Unchanged artifacts (and their JSON) are carried over as-is,
+        # and replaced ones keep their position
+        store = ArtifactStore(product)
+        dropped = set(removed)
+        for record in self.store:
+            if record.uuid in replaced:
+                store.add(replaced.pop(record.uuid))
+            elif record.uuid not in dropped:
+                store.add_record(record, self.store.json(record.uuid))
+        for artifact in replaced.values():
+            store.add(artifact)
+        metadata._index_store(store)
+        metadata._index_search(self)
+        logger.info(f"Applied version:{metadata._changes.version} added:{len(added)} modified:{len(modified)} removed:{len(removed)}")
+        return metadata
+
+
+    def info(self) -> models.FQProduct:
+        """
+        Return the product and its artifacts; artifacts are held
+        in compact form, so this creates a model for each of them
+        (use product(), artifacts() or query() where possible)
+        """
+        artifacts = [self.store.model(record) for record in self.store]
+        return models.FQProduct.model_construct(product=self.store.product, artifacts=artifacts)
+
+
+    def uuids(self) -> models.UUIDs:
+        artifact_uuids = [{name: artifact_uuid} for name, artifact_uuid in self.artifact_uuids.items()]
+        return models.UUIDs(product_uuid=self.product_uuid, artifact_uuids=artifact_uuids)
+
+
+    def source(self, artifact_uuid: str) -> Optional[str]:
+        return self.sources.get(artifact_uuid)
+
+
+    def product(self) -> models.Product:
+        return self.store.product
+
 
+    def artifacts(self) -> Iterable[ArtifactRecord]:
+        return self.store
 
-    def info(self):
-        return self.metadata
+
+    def changes(self) -> models.MetadataChange:
+        return self._changes
 
 
     def query(self, **kwargs):
         logger.info(f"Querying kwargs:{kwargs}")
-        self.artifact_uuid = self._param(kwargs, "artifact")
-        # Find the artifact by UUID in the metadata cache (cache is self.metadata)
+        artifact_uuid = self._param(kwargs, "artifact")
+        record = self.store.get(artifact_uuid)
+        return None if record is None else self.store.model(record)
+
+
+    def product_json(self, fields: List[str] = None) -> bytes:
+        """
+        Return the FQProduct as JSON. Artifacts are serialized once
+        at load; the product is serialized on each call since it is
+        small and its address is set after load (upon registration)
+
+        Fields may name "product" or "artifacts" (included whole)
+        or a field of either ("product.name", "artifacts.uuid")
+        """
+        product_fields, artifact_fields = self._split_fields(fields)
+        parts = []
+        if product_fields is not None:
+            include = self._include(models.Product, product_fields)
+            product = self.store.product.model_dump_json(include=include).encode("utf-8")
+            parts.append(b'"product":' + product)
+        if artifact_fields is not None:
+            parts.append(b'"artifacts":' + self.artifacts_json(artifact_fields))
+        return b"{" + b",".join(parts) + b"}"
+
+
+    def artifacts_json(self, fields: List[str] = None) -> bytes:
+        """
+        Return the list of all artifacts as JSON (serialized at load,
+        or on first use of a projection)
+        """
+        if not fields:
+            return self.store.buffer
+        data = self._projection(fields).artifacts_json()
+        self._limit_projections()
+        return data
+
+
+    def artifact_json(self, artifact_uuid: str, fields: List[str] = None) -> bytes:
+        """
+        Return an artifact as JSON (serialized at load, or on first
+        use of a projection), or None if there is no artifact with the uuid
+        """
+        if not fields:
+            return self.store.json(artifact_uuid)
+        projection = self._projection(fields)
+        record = self.store.get(artifact_uuid)
+        if record is None:
+            return None
+        return projection.artifact_json(record)
+
+
+    def artifacts_batch_json(self, artifact_uuids: List[str], fields: List[str] = None) -> bytes:
+        """
+        Return the artifacts with the given uuids (in the order
+        requested, once each) and the uuids that were not found
+        as an ArtifactBatch in JSON
+        """
+        projection = self._projection(fields) if fields else None
+        data = []
+        missing = []
+        for artifact_uuid in dict.fromkeys(artifact_uuids):
+            record = self.store.get(artifact_uuid)
+            if record is None:
+                missing.append(artifact_uuid)
+            elif projection:
+                data.append(projection.artifact_json(record))
+            else:
+                data.append(self.store.json(artifact_uuid))
+        missing_json = json.dumps(missing, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return b'{"artifacts":[' + b",".join(data) + b'],"missing":' + missing_json + b"}"
+
+
+    def complete(self, prefix: str, kind: str = None, limit: int = None) -> List[models.Completion]:
+        """
+        Return up to limit completions of prefix among artifact
+        names and/or tags, most frequent first
+        """
+        if limit is None:
+            limit = DEFAULT_COMPLETIONS
+        if limit < 1 or limit > MAX_COMPLETIONS:
+            raise ValueError(f"Invalid limit:{limit} (must be between 1 and {MAX_COMPLETIONS})")
+        if kind is not None and kind not in self._completions:
+            raise ValueError(f"Invalid kind:{kind} (valid kinds:{list(self._completions)})")
+
+        kinds = [kind] if kind else list(self._completions)
+        completions = [
+            (text, count, each)
+            for each in kinds
+            for text, count in self._completions[each].complete(prefix, limit)
+        ]
+        if len(kinds) > 1:
+            completions.sort(key=lambda completion: (-completion[1], completion[0].casefold()))
+        return [
+            models.Completion(text=text, kind=each, count=count)
+            for text, count, each in completions[:limit]
+        ]
+
+
+    def facets(self, facets: List[str] = None, filters: List[str] = None) -> models.FacetCounts:
+        """
+        Return the number of artifacts with each value of the given
+        facets (all if none), counting only artifacts that match the
+        "facet:value" filters if any
+        """
+        facets = parse_facets(facets)
+        total, counts = self._facets.counts(facets, parse_filters(filters))
+        return models.FacetCounts(total=total, facets=counts)
+
+
+    def artifacts_page(self, limit: int = None, cursor: str = None,
+                       sort: str = None, fields: List[str] = None):
+        """
+        Return a page of artifacts as JSON, and the cursor for the
+        next page (None if this is the last page)
+        """
+        limit = pagination.check_limit(limit)
+        field, descending = pagination.parse_sort(sort)
+        sort = sort or pagination.DEFAULT_SORT
+        after = pagination.decode_cursor(cursor, sort) if cursor else None
+
+        records, last = self._sort_orders[field].page(limit, after, descending)
+        if fields:
+            projection = self._projection(fields)
+            data = [projection.artifact_json(record) for record in records]
+        else:
+            data = [self.store.json(record.uuid) for record in records]
+
+        next_cursor = pagination.encode_cursor(sort, last) if last else None
+        return b"[" + b",".join(data) + b"]", next_cursor
+
+
+    def _compare(self, artifacts: List[models.Artifact], previous: AbstractMetadata):
+        """
+        Compare the loaded artifacts with those of the previous metadata
+        to find the changes and set the version. Unchanged artifacts
+        keep their timestamps (and modified ones their createtimestamp)
+        so that reloading does not make every artifact appear updated
+        """
+        previous_artifacts = {}
+        version = 1
+        if previous:
+            previous_artifacts = {artifact.uuid: artifact for artifact in previous.artifacts()}
+            version = previous.changes().version + 1
+
+        added = []
+        modified = []
+        for artifact in artifacts:
+            old = previous_artifacts.get(artifact.uuid)
+            if old is None:
+                added.append(artifact.uuid)
+                continue
+            artifact.createtimestamp = old.createtimestamp
+            if artifactstore.content(artifact) == artifactstore.content(old):
+                artifact.updatetimestamp = old.updatetimestamp
+            else:
+                modified.append(artifact.uuid)
+        current = {artifact.uuid for artifact in artifacts}
+        removed = [uuid for uuid in previous_artifacts if uuid not in current]
+
+        self._changes = models.MetadataChange(
+            version=version,
+            added=added,
+            modified=modified,
+            removed=removed,
+            createtimestamp=datetime.now().isoformat(sep=' ', timespec='milliseconds'),
+        )
+        logger.info(f"Loaded version:{version} added:{len(added)} modified:{len(modified)} removed:{len(removed)}")
+
+
+    def _index(self, product: models.Product, artifacts: List[models.Artifact]):
+        """
+        Move the artifacts into the compact store (serializing each
+        once, so that requests do not re-validate or re-serialize
+        artifacts) and build the sort orders
+        """
+        store = ArtifactStore(product)
+        for artifact in artifacts:
+            store.add(artifact)
+        self._index_store(store)
+
+
+    def _index_store(self, store: ArtifactStore):
+        store.finish()
+        self.store = store
+        self._projections: "OrderedDict[frozenset, _Projection]" = OrderedDict()
+        self._sort_orders: Dict[str, pagination.SortOrder] = {
+            field: pagination.SortOrder(field, self.store.records)
+            for field in pagination.SORT_FIELDS
+        }
+
+
+    def _index_search(self, previous: AbstractMetadata):
+        """
+        Build the prefix indexes of artifact names and tags, and the
+        facet index or, on reload, update copies of those of the
+        previous metadata for the artifacts that changed (the previous
+        metadata may still be serving requests, so it is not changed)
+        """
+        changes = self._changes
+        changed = len(changes.added) + len(changes.modified) + len(changes.removed)
+        completions = getattr(previous, "_completions", None)
+        facet_index = getattr(previous, "_facets", None)
+        if completions is None or facet_index is None or changed > MAX_INCREMENTAL_FRACTION * len(self.store):
+            self._completions: Dict[str, PrefixIndex] = {
+                KIND_NAME: PrefixIndex(record.name for record in self.store),
+                KIND_TAG: PrefixIndex(tag for record in self.store for tag in record.tags),
+            }
+            self._facets = FacetIndex(self.store)
+            return
+
+        completions = {kind: index.copy() for kind, index in completions.items()}
+        facet_index = facet_index.copy()
+        names = completions[KIND_NAME]
+        tags = completions[KIND_TAG]
+        for artifact_uuid in changes.modified + changes.removed:
+            record = previous.store.get(artifact_uuid)
+            names.remove(record.name)
+            for tag in record.tags:
+                tags.remove(tag)
+            facet_index.remove(record)
+        for artifact_uuid in changes.added + changes.modified:
+            record = self.store.get(artifact_uuid)
+            names.add(record.name)
+            for tag in record.tags:
+                tags.add(tag)
+            facet_index.add(record)
+        self._completions = completions
+        self._facets = facet_index
+
+
+    def _projection(self, fields: List[str]) -> _Projection:
+        """
+        Return the (cached) projection of artifacts to the given fields
+        """
+        include = self._include(models.Artifact, fields)
+        projection = self._projections.get(include)
+        if projection is None:
+            projection = _Projection(self.store, include)
+            self._projections[include] = projection
+            while len(self._projections) > MAX_PROJECTIONS:
+                self._projections.popitem(last=False)
+        else:
+            self._projections.move_to_end(include)
+        return projection
+
+
+    def _limit_projections(self):
+        """
+        Discard the least recently used projections until those
+        cached fit within MAX_PROJECTION_BYTES (including the one
+        just used, if it alone is larger)
+        """
+        total = sum(projection.size() for projection in self._projections.values())
+        while total > MAX_PROJECTION_BYTES:
+            _, projection = self._projections.popitem(last=False)
+            total -= projection.size()
+
+
+    def _include(self, model, fields: List[str]) -> frozenset:
+        """
+        Return the fields to include (None for all fields)
+        """
+        if not fields:
+            return None
+        unknown = [field for field in fields if field not in model.model_fields]
+        if unknown:
+            raise ValueError(f"Unknown fields:{unknown} for {model.__name__} (valid fields:{list(model.model_fields)})")
+        return frozenset(fields)
+
+
+    def _split_fields(self, fields: List[str]):
+        """
+        Split product response fields into product and artifact
+        fields; each is None if excluded, or an empty list if
+        included whole
+        """
+        if not fields:
+            return [], []
+        selected = {FIELD_PRODUCT: None, FIELD_ARTIFACTS: None}
+        whole = set()
+        for field in fields:
+            name, _, subfield = field.partition(".")
+            if name not in selected:
+                raise ValueError(f"Unknown field:{field} (must be {FIELD_PRODUCT}[.<field>] or {FIELD_ARTIFACTS}[.<field>])")
+            if selected[name] is None:
+                selected[name] = []
+            if subfield:
+                selected[name].append(subfield)
+            else:
+                whole.add(name)
+        for name in whole:
+            selected[name] = []
+        return selected[FIELD_PRODUCT], selected[FIELD_ARTIFACTS]
 
 
     def _load_uuids(self):
@@ -82,7 +547,7 @@ class SimpleMetadata(AbstractMetadata):
         uuids: models.UUIDs = None
         with open(file_path, 'r') as f:
             try:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=YamlLoader)
                 uuids = models.UUIDs(**data)
             except yaml.YAMLError as e:
                 msg = f"Error reading YAML file:{file_path}, exception:{e}"
@@ -99,8 +564,7 @@ class SimpleMetadata(AbstractMetadata):
         the directory specified by the 'directory' attribute of this class.
 
         Returns:
-            models.FQProduct: A fully qualified data product object representing the loaded metadata,
-            which includes product information, a list of artifacts, and publisher data.
+            The product (models.Product) and its artifacts (List[models.Artifact]).
 
         Raises:
             BgsException: If any of the YAML files are malformed or if there are issues reading
@@ -115,17 +579,16 @@ class SimpleMetadata(AbstractMetadata):
 
         # Load the artifacts, and set UUID for each artifact
         # (from the loaded UUIDs)
-        artifacts: List[models.Artifact] = self._load_artifacts(product)
-        for artifact in artifacts:
+        # (and record the file each artifact was loaded from)
+        artifacts: List[models.Artifact] = []
+        self.sources: Dict[str, str] = {}
+        for artifact, source in self._load_artifacts(product):
             artifact.uuid = self.artifact_uuids[artifact.name]
             artifact.productuuid = product.uuid
+            artifacts.append(artifact)
+            self.sources[artifact.uuid] = source
 
-        fqproduct = models.FQProduct(
-            product = product,
-            artifacts = artifacts
-        )
-
-        return fqproduct
+        return product, artifacts
 
 
     def _load_product(self):
@@ -135,7 +598,7 @@ class SimpleMetadata(AbstractMetadata):
         product: models.Product = None
         try:
             with open(fqpath, 'r') as f:
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=YamlLoader)
                 data = data["product"]
                 product = models.Product(**data)
         except yaml.YAMLError as e:
@@ -158,7 +621,7 @@ class SimpleMetadata(AbstractMetadata):
         with open(file_path, 'r') as f:
             try:
                 logger.info(f"Loading owner:{file_path}")
-                data = yaml.safe_load(f)
+                data = yaml.load(f, Loader=YamlLoader)
                 data = data["publisher"]
                 publisher = models.Publisher(**data)
             except yaml.YAMLError as e:
@@ -168,8 +631,13 @@ class SimpleMetadata(AbstractMetadata):
         return publisher
 
 
+    @tracing.traced("SimpleMetadata._load_artifacts")
     def _load_artifacts(self, product: models.Product):
-        artifacts: List[models.Artifact] = []
+        """
+        Return the artifacts, each with the path (relative to the
+        directory) of the file it was loaded from
+        """
+        artifacts: List[Tuple[models.Artifact, str]] = []
         for root, dirs, files in os.walk(self.directory):
             if root.endswith("artifacts"):
                 logger.info(f"Loading artifacts:{files}")
@@ -179,7 +647,7 @@ class SimpleMetadata(AbstractMetadata):
                         with open(file_path, 'r') as f:
                             try:
                                 logger.info(f"Loading artifact:{file_path}")
-                                data = yaml.safe_load(f)
+                                data = yaml.load(f, Loader=YamlLoader)
                                 data = data["artifact"]
                                 # logger.info(f"Loading data:{data}")
                                 # logger.info(f"Loading data:{json.dumps(data)}")
@@ -188,7 +656,7 @@ class SimpleMetadata(AbstractMetadata):
                                 artifact.productname = product.name
                                 artifact.createtimestamp = datetime.now().isoformat(sep=' ', timespec='milliseconds')
                                 artifact.updatetimestamp = artifact.createtimestamp
-                                artifacts.append(artifact)
+                                artifacts.append((artifact, os.path.relpath(file_path, self.directory)))
                             except yaml.YAMLError as e:
                                 msg = f"Error reading artifact YAML file:{file_path}: {e}"
                                 logger.error(msg, exc_info=True)
@@ -205,4 +673,3 @@ class SimpleMetadata(AbstractMetadata):
             return kwargs[name]
         else:
             raise ValueError(f"Mandatory keyword:{name} parameters:{kwargs}")
-
@@ -0,0 +1,270 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+import json
+import asyncio
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional
+
+import uvicorn
+
+import state
+from routemetrics import RouteMetrics
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+STATE_WORKER = "state-worker"
+
+DEFAULT_SLOT_SIZE = 1024 * 1024
+METRICS_PUBLISH_SECONDS = 1.0
+
+# Slot header: sequence number (odd while being written), payload length
+_HEADER = struct.Struct("QI")
+
+
+class MetricsSlots():
+    """
+    Shared memory holding one metrics slot per worker.
+
+    Each worker periodically writes a JSON copy of its
+    RouteMetrics (see RouteMetrics.to_dict) into its own slot,
+    and any worker can merge all slots to report metrics for
+    the whole pod. A sequence number guards each slot so that
+    a reader never uses a partially written payload.
+    """
+
+    def __init__(self, workers: int, slot_size: int = DEFAULT_SLOT_SIZE):
+        self.workers = workers
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=workers * slot_size)
+        self.shm.buf[:workers * slot_size] = bytes(workers * slot_size)
+
+    def publish(self, slot: int, metrics: RouteMetrics):
+        """
+        Write metrics into a worker's slot
+        """
+        payload = json.dumps(metrics.to_dict()).encode("utf-8")
+        if _HEADER.size + len(payload) > self.slot_size:
+            logger.warning(f"Metrics too large for slot:{slot} size:{len(payload)}")
+            return
+
+        offset = slot * self.slot_size
+        sequence, _ = _HEADER.unpack_from(self.shm.buf, offset)
+        _HEADER.pack_into(self.shm.buf, offset, sequence + 1, 0)
+        start = offset + _HEADER.size
+        self.shm.buf[start:start + len(payload)] = payload
+        _HEADER.pack_into(self.shm.buf, offset, sequence + 2, len(payload))
+
+    def read(self, slot: int) -> Optional[Dict]:
+        """
+        Read the metrics in a worker's slot (None if empty or
+        if a consistent copy could not be read)
+        """
+        offset = slot * self.slot_size
+        for _ in range(3):
+            sequence, length = _HEADER.unpack_from(self.shm.buf, offset)
+            if sequence % 2 == 1:
+                continue
+            if length == 0:
+                return None
+            start = offset + _HEADER.size
+            payload = bytes(self.shm.buf[start:start + length])
+            after, _ = _HEADER.unpack_from(self.shm.buf, offset)
+            if after == sequence:
+                return json.loads(payload)
+        logger.warning(f"Could not read consistent metrics for slot:{slot}")
+        return None
+
+    def aggregate(self, slot: int, metrics: RouteMetrics) -> RouteMetrics:
+        """
+        Return a new RouteMetrics merging this worker's live
+        metrics with the published metrics of all other workers
+        """
+        aggregated = RouteMetrics()
+        aggregated.merge(metrics.to_dict())
+        for other in range(self.workers):
+            if other == slot:
+                continue
+            data = self.read(other)
+            if data:
+                aggregated.merge(data)
+        return aggregated
+
+    def clear(self, slot: int):
+        offset = slot * self.slot_size
+        sequence, _ = _HEADER.unpack_from(self.shm.buf, offset)
+        _HEADER.pack_into(self.shm.buf, offset, sequence + 2, 0)
+
+    def close(self, unlink: bool = False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Worker():
+    """
+    Identity of the current worker process (held in global
+    state under STATE_WORKER in each worker)
+    """
+
+    def __init__(self, slot: int, slots: MetricsSlots):
+        self.slot = slot
+        self.slots = slots
+
+
+class Supervisor():
+    """
+    Pre-fork supervisor for serving with multiple worker processes.
+
+    Metadata is loaded (and the product registered) by the caller
+    before the supervisor is started, so every worker inherits
+    it copy-on-write when forked. The supervisor owns the listening
+    socket and runs the directory watcher; after each reload it
+    sends SIGHUP to the workers so they reload their metadata.
+    Workers that exit unexpectedly are replaced.
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int,
+                 watcher: Callable[[Callable[[], None]], None]):
+        """
+        Args:
+            app: ASGI application served by each worker
+            host, port: address to listen on
+            workers: number of worker processes
+            watcher: blocking function that watches for metadata
+                changes; it is passed a callback that must be
+                called after each reload
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.watcher = watcher
+        self.pids: Dict[int, int] = {}
+        self.stopping = False
+        self.sock: socket.socket = None
+        self.slots: MetricsSlots = None
+
+    def run(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+        self.slots = MetricsSlots(self.workers)
+        logger.info(f"Supervisor pid:{os.getpid()} listening on host:{self.host} port:{self.port} workers:{self.workers}")
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        thread = threading.Thread(target=self.watcher, args=(self.reload_workers,), daemon=True)
+        thread.start()
+
+        try:
+            self._monitor()
+        finally:
+            self.sock.close()
+            self.slots.close(unlink=True)
+            logger.info("Supervisor terminated")
+
+    def reload_workers(self):
+        """
+        Ask every worker to reload its metadata
+        """
+        for pid in list(self.pids):
+            logger.info(f"Signalling worker pid:{pid} to reload")
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, slot: int):
+        # Reloads are requested with SIGHUP: the worker starts with it
+        # blocked (so a reload requested while it starts is kept
+        # pending rather than lost) and unblocks it once its handler
+        # is installed (unblock_reloads())
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGHUP})
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                self.slots.clear(slot)
+                state.gstate(STATE_WORKER, Worker(slot, self.slots))
+                logger.info(f"Worker pid:{os.getpid()} slot:{slot} starting")
+                config = uvicorn.Config(self.app)
+                server = uvicorn.Server(config)
+                server.run(sockets=[self.sock])
+            except Exception as e:
+                logger.error(f"Worker pid:{os.getpid()} slot:{slot} failed, exception:{e}")
+                code = 1
+            finally:
+                os._exit(code)
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        self.pids[pid] = slot
+        logger.info(f"Spawned worker pid:{pid} slot:{slot}")
+
+    def _monitor(self):
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot = self.pids.pop(pid, None)
+            if slot is None:
+                continue
+            logger.warning(f"Worker pid:{pid} slot:{slot} exited, status:{status}")
+            if not self.stopping:
+                self._spawn(slot)
+
+    def _stop(self, signum, frame):
+        logger.info(f"Supervisor stopping, signal:{signum}")
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def worker() -> Optional[Worker]:
+    """
+    Return the current worker (None if not running under a Supervisor)
+    """
+    return state.gstate(STATE_WORKER)
+
+
+def unblock_reloads():
+    """
+    Deliver reload signals (SIGHUP) to this worker, including any
+    sent while it was starting; its handler must be installed
+    """
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGHUP})
+
+
+async def publish_metrics(get_metrics: Callable[[], RouteMetrics]):
+    """
+    Periodically publish this worker's metrics to its shared slot
+    """
+    current = worker()
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+        metrics = get_metrics()
+        if metrics:
+            current.slots.publish(current.slot, metrics)
@@ -0,0 +1,127 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import logging
+import os
+import functools
+import contextlib
+from typing import Dict, Optional
+
+from opentelemetry import trace
+from opentelemetry.propagate import inject
+
+import constants
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "osc-dm-product-srv"
+
+EXPORTER_NONE = "none"
+EXPORTER_CONSOLE = "console"
+EXPORTER_FILE = "file"
+DEFAULT_EXPORTER = EXPORTER_NONE
+DEFAULT_FILE = "./traces.jsonl"
+DEFAULT_SAMPLE_RATIO = 1.0
+
+ATTRIBUTE_CORRELATION_ID = "osc_dm.correlation_id"
+ATTRIBUTE_USERNAME = "osc_dm.username"
+
+# Until setup() installs a tracer provider, spans created
+# through this tracer are non-recording (no-ops)
+tracer = trace.get_tracer(SERVICE_NAME)
+
+
+def setup(configuration: Optional[Dict], app=None):
+    """
+    Configure tracing from the "tracing" section of the configuration:
+    - exporter: "none" (default), "console" or "file"
+    - file: file that spans are appended to (one JSON span per line)
+    - sample_ratio: fraction of traces to sample (default 1.0)
+
+    If an app is provided then each request is also traced.
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("tracing") or {}
+    exporter_name = config.get("exporter", DEFAULT_EXPORTER)
+    if exporter_name == EXPORTER_NONE:
+        logger.info("Tracing disabled")
+        return
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if exporter_name == EXPORTER_CONSOLE:
+        exporter = ConsoleSpanExporter(service_name=SERVICE_NAME)
+    elif exporter_name == EXPORTER_FILE:
+        filename = config.get("file", DEFAULT_FILE)
+        out = open(filename, "a")
+        exporter = ConsoleSpanExporter(
+            service_name=SERVICE_NAME, out=out,
+            formatter=lambda span: span.to_json(indent=None) + os.linesep)
+    else:
+        raise ValueError(f"Unknown tracing exporter:{exporter_name}")
+
+    sample_ratio = float(config.get("sample_ratio", DEFAULT_SAMPLE_RATIO))
+    sampler = ParentBased(TraceIdRatioBased(sample_ratio))
+    resource = Resource.create({"service.name": SERVICE_NAME})
+    provider = TracerProvider(resource=resource, sampler=sampler)
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled exporter:{exporter_name} sample_ratio:{sample_ratio}")
+
+    if app is not None:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app, tracer_provider=provider)
+
+
+def traced(name: str):
+    """
+    Decorator that runs the decorated function inside a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate_request(correlation_id: str, username: str):
+    """
+    Add the correlation id and username to the current request span
+    """
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_attribute(ATTRIBUTE_CORRELATION_ID, correlation_id)
+        span.set_attribute(ATTRIBUTE_USERNAME, username)
+
+
+@contextlib.contextmanager
+def client_span(method: str, url: str, headers: Optional[Dict]):
+    """
+    Run an outgoing HTTP request inside a span; trace
+    context (traceparent) is added to the request headers
+    """
+    attributes = {
+        "http.method": method,
+        "http.url": url,
+    }
+    if headers:
+        correlation_id = headers.get(constants.HEADER_CORRELATION_ID)
+        if correlation_id:
+            attributes[ATTRIBUTE_CORRELATION_ID] = correlation_id
+    with tracer.start_as_current_span(
+            f"HTTP {method}", kind=trace.SpanKind.CLIENT, attributes=attributes) as span:
+        if headers is not None:
+            inject(headers)
+        yield span
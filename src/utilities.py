@@ -11,11 +11,36 @@ import httpx
 import logging
 
 from bgsexception import BgsException, BgsNotFoundException
+import state
+import tracing
 
 LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 logger = logging.getLogger(__name__)
 
+STATE_HTTP_CLIENT = "http-client"
+HTTP_CLIENT_TIMEOUT = 30.0
+
+
+def http_client() -> httpx.AsyncClient:
+    """
+    Return the HTTP client shared by this process (created on
+    first use), which keeps connections to hosts open between
+    requests. It must only be used from the server's event loop.
+    """
+    client: httpx.AsyncClient = state.gstate(STATE_HTTP_CLIENT)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(follow_redirects=True, timeout=HTTP_CLIENT_TIMEOUT)
+        state.gstate(STATE_HTTP_CLIENT, client)
+    return client
+
+
+async def close_http_client():
+    client: httpx.AsyncClient = state.gstate(STATE_HTTP_CLIENT)
+    if client is not None:
+        await client.aclose()
+
+
 async def httprequest(host: str, port: int, service: str, method: str,
              data: Optional[Any]=None, obj: Optional[Dict]=None,
              files: Optional[Any]=None, headers: Optional[Dict]=None) -> Any:
@@ -42,10 +67,12 @@ async def httprequest(host: str, port: int, service: str, method: str,
         headers = {"Content-Type": "application/json"}
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(method, url, headers=headers, json=obj, data=data, files=files)
-            response.raise_for_status()
-            return response.json()
+        with tracing.client_span(method, url, headers) as span:
+            async with httpx.AsyncClient() as client:
+                response = await client.request(method, url, headers=headers, json=obj, data=data, files=files)
+                span.set_attribute("http.status_code", response.status_code)
+                response.raise_for_status()
+                return response.json()
 
     except httpx.HTTPStatusError as e:
         details = e.response.json().get("detail", str(e))
@@ -105,9 +132,11 @@ def shttprequest(host: str, port: int, service: str, method: str,
 
     try:
         import requests
-        response = requests.request(method, url, headers=headers, json=obj, data=data, files=files)
-        response.raise_for_status()
-        return response.json()
+        with tracing.client_span(method, url, headers) as span:
+            response = requests.request(method, url, headers=headers, json=obj, data=data, files=files)
+            span.set_attribute("http.status_code", response.status_code)
+            response.raise_for_status()
+            return response.json()
 
     except requests.HTTPError as e:
         details = e.response.json().get("detail", str(e))
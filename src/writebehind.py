@@ -0,0 +1,174 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+import artifactfiles
+import models
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(module)s:%(funcName)s %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELAY = 1.0
+DEFAULT_RETRY_SECONDS = 15.0
+
+# Pending files: path to the change number and the contents (an
+# artifact, the UUIDs, or None to remove the file)
+Contents = Optional[Union[models.Artifact, models.UUIDs]]
+Batch = "OrderedDict[str, Tuple[int, Contents]]"
+
+
+class WriteBehind():
+    """
+    Persists artifacts changed through the API to their YAML files
+    (and the UUIDs file) after the change is applied in memory.
+
+    Writes are batched: files are written delay seconds after the
+    first pending change, and pending changes to the same file are
+    coalesced (only the latest contents are written). Each file is
+    replaced atomically and recorded as a self write, so the
+    directory watcher does not reload for it. Batches that cannot be
+    written are retried every retry_seconds. Must be used from the
+    event loop thread (files are written in a worker thread).
+    """
+
+    def __init__(self, directory: str, delay: float = DEFAULT_DELAY,
+                 retry_seconds: float = DEFAULT_RETRY_SECONDS):
+        self.directory = directory
+        self.delay = delay
+        self.retry_seconds = retry_seconds
+        self.pending: Batch = OrderedDict()
+        # Number of the last change scheduled, and of the last change
+        # written to each file (older changes are never written after it)
+        self.changes = 0
+        self.written: Dict[str, int] = {}
+        self.available = asyncio.Event()
+        # Held while a batch is written (by the task or flush())
+        self.lock = threading.Lock()
+        self.task: asyncio.Task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(f"Write-behind started directory:{self.directory} delay:{self.delay}")
+
+    def stop(self):
+        """
+        Stop, writing pending changes (once, without retrying)
+        """
+        if self.task:
+            self.task.cancel()
+        self.flush()
+
+    def schedule(self, path: str, artifact: Optional[models.Artifact]):
+        """
+        Write an artifact to its file (path relative to the
+        directory), or remove the file if artifact is None
+        """
+        self._put(path, artifact)
+
+    def schedule_uuids(self, uuids: models.UUIDs):
+        self._put(artifactfiles.UUIDS_FILENAME, uuids)
+
+    def new_path(self) -> str:
+        """
+        Return the path (relative to the directory) of a
+        new artifact file, not yet written nor pending
+        """
+        artifacts_dir = os.path.join(self.directory, artifactfiles.ARTIFACTS_DIR)
+        taken = [os.path.basename(path) for path in self.pending]
+        filename = artifactfiles.next_artifact_filename(artifacts_dir, taken)
+        return os.path.join(artifactfiles.ARTIFACTS_DIR, filename)
+
+    def flush(self):
+        """
+        Write pending changes now (blocking), for example before
+        the files are read again; failed writes are left pending
+        """
+        if not self.pending:
+            return
+        batch = self._take()
+        try:
+            self._write(batch)
+        except Exception as e:
+            logger.error(f"Could not write pending files:{len(batch)}, exception:{e}")
+            self._requeue(batch)
+
+    def _put(self, path: str, contents: Contents):
+        self.changes += 1
+        self.pending.pop(path, None)
+        self.pending[path] = (self.changes, contents)
+        self.available.set()
+
+    def _take(self) -> Batch:
+        batch = self.pending
+        self.pending = OrderedDict()
+        return batch
+
+    def _write(self, batch: Batch):
+        with self.lock:
+            while batch:
+                path, (change, contents) = next(iter(batch.items()))
+                fqpath = os.path.join(self.directory, path)
+                if contents is None:
+                    artifactfiles.remove(fqpath)
+                    logger.info(f"Removed path:{path}")
+                elif isinstance(contents, models.UUIDs):
+                    artifactfiles.write_uuids(self.directory, contents)
+                else:
+                    artifactfiles.write_atomic(fqpath, artifactfiles.artifact_yaml(contents))
+                    logger.info(f"Wrote artifact uuid:{contents.uuid} path:{path}")
+                # Written files are not retried
+                del batch[path]
+                self.written[path] = change
+
+    def _requeue(self, batch: Batch):
+        """
+        Put back changes that could not be written, unless newer
+        changes to the same files are pending (or were written by
+        flush() meanwhile)
+        """
+        pending = self.pending
+        self.pending = OrderedDict(
+            (path, entry) for path, entry in batch.items()
+            if path not in pending and entry[0] > self.written.get(path, 0))
+        self.pending.update(pending)
+
+    async def _run(self):
+        while True:
+            await self.available.wait()
+            await asyncio.sleep(self.delay)
+            self.available.clear()
+            if not self.pending:
+                continue
+            batch = self._take()
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception as e:
+                logger.error(f"Could not write files:{len(batch)}, retry in (seconds):{self.retry_seconds}, exception:{e}")
+                self._requeue(batch)
+                await asyncio.sleep(self.retry_seconds)
+                self.available.set()
+
+
+def from_configuration(configuration: Optional[Dict], directory: str) -> WriteBehind:
+    """
+    Create a WriteBehind using the "persistence" section of the configuration:
+    - delay: seconds a change waits to be written with others (default 1)
+    - retry_seconds: seconds between attempts to write a batch (default 15)
+    """
+    config = {}
+    if configuration:
+        config = configuration.get("persistence") or {}
+    delay = float(config.get("delay", DEFAULT_DELAY))
+    retry_seconds = float(config.get("retry_seconds", DEFAULT_RETRY_SECONDS))
+    return WriteBehind(directory, delay, retry_seconds)
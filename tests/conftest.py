@@ -0,0 +1,27 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATAPRODUCTS = os.path.join(ROOT, "dataproducts")
+
+# Modules are imported from "src" (as the server does)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+@pytest.fixture
+def dataproducts(tmp_path) -> str:
+    """
+    A copy of the sample data product directory
+    """
+    directory = str(tmp_path / "dataproducts")
+    shutil.copytree(DATAPRODUCTS, directory)
+    return directory
@@ -0,0 +1,170 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import admission
+import state
+from middleware import HEADER_USERNAME
+
+UNLIMITED = admission.Limits(None, None, None)
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = admission.TokenBucket(rate=2.0, burst=3.0)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    # A token is available half a second later (and only one)
+    assert bucket.take(now + 0.5) == 0.0
+    assert bucket.take(now + 0.5) == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = admission.TokenBucket(rate=1.0, burst=2.0)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert not bucket.full(now)
+    assert bucket.full(now + 10)
+    bucket.take(now + 10)
+    assert bucket.tokens == pytest.approx(1.0)
+
+
+def test_token_bucket_give():
+    bucket = admission.TokenBucket(rate=1.0, burst=1.0)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.give()
+    assert bucket.take(now) == 0.0
+    bucket.give()
+    bucket.give()
+    assert bucket.tokens == 1.0
+
+
+def test_user_concurrency_limit():
+    controller = admission.AdmissionController(UNLIMITED, admission.Limits(2, None, None))
+    first, _ = controller.admit("alice")
+    controller.admit("alice")
+    _, rejection = controller.admit("alice")
+    assert rejection.status_code == 429
+    # Other users are not affected
+    assert controller.admit("bob")[1] is None
+    controller.release(first)
+    assert controller.admit("alice")[1] is None
+
+
+def test_process_concurrency_limit():
+    controller = admission.AdmissionController(admission.Limits(2, None, None), UNLIMITED)
+    controller.admit("alice")
+    controller.admit("bob")
+    _, rejection = controller.admit("carol")
+    assert rejection.status_code == 503
+    assert controller.inflight == 2
+
+
+def test_user_rate_limit():
+    controller = admission.AdmissionController(UNLIMITED, admission.Limits(None, 0.5, 1.0))
+    user, rejection = controller.admit("alice")
+    assert rejection is None
+    controller.release(user)
+    _, rejection = controller.admit("alice")
+    assert rejection.status_code == 429
+    assert rejection.retry_after == 2
+
+
+def test_process_rate_limit_returns_user_token():
+    controller = admission.AdmissionController(
+        admission.Limits(None, 1.0, 1.0), admission.Limits(None, 1.0, 2.0))
+    controller.admit("alice")
+    user, rejection = controller.admit("alice")
+    assert rejection.status_code == 503
+    # The user's token was given back (only the process was over its limit)
+    assert user.bucket.tokens == pytest.approx(1.0, abs=0.01)
+
+
+def test_user_overrides():
+    controller = admission.AdmissionController(
+        UNLIMITED, admission.Limits(1, None, None), users={"batch": admission.Limits(3, None, None)})
+    for _ in range(3):
+        assert controller.admit("batch")[1] is None
+    assert controller.admit("batch")[1].status_code == 429
+
+
+def test_users_are_bounded():
+    controller = admission.AdmissionController(UNLIMITED, admission.Limits(1, None, None), max_users=2)
+    controller.admit("alice")
+    controller.admit("bob")
+    # All users are busy, so new users share the overflow limits
+    assert controller.admit("carol")[1] is None
+    assert controller.admit("dave")[1].status_code == 429
+    assert set(controller.users) == {"alice", "bob", admission.OVERFLOW_KEY}
+
+
+def test_idle_users_are_forgotten():
+    controller = admission.AdmissionController(UNLIMITED, admission.Limits(1, None, None), max_users=2)
+    user, _ = controller.admit("alice")
+    controller.release(user)
+    controller.admit("bob")
+    controller.admit("carol")
+    assert set(controller.users) == {"bob", "carol"}
+
+
+def test_from_configuration():
+    controller = admission.from_configuration({"admission": {
+        "max_concurrent": 10,
+        "user_rate": 5,
+        "users": {"batch": {"rate": 0.5}},
+        "exempt": ["/health"],
+    }})
+    assert controller.enabled
+    assert controller.limits == admission.Limits(10, None, None)
+    assert controller.user_limits == admission.Limits(None, 5.0, 5.0)
+    assert controller.overrides["batch"] == admission.Limits(None, 0.5, 1.0)
+    assert controller.is_exempt("/api/dataproducts/health")
+    assert not controller.is_exempt("/metrics")
+
+
+def test_from_configuration_without_limits():
+    assert not admission.from_configuration(None).enabled
+    assert not admission.from_configuration({"admission": {}}).enabled
+
+
+def test_from_configuration_invalid_rate():
+    with pytest.raises(ValueError):
+        admission.from_configuration({"admission": {"rate": 0}})
+
+
+def test_middleware_rejects_over_limit():
+    app = FastAPI()
+
+    @app.get("/artifacts")
+    async def artifacts():
+        return []
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    app.add_middleware(admission.AdmissionMiddleware)
+    state.gstate(admission.STATE_ADMISSION, admission.AdmissionController(
+        UNLIMITED, admission.Limits(None, 1.0, 1.0)))
+    try:
+        client = TestClient(app)
+        headers = {HEADER_USERNAME: "alice"}
+        assert client.get("/artifacts", headers=headers).status_code == 200
+        response = client.get("/artifacts", headers=headers)
+        assert response.status_code == 429
+        assert response.headers[admission.HEADER_RETRY_AFTER] == "1"
+        assert "alice" in response.json()["detail"]
+        # Exempt paths and other users are admitted
+        assert client.get("/health", headers=headers).status_code == 200
+        assert client.get("/artifacts", headers={HEADER_USERNAME: "bob"}).status_code == 200
+        assert state.gstate(admission.STATE_ADMISSION).inflight == 0
+    finally:
+        state.gstate(admission.STATE_ADMISSION, None)
@@ -0,0 +1,67 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import tracemalloc
+
+import csvprofile
+
+
+def _write_csv(tmp_path, lines) -> str:
+    fqpath = str(tmp_path / "data.csv")
+    with open(fqpath, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return fqpath
+
+
+def _columns(fqpath: str, **kwargs):
+    rows, columns = csvprofile.profile(fqpath, **kwargs)
+    return rows, {column.name: column for column in columns}
+
+
+def test_profile_column_types_and_nulls(tmp_path):
+    fqpath = _write_csv(tmp_path, [
+        "id,price,name",
+        "1, 2.5 ,alpha",
+        "2,NA,beta",
+        "3,4,",
+        "4,1e1,alpha",
+    ])
+    rows, columns = _columns(fqpath)
+    assert rows == 4
+    assert (columns["id"].type, columns["id"].min, columns["id"].max) == (csvprofile.TYPE_INTEGER, 1, 4)
+    assert (columns["price"].type, columns["price"].nulls) == (csvprofile.TYPE_FLOAT, 1)
+    assert (columns["price"].min, columns["price"].max) == (2.5, 10.0)
+    assert columns["name"].type == csvprofile.TYPE_STRING
+    assert (columns["name"].nulls, columns["name"].distinct) == (1, 2)
+    assert (columns["name"].min, columns["name"].max) == ("alpha", "beta")
+    assert columns["id"].histogram.counts == [1, 0, 0, 1, 0, 0, 1, 0, 0, 1]
+
+
+def test_profile_long_value_memory(tmp_path):
+    # One 100KB value among many short ones: a fixed-width array of
+    # the chunk would take rows x 100KB x 4 bytes (800MB here)
+    rows = 2000
+    lines = ["id,text"] + [f"{i},short" for i in range(rows - 1)] + [f"{rows},{'x' * 100 * 1000}"]
+    fqpath = _write_csv(tmp_path, lines)
+
+    tracemalloc.start()
+    try:
+        count, columns = _columns(fqpath, chunk_rows=rows)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert count == rows
+    assert columns["text"].type == csvprofile.TYPE_STRING
+    assert columns["text"].distinct == 2
+    assert columns["id"].type == csvprofile.TYPE_INTEGER
+    assert peak < 32 * 1024 * 1024
+
+
+def test_profile_long_value_is_a_string(tmp_path):
+    fqpath = _write_csv(tmp_path, ["value", "1", "2", "1" * (csvprofile.MAX_NUMBER_LENGTH + 1)])
+    _, columns = _columns(fqpath)
+    assert columns["value"].type == csvprofile.TYPE_STRING
+    assert columns["value"].histogram is None
@@ -0,0 +1,271 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import os
+
+import httpx
+import pytest
+
+import downloadcache
+from bgsexception import BgsException
+
+URL = "http://origin/data.csv"
+OTHER_URL = "http://origin/other.csv"
+
+
+class Origin():
+    """
+    Serves "content" for every url (with an ETag) and
+    answers conditional requests with 304 when unchanged
+    """
+
+    def __init__(self, content: bytes = b"0123456789", delay: float = 0.0):
+        self.content = content
+        self.etag = '"1"'
+        self.delay = delay
+        self.requests = []
+        self.down = False
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        await asyncio.sleep(self.delay)
+        if self.down:
+            raise httpx.ConnectError("origin is down", request=request)
+        if request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=self.content,
+                              headers={"ETag": self.etag, "Content-Type": "text/csv"})
+
+
+def _cache(tmp_path, origin: Origin, **kwargs) -> downloadcache.DownloadCache:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(origin.handler))
+    return downloadcache.DownloadCache(lambda: client, str(tmp_path), **kwargs)
+
+
+def _read(entry: downloadcache.Entry) -> bytes:
+    with open(entry.path, "rb") as f:
+        return f.read()
+
+
+def test_get_downloads_once_for_concurrent_requests(tmp_path):
+    origin = Origin(delay=0.05)
+    cache = _cache(tmp_path, origin)
+
+    async def main():
+        return await asyncio.gather(*[cache.get(URL) for _ in range(5)])
+
+    entries = asyncio.run(main())
+    assert len(origin.requests) == 1
+    assert all(entry is entries[0] for entry in entries)
+    assert _read(entries[0]) == origin.content
+    assert entries[0].etag == origin.etag
+    assert entries[0].content_type == "text/csv"
+    assert not cache.inflight
+
+
+def test_get_serves_fresh_entry_without_request(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin)
+
+    async def main():
+        await cache.get(URL)
+        await cache.get(URL)
+
+    asyncio.run(main())
+    assert len(origin.requests) == 1
+
+
+def test_get_revalidates_stale_entry(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin, max_age=0)
+
+    async def main():
+        first = await cache.get(URL)
+        second = await cache.get(URL)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert len(origin.requests) == 2
+    assert origin.requests[1].headers["If-None-Match"] == origin.etag
+    # Not modified: the cached download is kept
+    assert second is first
+    assert _read(second) == origin.content
+
+
+def test_get_downloads_modified_entry(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin, max_age=0)
+
+    async def main():
+        await cache.get(URL)
+        origin.content, origin.etag = b"changed", '"2"'
+        return await cache.get(URL)
+
+    entry = asyncio.run(main())
+    assert _read(entry) == b"changed"
+    assert entry.etag == '"2"'
+    assert cache.size == len(b"changed")
+
+
+def test_get_serves_stale_entry_if_origin_is_down(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin, max_age=0)
+
+    async def main():
+        first = await cache.get(URL)
+        origin.down = True
+        return first, await cache.get(URL)
+
+    first, second = asyncio.run(main())
+    assert second is first
+
+
+def test_get_raises_if_origin_is_down_and_not_cached(tmp_path):
+    origin = Origin()
+    origin.down = True
+    cache = _cache(tmp_path, origin)
+    with pytest.raises(BgsException):
+        asyncio.run(cache.get(URL))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin, max_bytes=25)
+
+    async def main():
+        first = await cache.get(URL)
+        await cache.get(OTHER_URL)
+        # Used again, so the other download is the least recently used
+        await cache.get(URL)
+        third = await cache.get("http://origin/third.csv")
+        return first, third
+
+    first, third = asyncio.run(main())
+    assert set(cache.entries) == {downloadcache._key(URL), downloadcache._key("http://origin/third.csv")}
+    assert cache.size == 20
+    assert os.path.exists(first.path)
+    assert not os.path.exists(os.path.join(str(tmp_path), downloadcache._key(OTHER_URL) + downloadcache.DATA_SUFFIX))
+    assert _read(third) == origin.content
+
+
+def test_get_file_gets_evicted_download_again(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin)
+    get = cache.get
+    evicted = []
+
+    async def get_then_evict(url):
+        # Another request evicts the download before this one opens it
+        entry = await get(url)
+        if not evicted:
+            evicted.append(cache.entries.pop(downloadcache._key(url)))
+            cache.size -= entry.size
+            os.remove(entry.path)
+        return entry
+
+    cache.get = get_then_evict
+
+    async def main():
+        return await cache.get_file(URL)
+
+    entry, f = asyncio.run(main())
+    with f:
+        assert f.read() == origin.content
+    assert len(origin.requests) == 2
+    assert cache.entries[downloadcache._key(URL)] is entry
+
+
+def test_loads_entries_of_previous_run(tmp_path):
+    origin = Origin()
+    asyncio.run(_cache(tmp_path, origin).get(URL))
+
+    cache = _cache(tmp_path, origin)
+    entry = asyncio.run(cache.get(URL))
+    assert len(origin.requests) == 1
+    assert cache.size == len(origin.content)
+    assert _read(entry) == origin.content
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-3", (0, 3)),
+    ("bytes=5-", (5, 9)),
+    ("bytes=-4", (6, 9)),
+    ("bytes=-20", (0, 9)),
+    ("bytes=2-100", (2, 9)),
+    ("bytes=0-1,4-5", None),
+    ("items=0-1", None),
+    ("bytes=-", None),
+])
+def test_byte_range(header, expected):
+    assert downloadcache.byte_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10-", "bytes=5-2", "bytes=-0"])
+def test_byte_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        downloadcache.byte_range(header, 10)
+
+
+def test_get_does_not_cache_download_too_large(tmp_path):
+    origin = Origin(content=b"abc")
+    cache = _cache(tmp_path, origin, max_bytes=25, max_object_bytes=5)
+
+    async def main():
+        await cache.get(OTHER_URL)
+        origin.content = b"0123456789"
+        with pytest.raises(downloadcache.DownloadTooLarge):
+            await cache.get(URL)
+
+    asyncio.run(main())
+    # Cached downloads are kept (not evicted for it)
+    assert list(cache.entries) == [downloadcache._key(OTHER_URL)]
+    assert cache.size == 3
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_get_stops_streaming_download_too_large(tmp_path):
+    async def chunks():
+        for _ in range(10):
+            yield b"x" * 10
+
+    async def handler(request):
+        # No Content-Length: the size is only known while streaming
+        return httpx.Response(200, content=chunks())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    cache = downloadcache.DownloadCache(lambda: client, str(tmp_path), max_bytes=50)
+    with pytest.raises(downloadcache.DownloadTooLarge):
+        asyncio.run(cache.get(URL))
+    assert not cache.entries
+    assert cache.size == 0
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_get_removes_cached_copy_grown_too_large(tmp_path):
+    origin = Origin()
+    cache = _cache(tmp_path, origin, max_bytes=20, max_age=0)
+
+    async def main():
+        await cache.get(URL)
+        origin.content, origin.etag = b"x" * 30, '"2"'
+        with pytest.raises(downloadcache.DownloadTooLarge):
+            await cache.get(URL)
+
+    asyncio.run(main())
+    assert not cache.entries
+    assert cache.size == 0
+
+
+def test_get_writes_large_download_in_parts(tmp_path):
+    content = bytes(range(256)) * (3 * downloadcache.WRITE_BYTES // 256 + 7)
+    origin = Origin(content=content)
+    cache = _cache(tmp_path, origin)
+    entry = asyncio.run(cache.get(URL))
+    assert entry.size == len(content)
+    assert _read(entry) == content
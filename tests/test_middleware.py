@@ -0,0 +1,23 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from starlette.datastructures import Headers
+
+import middleware
+from admin import HEADER_ADMIN_TOKEN
+
+
+def test_logged_headers_redacts_credentials():
+    headers = Headers(raw=[
+        (HEADER_ADMIN_TOKEN.lower().encode(), b"secret"),
+        (b"authorization", b"Bearer secret"),
+        (b"cookie", b"session=secret"),
+        (b"osc-dm-username", b"alice"),
+    ])
+    logged = middleware._logged_headers(headers)
+    assert "secret" not in str(logged)
+    assert logged[HEADER_ADMIN_TOKEN.lower()] == middleware.REDACTED
+    assert logged["osc-dm-username"] == "alice"
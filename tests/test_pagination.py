@@ -0,0 +1,149 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import pagination
+import simplemetadata
+
+
+def _items(*names):
+    return [SimpleNamespace(uuid=f"uuid-{name}", name=name) for name in names]
+
+
+def _pages(order: pagination.SortOrder, limit: int, descending: bool = False):
+    """
+    Return the names on each page, following the cursors
+    """
+    pages = []
+    after = None
+    while True:
+        items, after = order.page(limit, after, descending)
+        pages.append([item.name for item in items])
+        if after is None:
+            return pages
+
+
+def test_page_ascending():
+    order = pagination.SortOrder("name", _items("c", "a", "e", "b", "d"))
+    assert _pages(order, 2) == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_page_descending():
+    order = pagination.SortOrder("name", _items("c", "a", "e", "b", "d"))
+    assert _pages(order, 2, descending=True) == [["e", "d"], ["c", "b"], ["a"]]
+
+
+def test_page_exact_fit_has_no_cursor():
+    order = pagination.SortOrder("name", _items("a", "b"))
+    assert order.page(2) == (order.items, None)
+    assert order.page(2, descending=True)[1] is None
+
+
+def test_page_ties_broken_by_uuid():
+    items = [SimpleNamespace(uuid=f"uuid-{i}", name="same") for i in range(5)]
+    order = pagination.SortOrder("name", items)
+    seen = []
+    after = None
+    while True:
+        page, after = order.page(2, after)
+        seen.extend(item.uuid for item in page)
+        if after is None:
+            break
+    assert seen == sorted(item.uuid for item in items)
+
+
+def test_page_missing_values_sort_first():
+    items = _items("b", "a") + [SimpleNamespace(uuid="uuid-none", name=None)]
+    order = pagination.SortOrder("name", items)
+    assert [item.uuid for item in order.page(3)[0]] == ["uuid-none", "uuid-a", "uuid-b"]
+
+
+def test_cursor_still_valid_after_changes():
+    order = pagination.SortOrder("name", _items("a", "b", "c", "d"))
+    _, after = order.page(2)
+    # "b" (the last item returned) is removed and an item is added
+    # before the cursor: the next page continues after "b"
+    order = pagination.SortOrder("name", _items("a", "aa", "c", "d", "e"))
+    items, after = order.page(2, after)
+    assert [item.name for item in items] == ["c", "d"]
+    assert after is not None
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor("-name", ("Employees", "uuid-1"))
+    assert "=" not in cursor
+    assert pagination.decode_cursor(cursor, "-name") == ("Employees", "uuid-1")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not a cursor!",
+    pagination.encode_cursor("name", ("a", "b"))[:-2],
+    "e30",  # {}
+])
+def test_decode_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, "name")
+
+
+def test_decode_cursor_for_other_sort():
+    cursor = pagination.encode_cursor("name", ("a", "uuid-a"))
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, "-name")
+
+
+@pytest.mark.parametrize("sort, expected", [
+    (None, ("name", False)),
+    ("name", ("name", False)),
+    ("-updatetimestamp", ("updatetimestamp", True)),
+])
+def test_parse_sort(sort, expected):
+    assert pagination.parse_sort(sort) == expected
+
+
+@pytest.mark.parametrize("sort", ["description", "--name", "-"])
+def test_parse_invalid_sort(sort):
+    with pytest.raises(ValueError):
+        pagination.parse_sort(sort)
+
+
+def test_check_limit():
+    assert pagination.check_limit(None) == pagination.DEFAULT_LIMIT
+    assert pagination.check_limit(pagination.MAX_LIMIT) == pagination.MAX_LIMIT
+    for limit in [0, -1, pagination.MAX_LIMIT + 1]:
+        with pytest.raises(ValueError):
+            pagination.check_limit(limit)
+
+
+@pytest.mark.parametrize("sort", ["name", "-name", "createtimestamp"])
+def test_artifacts_page_returns_every_artifact_once(dataproducts, sort):
+    metadata = simplemetadata.SimpleMetadata(directory=dataproducts)
+    metadata.load()
+    expected = [artifact.uuid for artifact in metadata.artifacts()]
+
+    uuids = []
+    cursor = None
+    while True:
+        data, cursor = metadata.artifacts_page(limit=4, cursor=cursor, sort=sort)
+        page = json.loads(data)
+        assert 0 < len(page) <= 4
+        uuids.extend(artifact["uuid"] for artifact in page)
+        if cursor is None:
+            break
+    assert sorted(uuids) == sorted(expected)
+    assert len(uuids) == len(expected)
+
+
+def test_artifacts_page_fields(dataproducts):
+    metadata = simplemetadata.SimpleMetadata(directory=dataproducts)
+    metadata.load()
+    data, _ = metadata.artifacts_page(limit=2, fields=["uuid", "name"])
+    page = json.loads(data)
+    assert [set(artifact) for artifact in page] == [{"uuid", "name"}] * 2
+    assert page[0]["name"] <= page[1]["name"]
@@ -0,0 +1,45 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+
+import pytest
+
+import simplemetadata
+
+
+@pytest.fixture
+def metadata(dataproducts) -> simplemetadata.SimpleMetadata:
+    metadata = simplemetadata.SimpleMetadata(directory=dataproducts)
+    metadata.load()
+    return metadata
+
+
+def test_artifacts_json_projection(metadata):
+    artifacts = json.loads(metadata.artifacts_json(["uuid", "name"]))
+    assert [list(artifact) for artifact in artifacts] == [["uuid", "name"]] * len(artifacts)
+    assert [artifact["uuid"] for artifact in artifacts] == [record.uuid for record in metadata.artifacts()]
+
+
+def test_projections_limited_by_bytes(metadata, monkeypatch):
+    uuid_size = len(metadata.artifacts_json(["uuid"]))
+    both_size = len(metadata.artifacts_json(["uuid", "name"]))
+    metadata._projections.clear()
+    monkeypatch.setattr(simplemetadata, "MAX_PROJECTION_BYTES", uuid_size + both_size)
+
+    metadata.artifacts_json(["uuid"])
+    metadata.artifacts_json(["name"])
+    # Using "uuid" again makes "name" the least recently used
+    metadata.artifacts_json(["uuid"])
+    metadata.artifacts_json(["uuid", "name"])
+    assert [sorted(include) for include in metadata._projections] == [["uuid"], ["name", "uuid"]]
+
+
+def test_projection_larger_than_limit_is_not_kept(metadata, monkeypatch):
+    monkeypatch.setattr(simplemetadata, "MAX_PROJECTION_BYTES", 10)
+    data = metadata.artifacts_json(["uuid", "name"])
+    assert json.loads(data)
+    assert not metadata._projections
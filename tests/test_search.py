@@ -0,0 +1,92 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+from types import SimpleNamespace
+
+import yaml
+
+from facets import FACET_LICENSE, FACET_TAGS, FacetIndex
+from prefixindex import PrefixIndex
+from simplemetadata import SimpleMetadata
+
+
+def test_prefix_index_ranks_by_count():
+    index = PrefixIndex(["Sales", "salary", "Sales", "Costs"])
+    assert index.complete("sa", 10) == [("Sales", 2), ("salary", 1)]
+    assert index.complete("x", 10) == []
+
+
+def test_prefix_index_add_and_remove():
+    index = PrefixIndex(["Sales"])
+    index.add("Salary")
+    index.remove("sales")
+    assert index.complete("sa", 10) == [("Salary", 1)]
+    assert len(index) == 1
+
+
+def test_prefix_index_copy_leaves_original_unchanged():
+    index = PrefixIndex(["Customer Sales", "Costs"])
+    copy = index.copy()
+    copy.remove("Customer Sales")
+    copy.add("Customers")
+    assert index.complete("cust", 10) == [("Customer Sales", 1)]
+    assert copy.complete("cust", 10) == [("Customers", 1)]
+
+
+def test_facet_index_counts():
+    index = FacetIndex([_artifact("a", ["x", "y"], "MIT"), _artifact("b", ["x"], "CC0")])
+    total, counts = index.counts([FACET_TAGS, FACET_LICENSE])
+    assert total == 2
+    assert counts == {FACET_TAGS: {"x": 2, "y": 1}, FACET_LICENSE: {"CC0": 1, "MIT": 1}}
+    total, counts = index.counts([FACET_TAGS], {FACET_LICENSE: ["MIT"]})
+    assert (total, counts) == (1, {FACET_TAGS: {"x": 1, "y": 1}})
+
+
+def test_facet_index_copy_leaves_original_unchanged():
+    a, b = _artifact("a", ["x"], "MIT"), _artifact("b", ["x"], "MIT")
+    index = FacetIndex([a, b])
+    copy = index.copy()
+    copy.remove(a)
+    copy.add(_artifact("a", ["z"], "CC0"))
+    assert index.counts([FACET_TAGS, FACET_LICENSE])[1] == {FACET_TAGS: {"x": 2}, FACET_LICENSE: {"MIT": 2}}
+    assert copy.counts([FACET_TAGS, FACET_LICENSE])[1] == {FACET_TAGS: {"x": 1, "z": 1}, FACET_LICENSE: {"CC0": 1, "MIT": 1}}
+    # Copies of copies share sets too
+    second = copy.copy()
+    second.remove(b)
+    assert copy.counts([FACET_TAGS])[1] == {FACET_TAGS: {"x": 1, "z": 1}}
+    assert second.counts([FACET_TAGS])[1] == {FACET_TAGS: {"z": 1}}
+
+
+def _artifact(uuid, tags, license):
+    return SimpleNamespace(uuid=uuid, tags=tags, license=license, securitypolicy="public")
+
+
+def test_load_leaves_previous_metadata_unchanged(dataproducts):
+    previous = SimpleMetadata(directory=dataproducts)
+    previous.load()
+    record = next(record for record in previous.artifacts() if record.name == "Customer Sales")
+    before = (previous.complete("cust"), previous.facets())
+
+    fqpath = os.path.join(dataproducts, previous.source(record.uuid))
+    with open(fqpath, "r") as f:
+        data = yaml.safe_load(f)
+    data["artifact"]["name"] = "Renamed Sales"
+    data["artifact"]["license"] = "Changed License"
+    with open(fqpath, "w") as f:
+        yaml.safe_dump(data, f)
+    fqpath = os.path.join(dataproducts, "uuids.yaml")
+    with open(fqpath, "r") as f:
+        uuids = f.read()
+    with open(fqpath, "w") as f:
+        f.write(uuids.replace("Customer Sales:", "Renamed Sales:"))
+    metadata = SimpleMetadata(directory=dataproducts)
+    metadata.load(previous)
+
+    assert metadata.changes().modified == [record.uuid]
+    assert (previous.complete("cust"), previous.facets()) == before
+    assert metadata.complete("cust") != before[0]
+    assert metadata.facets().facets["license"]["Changed License"] == 1
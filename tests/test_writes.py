@@ -0,0 +1,201 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import asyncio
+import os
+
+import pytest
+import yaml
+
+import artifactfiles
+import models
+import simplemetadata
+import writebehind
+from bgsexception import BgsException, BgsNotFoundException
+
+NEW_UUID = "00000000-0000-0000-0000-000000000001"
+
+
+@pytest.fixture
+def metadata(dataproducts) -> simplemetadata.SimpleMetadata:
+    metadata = simplemetadata.SimpleMetadata(directory=dataproducts)
+    metadata.load()
+    return metadata
+
+
+def _first(metadata: simplemetadata.SimpleMetadata) -> models.Artifact:
+    return metadata.query(artifact=next(iter(metadata.artifacts())).uuid)
+
+
+def _artifact(name: str, uuid: str = NEW_UUID) -> models.Artifact:
+    return models.Artifact(uuid=uuid, name=name, description="A new artifact", tags=["new"],
+                           license="MIT", securitypolicy="public", links=[])
+
+
+def _read_yaml(fqpath: str):
+    with open(fqpath, "r") as f:
+        return yaml.safe_load(f)
+
+
+def test_apply_adds_artifact(metadata):
+    path = os.path.join(artifactfiles.ARTIFACTS_DIR, "artifacts-999.yaml")
+    applied = metadata.apply(upserts=[_artifact("New")], sources={NEW_UUID: path})
+
+    changes = applied.changes()
+    assert changes.version == metadata.changes().version + 1
+    assert (changes.added, changes.modified, changes.removed) == ([NEW_UUID], [], [])
+    artifact = applied.query(artifact=NEW_UUID)
+    assert artifact.productuuid == metadata.product().uuid
+    assert artifact.createtimestamp == artifact.updatetimestamp
+    assert applied.source(NEW_UUID) == path
+    assert list(applied.uuids().artifact_uuids[-1].items()) == [("New", NEW_UUID)]
+    # The previous metadata is unchanged
+    assert metadata.query(artifact=NEW_UUID) is None
+    assert metadata.source(NEW_UUID) is None
+
+
+def test_apply_modifies_artifact(metadata):
+    old = _first(metadata)
+    applied = metadata.apply(upserts=[old.model_copy(update={"description": "Changed"})])
+
+    changes = applied.changes()
+    assert (changes.added, changes.modified, changes.removed) == ([], [old.uuid], [])
+    artifact = applied.query(artifact=old.uuid)
+    assert artifact.description == "Changed"
+    assert artifact.createtimestamp == old.createtimestamp
+    assert artifact.updatetimestamp != old.updatetimestamp
+    assert applied.source(old.uuid) == metadata.source(old.uuid)
+    # Not renamed: the UUIDs (and their order) are unchanged
+    assert applied.uuids() == metadata.uuids()
+
+
+def test_apply_renames_artifact(metadata):
+    old = _first(metadata)
+    applied = metadata.apply(upserts=[old.model_copy(update={"name": "Renamed"})])
+    names = {name: uuid for item in applied.uuids().artifact_uuids for name, uuid in item.items()}
+    assert names["Renamed"] == old.uuid
+    assert old.name not in names
+
+
+def test_apply_ignores_unchanged_artifact(metadata):
+    applied = metadata.apply(upserts=[_first(metadata)])
+    changes = applied.changes()
+    assert (changes.added, changes.modified, changes.removed) == ([], [], [])
+
+
+def test_apply_removes_artifact(metadata):
+    old = _first(metadata)
+    applied = metadata.apply(removals=[old.uuid])
+    assert applied.changes().removed == [old.uuid]
+    assert applied.query(artifact=old.uuid) is None
+    assert applied.source(old.uuid) is None
+    assert len(list(applied.artifacts())) == len(list(metadata.artifacts())) - 1
+
+
+def test_apply_remove_unknown_artifact(metadata):
+    with pytest.raises(BgsNotFoundException):
+        metadata.apply(removals=[NEW_UUID])
+
+
+def test_apply_name_already_used(metadata):
+    with pytest.raises(BgsException):
+        metadata.apply(upserts=[_artifact(_first(metadata).name)])
+
+
+def test_write_behind_coalesces_changes(metadata, dataproducts, monkeypatch):
+    writes = []
+    write_atomic = artifactfiles.write_atomic
+
+    def counting_write_atomic(fqpath, data):
+        writes.append(fqpath)
+        write_atomic(fqpath, data)
+
+    monkeypatch.setattr(artifactfiles, "write_atomic", counting_write_atomic)
+    writer = writebehind.WriteBehind(dataproducts)
+    old = _first(metadata)
+    path = metadata.source(old.uuid)
+    for description in ["First", "Second", "Third"]:
+        writer.schedule(path, old.model_copy(update={"description": description}))
+    writer.flush()
+
+    assert writes == [os.path.join(dataproducts, path)]
+    assert _read_yaml(os.path.join(dataproducts, path))["artifact"]["description"] == "Third"
+    assert not writer.pending
+
+
+def test_write_behind_writes_and_removes_files(metadata, dataproducts):
+    writer = writebehind.WriteBehind(dataproducts)
+    path = writer.new_path()
+    writer.schedule(path, _artifact("New"))
+    assert writer.new_path() != path
+    old = _first(metadata)
+    writer.schedule(metadata.source(old.uuid), None)
+    applied = metadata.apply(upserts=[_artifact("New")], removals=[old.uuid])
+    writer.schedule_uuids(applied.uuids())
+    writer.flush()
+
+    assert _read_yaml(os.path.join(dataproducts, path))["artifact"]["name"] == "New"
+    assert not os.path.exists(os.path.join(dataproducts, metadata.source(old.uuid)))
+    reloaded = simplemetadata.SimpleMetadata(directory=dataproducts)
+    reloaded.load()
+    assert reloaded.query(artifact=NEW_UUID).name == "New"
+    assert reloaded.query(artifact=old.uuid) is None
+
+
+def test_write_behind_keeps_failed_writes(metadata, dataproducts, monkeypatch):
+    def failing_write_atomic(fqpath, data):
+        raise OSError("disk full")
+
+    writer = writebehind.WriteBehind(dataproducts)
+    old = _first(metadata)
+    path = metadata.source(old.uuid)
+    writer.schedule(path, old.model_copy(update={"description": "Changed"}))
+    monkeypatch.setattr(artifactfiles, "write_atomic", failing_write_atomic)
+    writer.flush()
+    assert list(writer.pending) == [path]
+
+    monkeypatch.undo()
+    writer.flush()
+    assert not writer.pending
+    assert _read_yaml(os.path.join(dataproducts, path))["artifact"]["description"] == "Changed"
+
+
+def test_write_behind_requeue_keeps_newer_changes(metadata, dataproducts):
+    writer = writebehind.WriteBehind(dataproducts)
+    first, second = list(metadata.artifacts())[:2]
+    first_path, second_path = metadata.source(first.uuid), metadata.source(second.uuid)
+    writer.schedule(first_path, metadata.query(artifact=first.uuid))
+    writer.schedule(second_path, metadata.query(artifact=second.uuid))
+
+    # A batch being written fails after newer changes were made:
+    # one is pending and the other was already written by flush()
+    batch = writer._take()
+    writer.schedule(second_path, _artifact("Newer", second.uuid))
+    writer.flush()
+    writer.schedule(first_path, None)
+    writer._requeue(batch)
+
+    assert list(writer.pending) == [first_path]
+    assert writer.pending[first_path][1] is None
+    assert _read_yaml(os.path.join(dataproducts, second_path))["artifact"]["name"] == "Newer"
+
+
+def test_write_behind_task_writes_after_delay(metadata, dataproducts):
+    old = _first(metadata)
+    path = metadata.source(old.uuid)
+
+    async def main():
+        writer = writebehind.WriteBehind(dataproducts, delay=0.01)
+        writer.start()
+        writer.schedule(path, old.model_copy(update={"description": "Later"}))
+        await asyncio.sleep(0.2)
+        pending = dict(writer.pending)
+        writer.stop()
+        return pending
+
+    assert asyncio.run(main()) == {}
+    assert _read_yaml(os.path.join(dataproducts, path))["artifact"]["description"] == "Later"
+    assert artifactfiles.self_writes().is_self_write(os.path.join(dataproducts, path))